@@ -1,5 +1,5 @@
 # ----------------------------------------------------------------------------------------------------------------------
-#  Copyright (c) 2022-2024 Dimitri Kroon.
+#  Copyright (c) 2022-2025 Dimitri Kroon.
 #  This file is part of plugin.video.viwx.
 #  SPDX-License-Identifier: GPL-2.0-or-later
 #  See LICENSE.txt
@@ -9,22 +9,166 @@
 """
 A very simple key-value store.
 Stores data in volatile memory for the lifetime of the addon or the specified period.
+
+The memory cache is bounded by both a maximum number of items and an approximate
+number of bytes. When either limit is exceeded, the least recently used items are
+evicted. Expiry times are kept in a heap, so cleaning up only touches items that
+have actually expired.
+
+Items can be allowed to go stale for a while after they have expired. When such an
+item is requested through get_or_fetch(), the stale data is returned immediately,
+while the item is refreshed on a background thread.
+
+Items fetched conditionally keep the validators (ETag, Last-Modified) of the HTTP
+response they were created from. Such items are retained for a while after they
+have expired, so they can be revalidated. If the server reports the resource has
+not been modified, the lifetime of the cached item is just extended.
+
+Concurrent requests of an item through get_or_fetch() are coalesced: while the
+item is being fetched, other threads requesting the same key wait for that fetch
+and share its result, or its exception, instead of fetching it again.
+
+Hits, misses and evictions are counted per key prefix; see statistics().
+
+Items can be tagged, e.g. as being specific to the signed-in user, so that all
+items with a particular tag can be removed at once by invalidate().
+
+Data is normally copied on both storing and retrieving. Alternatively, data can be
+stored frozen - converted to read-only dicts and lists - in which case a cache hit
+returns the cached object itself, without any copying.
+
+Large items can be stored compressed, see set_compression(). Such items are
+held in memory as a compressed blob, and decompressed on each hit.
+
+Items can optionally be stored in a database in the addon's profile directory as
+well. These persistent items survive the end of the LanguageInvoker, or even a
+restart of Kodi, and are loaded back into memory on the first request after that.
 """
 
 
+import os
+import sys
+import json
+import zlib
 import time
+import heapq
+import pickle
+import marshal
+import sqlite3
 import logging
+import threading
 from copy import deepcopy
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+try:
+    import lzma
+except ImportError:
+    # Not all builds of Kodi's python include lzma.
+    lzma = None
 
 from codequick.support import logger_id
 
+from resources.lib import utils
+
 
 logger = logging.getLogger(logger_id + '.cache')
 # noinspection SpellCheckingInspection
 DFLT_EXPIRE_TIME = 600
+DB_FILE_NAME = 'cache.db'
+DB_SCHEMA_VERS = 5
+# Time in seconds after expiry during which items with validators are kept for revalidation.
+REVALIDATE_TIME = 7 * 86400
+
+DFLT_MAX_ITEMS = 500
+DFLT_MAX_BYTES = 64 * 1024 * 1024
+# Statistics of keys beyond this number of prefixes are collected under a single prefix.
+MAX_STATS_PREFIXES = 100
+OTHER_PREFIX = '<other>'
+# Maximum time in seconds to wait for another thread fetching the same key, after which
+# the waiting thread fetches the data itself.
+FLIGHT_TIMEOUT = 60
+
+# Tags of data specific to the signed-in user, the user's 'My List' and
+# recommendations based on the user's viewing history, respectively.
+TAG_USER = 'user'
+TAG_MYLIST = 'mylist'
+TAG_RECOMMENDED = 'recommended'
+
+# Name of the codec that stores data uncompressed.
+CODEC_PLAIN = 'pickle'
+DFLT_CODEC = 'zlib-pickle'
+# Data of items with an estimated size below this number of bytes is never compressed.
+DFLT_COMPRESS_THRESHOLD = 256 * 1024
+
+
+class _CacheItem:
+    __slots__ = ('data', 'stored', 'expires', 'stale_until', 'keep_until', 'size', 'frozen', 'validators', 'tags',
+                 'codec')
+
+    def __init__(self, data, stored, expires, stale_until, keep_until, size, frozen, validators, tags, codec):
+        self.data = data
+        self.stored = stored
+        self.expires = expires
+        self.stale_until = stale_until
+        self.keep_until = keep_until
+        self.size = size
+        self.frozen = frozen
+        self.validators = validators
+        self.tags = tags
+        # The codec by which data has been compressed, or None if data is not compressed.
+        self.codec = codec
+
+
+class _KeyStats:
+    __slots__ = ('hits', 'stale_hits', 'misses', 'evictions', 'age_at_hit')
+
+    def __init__(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.age_at_hit = 0.0
+
+
+class _Flight:
+    """A fetch in progress, which other threads requesting the same key can wait for."""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _NotModified:
+    def __repr__(self):
+        return 'NOT_MODIFIED'
+
 
+# Returned by conditional fetchers when the cached data is still valid.
+NOT_MODIFIED = _NotModified()
 
-__cache = {}
+
+# Items in order of use, the least recently used first.
+__cache = OrderedDict()
+# A heap of tuples (end of retention, key). Tuples of items that have been replaced
+# or evicted are not removed from the heap, but ignored when they are popped.
+_expiry_heap = []
+# Guards the memory cache against concurrent access from background refreshes.
+_lock = threading.RLock()
+# Fetches in progress, either in the foreground or in the background, per key.
+_in_flight = {}
+_revalidation = {'requests': 0, 'not_modified': 0}
+_limits = {'max_items': DFLT_MAX_ITEMS, 'max_bytes': DFLT_MAX_BYTES}
+_compression = {'codec': DFLT_CODEC, 'threshold': DFLT_COMPRESS_THRESHOLD}
+_resident = {'bytes': 0, 'evictions': 0}
+# Statistics per key prefix.
+_key_stats = {}
+# The keys of items in memory per tag.
+_tag_index = {}
+# The number of times each tag has been invalidated.
+_tag_generations = {}
 
 # A list of programmeId's of programmes currently present in itvX's 'My List'.
 # Used to determine whether to add an 'Add' or a 'Remove' option to a list
@@ -37,43 +181,836 @@ __cache = {}
 my_list_programmes = None
 
 
-def get_item(key):
-    """Return the cached data if present in the cache and not expired.
-    Return None otherwise.
+def _read_only(self, *args, **kwargs):
+    raise TypeError("'{}' object is read-only".format(type(self).__name__))
+
+
+class FrozenDict(dict):
+    """A read-only dict.
+
+    It's a subclass of dict, so it can be used everywhere a normal dict is expected,
+    but all methods that would change the dict raise TypeError.
+    """
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    """A read-only list.
+
+    Like FrozenDict, all methods that would change the list raise TypeError.
+    """
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def freeze(data):
+    """Return a read-only version of `data`.
+
+    Dicts and lists are recursively converted to FrozenDict and FrozenList. Data
+    that is already frozen is returned as is.
+    """
+    data_type = type(data)
+    if data_type in (FrozenDict, FrozenList):
+        return data
+    if isinstance(data, dict):
+        return FrozenDict((k, freeze(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return FrozenList(freeze(v) for v in data)
+    if data_type is tuple:
+        return tuple(freeze(v) for v in data)
+    return data
+
+
+def thaw(data):
+    """Return a mutable deep copy of frozen `data`."""
+    if isinstance(data, dict):
+        return {k: thaw(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [thaw(v) for v in data]
+    if type(data) is tuple:
+        return tuple(thaw(v) for v in data)
+    return data
+
+
+class Codec:
+    """Converts data to bytes and back.
+
+    Data is serialised by `dumps` and, if `compress` is given, the result is
+    compressed. Decoding reverses both steps.
+    """
+    __slots__ = ('name', '_dumps', '_loads', '_compress', '_decompress')
+
+    def __init__(self, name, dumps, loads, compress=None, decompress=None):
+        self.name = name
+        self._dumps = dumps
+        self._loads = loads
+        self._compress = compress
+        self._decompress = decompress
+
+    def encode(self, data):
+        blob = self._dumps(data)
+        return self._compress(blob) if self._compress else blob
+
+    def decode(self, blob):
+        return self._loads(self._decompress(blob) if self._decompress else blob)
+
+    def __repr__(self):
+        return "<Codec '{}'>".format(self.name)
+
+
+_codecs = {}
+
+
+def register_codec(name, dumps, loads, compress=None, decompress=None):
+    """Make a codec available under `name`. See Codec for the parameters."""
+    _codecs[name] = Codec(name, dumps, loads, compress, decompress)
+
+
+def codecs():
+    """Return the names of the available codecs."""
+    return list(_codecs)
+
+
+def _pickle_dumps(data):
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _marshal_dumps(data):
+    # Marshal only supports builtin types, not subclasses like FrozenDict.
+    return marshal.dumps(thaw(data))
+
+
+register_codec(CODEC_PLAIN, _pickle_dumps, pickle.loads)
+register_codec('zlib-pickle', _pickle_dumps, pickle.loads, zlib.compress, zlib.decompress)
+register_codec('zlib-marshal', _marshal_dumps, marshal.loads, zlib.compress, zlib.decompress)
+if lzma is not None:
+    register_codec('lzma-pickle', _pickle_dumps, pickle.loads, lzma.compress, lzma.decompress)
+    register_codec('lzma-marshal', _marshal_dumps, marshal.loads, lzma.compress, lzma.decompress)
+
+
+def _encode(key, codec, data):
+    """Return `data` encoded by `codec`, or None if `data` cannot be encoded."""
+    try:
+        return codec.encode(data)
+    except (pickle.PicklingError, TypeError, ValueError, AttributeError) as err:
+        logger.warning("Cannot encode '%s' with codec '%s': %r", key, codec.name, err)
+        return None
+
+
+class _DiskStore:
+    """The persistent tier of the cache.
+
+    Items are stored in an SQLite database as data encoded by a codec, together
+    with the name of that codec, whether the data is frozen, their expiry time,
+    the end of their stale period, the time until which they are retained, their
+    validators, if any, and their tags. Since time.monotonic() is meaningless
+    in another process, times on disk are wall clock times.
+
+    Any database error disables the disk store for the rest of the lifetime of
+    the addon, the memory cache continues to work as usual.
 
     """
-    item = __cache.get(key)
-    if item and item['expires'] > time.monotonic():
-        logger.debug("Data cache: hit")
-        return deepcopy(item['data'])
+    def __init__(self):
+        self._db = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        if self._db is None and not self._failed:
+            try:
+                self._db = self._open()
+            except (sqlite3.Error, OSError) as err:
+                logger.error("Disk cache disabled; failed to open database: %r", err)
+                self._failed = True
+        return self._db
+
+    @staticmethod
+    def _open():
+        profile_dir = utils.addon_info.profile
+        os.makedirs(profile_dir, exist_ok=True)
+        db = sqlite3.connect(os.path.join(profile_dir, DB_FILE_NAME), check_same_thread=False)
+        if db.execute('PRAGMA user_version').fetchone()[0] != DB_SCHEMA_VERS:
+            logger.info("Creating new disk cache, schema version %s", DB_SCHEMA_VERS)
+            db.execute('DROP TABLE IF EXISTS cache')
+            db.execute('CREATE TABLE cache (key TEXT PRIMARY KEY, expires REAL NOT NULL, '
+                       'stale_until REAL NOT NULL, keep_until REAL NOT NULL, validators TEXT, '
+                       "tags TEXT NOT NULL DEFAULT '', codec TEXT NOT NULL, frozen INTEGER NOT NULL, "
+                       'data BLOB NOT NULL)')
+            db.execute('PRAGMA user_version = {}'.format(DB_SCHEMA_VERS))
+            db.commit()
+        return db
+
+    def _execute(self, sql, *args):
+        """Execute a statement and return the first row of the result, if any.
+        Return None if the disk cache is not available.
+
+        """
+        with self._lock:
+            db = self.db
+            if db is None:
+                return None
+            try:
+                row = db.execute(sql, args).fetchone()
+                db.commit()
+                return row
+            except sqlite3.Error as err:
+                logger.error("Disk cache disabled; database error: %r", err)
+                self.close()
+                self._failed = True
+                return None
+
+    def get(self, key):
+        """Return a tuple (encoded data, codec name, frozen, remaining time to live, remaining time
+        to the end of the stale period, remaining retention time, validators, tags).
+        Return None if the item is not present or is no longer retained.
+
+        """
+        row = self._execute('SELECT expires, stale_until, keep_until, validators, tags, codec, frozen, data '
+                            'FROM cache WHERE key = ?', key)
+        if row is None:
+            return None
+        now = time.time()
+        keep_ttl = row[2] - now
+        if keep_ttl <= 0:
+            return None
+        try:
+            validators = json.loads(row[3]) if row[3] else None
+        except ValueError as err:
+            logger.warning("Failed to load '%s' from disk cache: %r", key, err)
+            self.delete(key)
+            return None
+        tags = tuple(row[4].strip('|').split('|')) if row[4] else ()
+        return row[7], row[5], bool(row[6]), row[0] - now, row[1] - now, keep_ttl, validators, tags
+
+    def set(self, key, blob, codec_name, frozen, expire_time, max_stale=0, validators=None, tags=()):
+        """Store data that has already been encoded by codec `codec_name`."""
+        expires, stale_until, keep_until = _lifetime(time.time(), expire_time, max_stale, validators)
+        # Tags are stored as '|tag1|tag2|' to be able to find them with instr().
+        self._execute('INSERT OR REPLACE INTO cache '
+                      '(key, expires, stale_until, keep_until, validators, tags, codec, frozen, data) '
+                      'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      key, expires, stale_until, keep_until, json.dumps(validators) if validators else None,
+                      '|{}|'.format('|'.join(tags)) if tags else '', codec_name, int(frozen), blob)
+
+    def renew(self, key, expire_time, max_stale, validators):
+        """Extend the lifetime of an item without rewriting its data."""
+        expires, stale_until, keep_until = _lifetime(time.time(), expire_time, max_stale, validators)
+        self._execute('UPDATE cache SET expires = ?, stale_until = ?, keep_until = ? WHERE key = ?',
+                      expires, stale_until, keep_until, key)
+
+    def delete(self, key):
+        self._execute('DELETE FROM cache WHERE key = ?', key)
+
+    def invalidate(self, tag):
+        self._execute('DELETE FROM cache WHERE instr(tags, ?) > 0', '|{}|'.format(tag))
+
+    def clean(self):
+        self._execute('DELETE FROM cache WHERE keep_until < ?', time.time())
+
+    def purge(self):
+        self._execute('DELETE FROM cache')
+
+    def stats(self):
+        """Return a dict with the number of items and the bytes of encoded data on disk."""
+        row = self._execute('SELECT COUNT(*), TOTAL(LENGTH(data)) FROM cache')
+        if row is None:
+            return {'available': False, 'items': 0, 'bytes': 0}
+        return {'available': True, 'items': row[0], 'bytes': int(row[1])}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+_disk = _DiskStore()
+
+
+def _lifetime(now, expire_time, max_stale, validators):
+    """Return a tuple of the times at which an item expires, at which its stale
+    period ends, and until which it is to be retained.
+
+    """
+    expires = now + expire_time
+    stale_until = expires + max_stale
+    keep_until = max(stale_until, expires + REVALIDATE_TIME) if validators else stale_until
+    return expires, stale_until, keep_until
+
+
+def _estimate_size(obj):
+    """Return the approximate number of bytes of memory used by `obj` and all objects it contains.
+
+    Dictionary keys are not counted, since JSON decoded data shares the key
+    objects between all dicts decoded from the same document.
+
+    """
+    getsizeof = sys.getsizeof
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        size += getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+def key_prefix(key):
+    """Return the prefix of `key` under which statistics are collected.
+
+    For URLs this is the host with at most two path segments, in which segments
+    that look like an ID or a programme slug, i.e. contain a digit or a dash,
+    are replaced by '*', like fetch.endpoint_of() does. For other keys it is the
+    key without a trailing '_<id>', e.g. 'mylist' for 'mylist_<user_id>'.
+    URLs can be preceded by a label and a space, like 'digest https://...', in
+    which case the label is part of the prefix.
+    """
+    scheme_end = key.find('://')
+    if scheme_end >= 0:
+        url_start = key.rfind(' ', 0, scheme_end) + 1
+        url = urlsplit(key[url_start:])
+        segments = ['*' if '-' in seg or any(c.isdigit() for c in seg) else seg
+                    for seg in url.path.split('/')[1:3]]
+        return key[:url_start] + '/'.join([url.netloc, *segments]).rstrip('/')
+    name, sep, tail = key.rpartition('_')
+    if sep and any(c.isdigit() for c in tail):
+        return name
+    return key
+
+
+def _stats_of(key):
+    prefix = key_prefix(key)
+    stats = _key_stats.get(prefix)
+    if stats is None:
+        if len(_key_stats) >= MAX_STATS_PREFIXES:
+            prefix = OTHER_PREFIX
+        stats = _key_stats.setdefault(prefix, _KeyStats())
+    return stats
+
+
+def _count_hit(key, item, now, stale=False):
+    stats = _stats_of(key)
+    if stale:
+        stats.stale_hits += 1
     else:
-        logger.debug("Data cache: miss")
+        stats.hits += 1
+    stats.age_at_hit += now - item.stored
+
+
+def _remove(key):
+    item = __cache.pop(key)
+    _resident['bytes'] -= item.size
+    for tag in item.tags:
+        keys = _tag_index.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _tag_index[tag]
+
+
+def _store(key, data, expire_time, max_stale=0, size=None, frozen=False, validators=None, tags=(), codec=None):
+    """Add data to the memory cache and evict the least recently used
+    items until the cache is within its limits again.
+
+    If `codec` is not None, `data` is the blob produced by that codec.
+    """
+    if size is None:
+        size = sys.getsizeof(data) if codec else _estimate_size(data)
+    now = time.monotonic()
+    item = _CacheItem(data, now, *_lifetime(now, expire_time, max_stale, validators),
+                      size, frozen, validators, tuple(tags), codec)
+    with _lock:
+        if key in __cache:
+            _remove(key)
+        __cache[key] = item
+        _resident['bytes'] += size
+        for tag in item.tags:
+            _tag_index.setdefault(tag, set()).add(key)
+        heapq.heappush(_expiry_heap, (item.keep_until, key))
+
+        max_items = _limits['max_items']
+        max_bytes = _limits['max_bytes']
+        while len(__cache) > max_items or _resident['bytes'] > max_bytes:
+            lru_key = next(iter(__cache))
+            if lru_key == key:
+                logger.warning("Item '%s' of %s bytes is too large for the memory cache", key, size)
+            else:
+                logger.debug("Evicted '%s' from the memory cache", lru_key)
+            _remove(lru_key)
+            _resident['evictions'] += 1
+            _stats_of(lru_key).evictions += 1
+
+        # Prevent the heap from growing indefinitely when items are often replaced.
+        if len(_expiry_heap) > 2 * len(__cache) + 100:
+            _expiry_heap[:] = [(itm.keep_until, k) for k, itm in __cache.items()]
+            heapq.heapify(_expiry_heap)
+    return item
+
+
+def _lookup(key):
+    """Return the cache item of `key` if it is present and still retained,
+    regardless of whether it has expired.
+
+    Items not present in memory are looked up in the disk cache, and if found
+    there, loaded into memory for the rest of their lifetime. Compressed data
+    remains compressed until it is actually used.
+
+    """
+    with _lock:
+        item = __cache.get(key)
+        if item is not None:
+            if item.keep_until > time.monotonic():
+                __cache.move_to_end(key)
+                return item
+            return None
+
+    disk_item = _disk.get(key)
+    if disk_item is None:
+        return None
+    blob, codec_name, frozen, ttl, stale_ttl, _, validators, tags = disk_item
+    codec = _codecs.get(codec_name)
+    if codec is None:
+        logger.warning("Cannot load '%s' from disk cache: unknown codec '%s'", key, codec_name)
+        _disk.delete(key)
+        return None
+    logger.debug("Data cache: loaded '%s' from disk", key)
+    if codec.name != CODEC_PLAIN:
+        return _store(key, blob, ttl, stale_ttl - ttl, frozen=frozen, validators=validators, tags=tags, codec=codec)
+    try:
+        data = codec.decode(blob)
+    except Exception as err:
+        # Intentionally broad, unpickling can raise almost anything.
+        logger.warning("Failed to load '%s' from disk cache: %r", key, err)
+        _disk.delete(key)
         return None
+    return _store(key, data, ttl, stale_ttl - ttl, frozen=frozen, validators=validators, tags=tags)
 
 
-def set_item(key, data, expire_time=DFLT_EXPIRE_TIME):
+class _DecodeError(Exception):
+    pass
+
+
+def _copy_out(key, item, copy):
+    """Return the data of a cache item as it is to be handed out to the caller.
+
+    Raise _DecodeError, after removing the item, if compressed data cannot be decoded.
+    """
+    if item.codec is not None:
+        try:
+            data = item.codec.decode(item.data)
+        except Exception as err:
+            # Intentionally broad, unpickling can raise almost anything.
+            logger.warning("Failed to decode '%s' with codec '%s': %r", key, item.codec.name, err)
+            with _lock:
+                if __cache.get(key) is item:
+                    _remove(key)
+            _disk.delete(key)
+            raise _DecodeError from err
+        # Freshly decoded data is a copy already.
+        if item.frozen:
+            return thaw(data) if copy else freeze(data)
+        return data
+    if item.frozen:
+        return thaw(item.data) if copy else item.data
+    else:
+        return deepcopy(item.data)
+
+
+def get_item(key, copy=False):
+    """Return the cached data if present in the cache and not expired.
+    Return None otherwise.
+
+    Items not present in memory are looked up in the disk cache, and if found
+    there, loaded into memory for the rest of their lifetime.
+
+    Frozen items are returned as is, unless `copy` is True, in which case a
+    mutable copy is returned. Other items are always returned as a copy.
+
+    """
+    item = _lookup(key)
+    now = time.monotonic()
+    if item and item.expires > now:
+        try:
+            data = _copy_out(key, item, copy)
+        except _DecodeError:
+            pass
+        else:
+            logger.debug("Data cache: hit '%s'", key)
+            _count_hit(key, item, now)
+            return data
+    logger.debug("Data cache: miss '%s'", key)
+    _stats_of(key).misses += 1
+    return None
+
+
+def set_item(key, data, expire_time=DFLT_EXPIRE_TIME, persistent=False, size=None, frozen=False, max_stale=0,
+             validators=None, tags=(), compress=False):
     """Cache `data` in memory for the lifetime of the addon, to a maximum of `expire_time` in seconds.
 
+    If `persistent` is True, the data is also written to the disk cache and
+    will be available to subsequent processes until it expires.
+
+    Optional parameter `size` is the memory used by `data` in bytes. If not
+    provided, it will be estimated.
+
+    If `frozen` is True, data is stored as a read-only structure (see freeze())
+    and subsequent hits return that very object, rather than a copy.
+
+    The item is kept in the cache for another `max_stale` seconds after it has
+    expired, to be used by get_or_fetch() while the item is being refreshed.
+
+    Items with `validators` are retained for REVALIDATE_TIME after they have expired.
+
+    `Tags` is an iterable of strings, see invalidate().
+
+    If `compress` is True and the size of data is at least the threshold set
+    by set_compression(), the data is kept compressed, both in memory and on disk,
+    and decompressed on each hit. Use this for large items that are used infrequently.
     """
-    item = dict(expires=time.monotonic() + expire_time,
-                data=deepcopy(data))
+    if compress:
+        if size is None:
+            size = _estimate_size(data)
+        codec = _codecs[_compression['codec']]
+        if size >= _compression['threshold']:
+            blob = _encode(key, codec, data)
+            if blob is not None:
+                logger.debug("cached '%s' compressed by '%s' from %s to %s bytes", key, codec.name, size, len(blob))
+                _store(key, blob, expire_time, max_stale, None, frozen, validators, tags, codec)
+                if persistent:
+                    _disk.set(key, blob, codec.name, frozen, expire_time, max_stale, validators, tags)
+                return
+        # Size has been estimated on data as provided, which may not be frozen yet.
+        size = None
+
+    data = freeze(data) if frozen else deepcopy(data)
     logger.debug("cached '%s'", key)
-    __cache[key] = item
+    _store(key, data, expire_time, max_stale, size, frozen, validators, tags)
+    if persistent:
+        blob = _encode(key, _codecs[CODEC_PLAIN], data)
+        if blob is not None:
+            _disk.set(key, blob, CODEC_PLAIN, frozen, expire_time, max_stale, validators, tags)
+
+
+def _renew(key, item, expire_time, max_stale, persistent):
+    """Extend the lifetime of an item that has been revalidated."""
+    _store(key, item.data, expire_time, max_stale, item.size, item.frozen, item.validators, item.tags, item.codec)
+    if persistent:
+        _disk.renew(key, expire_time, max_stale, item.validators)
+
+
+def _fetch(key, fetcher, item, expire_time, max_stale, conditional, kwargs):
+    """Call `fetcher` and cache the result. Return the cached data, or the
+    fetcher's result if that has not been cached.
+
+    A conditional fetcher is passed the validators of the cached item, if any,
+    and returns a tuple (data, validators), where data can be NOT_MODIFIED.
+
+    Results are not cached if any of the item's tags has been invalidated
+    while `fetcher` was running, e.g. when the user signed out meanwhile.
+    """
+    tags = kwargs.get('tags', ())
+    generations = [_tag_generations.get(tag, 0) for tag in tags]
+
+    if conditional:
+        validators = item.validators if item else None
+        with _lock:
+            _revalidation['requests'] += validators is not None
+        data, validators = fetcher(validators)
+        if data is NOT_MODIFIED:
+            logger.debug("Data cache: '%s' has not been modified", key)
+            with _lock:
+                _revalidation['not_modified'] += 1
+            if generations == [_tag_generations.get(tag, 0) for tag in tags]:
+                _renew(key, item, expire_time, max_stale, kwargs.get('persistent', False))
+            try:
+                return _copy_out(key, item, False)
+            except _DecodeError:
+                return _fetch(key, fetcher, None, expire_time, max_stale, conditional, kwargs)
+        kwargs['validators'] = validators
+    else:
+        data = fetcher()
+
+    if data is not None:
+        if generations != [_tag_generations.get(tag, 0) for tag in tags]:
+            logger.debug("Data cache: not caching '%s', its tags have been invalidated meanwhile", key)
+            return data
+        if kwargs.get('frozen'):
+            # Have the caller receive the very object that has been cached.
+            data = freeze(data)
+        set_item(key, data, expire_time, max_stale=max_stale, **kwargs)
+    return data
+
+
+def _join_flight(key):
+    """Return a tuple (flight, leader). If no fetch of `key` is in progress,
+    a new flight is registered and `leader` is True; the caller is then to
+    perform the fetch and complete the flight by _land().
+
+    """
+    with _lock:
+        flight = _in_flight.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _in_flight[key] = _Flight()
+        return flight, True
+
+
+def _land(key, flight, result=None, error=None):
+    """Complete `flight` and release all threads waiting for it."""
+    flight.result = result
+    flight.error = error
+    with _lock:
+        if _in_flight.get(key) is flight:
+            del _in_flight[key]
+    flight.done.set()
+
+
+def _refresh(key, flight, fetcher, item, expire_time, max_stale, conditional, kwargs):
+    # noinspection PyBroadException
+    try:
+        data = _fetch(key, fetcher, item, expire_time, max_stale, conditional, kwargs)
+        logger.debug("Refreshed '%s' in the background", key)
+    except BaseException as err:
+        # Keep the stale data, a next request will just try again. Catch SystemExit
+        # and the like as well, or waiters for the flight would never be released.
+        logger.warning("Failed to refresh '%s' in the background:\n", key, exc_info=True)
+        _land(key, flight, error=err)
+    else:
+        _land(key, flight, data)
+
+
+def get_or_fetch(key, fetcher, expire_time=DFLT_EXPIRE_TIME, max_stale=0, copy=False, conditional=False,
+                 refresher=None, **kwargs):
+    """Return the cached data of `key`, or obtain the data by calling `fetcher()`
+    and cache the result. Results of None are not cached.
+
+    If the item has expired less than `max_stale` seconds ago, the stale data
+    is returned immediately, while `fetcher` is called on a background thread
+    to refresh the item. Beyond `max_stale` the caller has to wait for `fetcher`.
+    If given, `refresher` is called instead of `fetcher` for background refreshes,
+    e.g. a fetcher that never interacts with the user.
+    Stale data is never returned beyond the `max_stale` of the current caller,
+    even if the item has been stored by a caller that accepts staler data.
+
+    If `conditional` is True, `fetcher` is called with the validators of the
+    expired item (or None) and must return a tuple (data, validators). A fetcher
+    that returns NOT_MODIFIED as data just extends the lifetime of the item.
+
+    If the item is already being fetched by another thread, the caller waits
+    for that fetch to complete and receives the same result or exception. If
+    that takes longer than FLIGHT_TIMEOUT seconds, the caller fetches the data
+    itself.
+
+    Other keyword arguments are passed to set_item().
+    """
+    item = _lookup(key)
+    now = time.monotonic()
+    if item is not None:
+        stale_until = min(item.stale_until, item.expires + max_stale)
+        if item.expires > now or stale_until > now:
+            try:
+                data = _copy_out(key, item, copy)
+            except _DecodeError:
+                item = None
+
+    if item is not None:
+        if item.expires > now:
+            logger.debug("Data cache: hit '%s'", key)
+            _count_hit(key, item, now)
+            return data
+
+        if stale_until > now:
+            _count_hit(key, item, now, stale=True)
+            flight, leader = _join_flight(key)
+            if leader:
+                logger.debug("Data cache: stale hit on '%s', refreshing in the background", key)
+                threading.Thread(target=_refresh,
+                                 args=(key, flight, refresher or fetcher, item, expire_time, max_stale, conditional, kwargs),
+                                 daemon=True).start()
+            return data
+
+    logger.debug("Data cache: miss '%s'", key)
+    _stats_of(key).misses += 1
+    flight, leader = _join_flight(key)
+    if leader:
+        try:
+            data = _fetch(key, fetcher, item, expire_time, max_stale, conditional, kwargs)
+        except BaseException as err:
+            _land(key, flight, error=err)
+            raise
+        _land(key, flight, data)
+    else:
+        logger.debug("Data cache: waiting for '%s' to be fetched by another thread", key)
+        if flight.done.wait(FLIGHT_TIMEOUT):
+            if flight.error is not None:
+                raise flight.error
+            data = flight.result
+            if not kwargs.get('frozen'):
+                # The thread that fetched the data returns the original to its caller.
+                return deepcopy(data)
+        else:
+            logger.warning("Data cache: timed out waiting for '%s', fetching it now", key)
+            data = _fetch(key, fetcher, item, expire_time, max_stale, conditional, kwargs)
+    if copy and kwargs.get('frozen'):
+        return thaw(data)
+    return data
 
 
 def clean():
-    """Remove expired items from the cache."""
+    """Remove items from the cache that are no longer retained."""
     now = time.monotonic()
-    for key, item in list(__cache.items()):
-        if item['expires'] < now:
-            logger.debug('Clean removed: %s', key)
-            del __cache[key]
+    heap = _expiry_heap
+    with _lock:
+        while heap and heap[0][0] < now:
+            keep_until, key = heapq.heappop(heap)
+            item = __cache.get(key)
+            # Ignore entries of items that have been replaced or removed since.
+            if item is not None and item.keep_until == keep_until:
+                logger.debug('Clean removed: %s', key)
+                _remove(key)
+    _disk.clean()
 
 
 def purge():
-    """Empty the cache."""
-    __cache.clear()
+    """Empty the cache, both memory and disk."""
+    with _lock:
+        __cache.clear()
+        _expiry_heap.clear()
+        _tag_index.clear()
+        _resident['bytes'] = 0
+    _disk.purge()
+
+
+def invalidate(tag):
+    """Remove all items tagged with `tag` from the cache, both memory and disk.
+    Return the number of items removed from memory.
+
+    """
+    with _lock:
+        _tag_generations[tag] = _tag_generations.get(tag, 0) + 1
+        keys = [key for key in _tag_index.pop(tag, ()) if key in __cache]
+        for key in keys:
+            _remove(key)
+    _disk.invalidate(tag)
+    logger.debug("Invalidated %s items tagged '%s'", len(keys), tag)
+    return len(keys)
+
+
+def set_limits(max_items=None, max_bytes=None):
+    """Set the maximum number of items and the approximate maximum number of
+    bytes the memory cache is allowed to use.
+    Parameters that are None leave the current limit unchanged.
+
+    Items are evicted immediately when the cache exceeds the new limits.
+    """
+    with _lock:
+        if max_items is not None:
+            _limits['max_items'] = max_items
+        if max_bytes is not None:
+            _limits['max_bytes'] = max_bytes
+        while __cache and (len(__cache) > _limits['max_items'] or _resident['bytes'] > _limits['max_bytes']):
+            lru_key = next(iter(__cache))
+            _remove(lru_key)
+            _resident['evictions'] += 1
+            _stats_of(lru_key).evictions += 1
+
+
+def set_compression(codec=None, threshold=None):
+    """Set the name of the codec and the minimum estimated size in bytes of data
+    that is to be compressed when items are stored with `compress=True`.
+    Parameters that are None leave the current setting unchanged.
+
+    Only affects items stored from now on.
+    """
+    if codec is not None:
+        if codec not in _codecs:
+            raise ValueError("Unknown codec '{}'".format(codec))
+        _compression['codec'] = codec
+    if threshold is not None:
+        _compression['threshold'] = threshold
 
 
 def size():
-    return len(__cache)
\ No newline at end of file
+    return len(__cache)
+
+
+def residency():
+    """Return a dict with the current number of items and bytes in the memory cache,
+    the limits that apply and the number of items evicted so far.
+
+    """
+    with _lock:
+        return {'items': len(__cache),
+                'bytes': _resident['bytes'],
+                'max_items': _limits['max_items'],
+                'max_bytes': _limits['max_bytes'],
+                'evictions': _resident['evictions']}
+
+
+def revalidation_stats():
+    """Return a dict with the number of conditional requests made to revalidate
+    cached items, and the number of those that saved downloading the resource again.
+
+    """
+    with _lock:
+        return dict(_revalidation)
+
+
+def statistics():
+    """Return a dict with statistics of the cache, suitable to be dumped as JSON.
+
+    Apart from the overall figures of residency(), revalidation_stats() and the
+    disk cache, it has per key prefix the number of hits, stale hits, misses and
+    evictions since the start of the addon, the mean age of data at a hit, and
+    the number, size and age of the items currently in memory. Ages are in seconds.
+    """
+    disk_stats = _disk.stats()
+    now = time.monotonic()
+    prefixes = {}
+    with _lock:
+        for prefix, stats in _key_stats.items():
+            hits = stats.hits + stats.stale_hits
+            lookups = hits + stats.misses
+            prefixes[prefix] = {
+                'hits': stats.hits,
+                'stale_hits': stats.stale_hits,
+                'misses': stats.misses,
+                'hit_ratio': round(hits / lookups, 3) if lookups else None,
+                'evictions': stats.evictions,
+                'mean_age_at_hit': round(stats.age_at_hit / hits, 1) if hits else None,
+                'items': 0,
+                'bytes': 0,
+                'max_age': None}
+        for key, item in __cache.items():
+            prefix = key_prefix(key)
+            entry = prefixes.get(prefix)
+            if entry is None:
+                # Items that have been stored, but never looked up.
+                entry = prefixes[prefix] = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'hit_ratio': None,
+                                            'evictions': 0, 'mean_age_at_hit': None,
+                                            'items': 0, 'bytes': 0, 'max_age': None}
+            entry['items'] += 1
+            entry['bytes'] += item.size
+            entry['max_age'] = max(entry['max_age'] or 0, round(now - item.stored, 1))
+        return {'memory': residency(),
+                'disk': disk_stats,
+                'revalidation': revalidation_stats(),
+                'prefixes': prefixes}
+
+
+def reset_statistics():
+    """Clear the statistics collected per key prefix."""
+    with _lock:
+        _key_stats.clear()
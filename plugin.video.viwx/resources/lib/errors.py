@@ -41,6 +41,13 @@ class HttpError(FetchError):
         super(HttpError, self).__init__(u'Connection error: {}'.format(reason))
 
 
+class HostUnavailableError(FetchError):
+    def __init__(self, host):
+        self.host = host
+        super(HostUnavailableError, self).__init__(
+            u'{} is temporarily unavailable'.format(host))
+
+
 class ParseError(FetchError):
     def __init__(self, msg=None):
         super(ParseError, self).__init__(
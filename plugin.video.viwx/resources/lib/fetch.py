@@ -6,14 +6,31 @@
 # ----------------------------------------------------------------------------------------------------------------------
 
 from __future__ import annotations
+import io
 import os
+import re
+import atexit
+import socket
+import hashlib
+import fnmatch
 import logging
 import requests
 import pickle
 import time
+import math
+import random
+import threading
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
+from http.cookiejar import Cookie
 from requests.cookies import RequestsCookieJar
 from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
+from urllib3.response import HTTPResponse
 import json
 
 from codequick import Script
@@ -27,25 +44,155 @@ WEB_TIMEOUT = (3.5, 12)
 USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:135.0) Gecko/20100101 Firefox/135.0'
 USER_AGENT_VERSION = '135.0'
 
+# The number of hosts for which connections are pooled, the maximum number of
+# connections kept per host, and the time in seconds after which an idle
+# connection is closed rather than reused.
+POOL_HOSTS = 10
+POOL_MAXSIZE = 4
+POOL_IDLE_TIMEOUT = 60
+# The maximum time in seconds to wait for TLS session tickets on a prewarmed connection.
+PREWARM_TICKET_TIMEOUT = 0.5
+# The maximum time in seconds a request waits for a connection that is being prewarmed.
+PREWARM_WAIT_TIMEOUT = WEB_TIMEOUT[0] + PREWARM_TICKET_TIMEOUT
+
+# Time in seconds that resolved addresses of hosts are cached, and the time
+# before expiry at which a host in use is resolved again in the background.
+DNS_CACHE_TTL = 300
+DNS_REFRESH_MARGIN = 60
+# Idempotent requests are retried at most MAX_RETRIES times on connection errors
+# and on responses with one of the RETRY_STATUSES. Retries wait a random time
+# between 0 and RETRY_BACKOFF seconds, doubling with each attempt.
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# After this number of consecutive failed requests to a host, requests to that
+# host fail immediately for BREAKER_COOLDOWN seconds. A request counts as failed
+# when it has failed after all its retries.
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60
+
+# The number of most recent requests of which timings are kept.
+TIMINGS_BUFFER_SIZE = 500
+TIMINGS_FILE_NAME = 'request_timings.jsonl'
+
+# Transport modes of the HttpSession, see set_transport().
+TRANSPORT_LIVE = 'live'
+TRANSPORT_RECORD = 'record'
+TRANSPORT_REPLAY = 'replay'
+# The default directory in the addon's profile where responses are recorded,
+# and the name of the index of recorded responses in such a directory.
+RECORDINGS_DIR = 'http_recordings'
+RECORDINGS_INDEX = 'recordings.json'
+RECORDINGS_VERSION = 1
+# Responses of these hosts are never recorded, as they consist of little more than credentials.
+RECORDINGS_SKIP_HOSTS = ('auth.prd.user.itv.com',)
+# Values of these fields in json bodies are replaced by RECORDINGS_REDACTED.
+RECORDINGS_SECRET_FIELDS = ('access_token', 'refresh_token', 'id_token', 'token', 'password')
+RECORDINGS_REDACTED = 'REDACTED'
+# The user ID in URLs of user specific data, like 'My List' and recommendations.
+_USER_ID_IN_PATH = re.compile(r'(/(?:user|homepage|byw)/)[^/]+')
+
+COOKIE_FILE = 'cookies.json'
+# The file in which cookies were pickled by previous versions of the addon.
+LEGACY_COOKIE_FILE = 'cookies'
+COOKIE_FILE_VERSION = 1
+# Time in seconds by which saving changed cookies is delayed, to combine the changes of multiple requests.
+COOKIE_SAVE_DELAY = 10
+
+# The maximum number of requests made concurrently by call_many() and friends.
+MAX_WORKERS = POOL_MAXSIZE
+# The size in bytes of the chunks in which streamed documents are read.
+STREAM_CHUNK_SIZE = 32 * 1024
+# When a streamed document has not been read completely, up to this number of bytes
+# of the remainder is read, so the connection can be reused. If more remains, the
+# connection is closed.
+STREAM_DRAIN_LIMIT = 64 * 1024
+
 
 logger = logging.getLogger('.'.join((logger_id, __name__.split('.', 2)[-1])))
 
 
+# Attributes of http.cookiejar.Cookie in the order in which they are saved; the
+# cookie's non-standard attributes follow as the last element.
+_COOKIE_ATTRS = ('version', 'name', 'value', 'port', 'port_specified', 'domain', 'domain_specified',
+                 'domain_initial_dot', 'path', 'path_specified', 'secure', 'expires', 'discard',
+                 'comment', 'comment_url', 'rfc2109')
+
+
 class PersistentCookieJar(RequestsCookieJar):
+    """A cookiejar that can be saved to, and loaded from a JSON file.
+
+    The file is a JSON object with the format version and a list of cookies,
+    each being a list of cookie attributes. Files are replaced atomically, so
+    a crash while saving cannot leave a corrupt file.
+
+    """
     def __init__(self, filename, policy=None):
         RequestsCookieJar.__init__(self, policy)
         self.filename = filename
         self._has_changed = False
+        self._save_timer = None
+        self._save_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filename):
+        """Return a new cookiejar with the cookies saved in file `filename`.
+
+        Raise ValueError if the file is not a cookie file of the current version.
+        """
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get('version') != COOKIE_FILE_VERSION:
+            raise ValueError("Unsupported cookie file format")
+        jar = cls(filename)
+        n_attrs = len(_COOKIE_ATTRS)
+        for values in data['cookies']:
+            cookie = Cookie(rest=values[n_attrs], **dict(zip(_COOKIE_ATTRS, values)))
+            # Bypass set_cookie(), loaded cookies are not a change.
+            RequestsCookieJar.set_cookie(jar, cookie)
+        return jar
 
     def save(self):
-        if not self._has_changed:
-            return
-        self.clear_expired_cookies()
-        self._has_changed = False
-        with open(self.filename, 'wb') as f:
-            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        """Write the cookies to file now, if they have changed since they were last saved."""
+        with self._save_lock:
+            # Requests can be made from multiple threads, see call_many().
+            with self._cookies_lock:
+                if not self._has_changed:
+                    return
+                self.clear_expired_cookies()
+                self._has_changed = False
+                data = {'version': COOKIE_FILE_VERSION,
+                        'cookies': [[getattr(cookie, attr) for attr in _COOKIE_ATTRS] + [cookie._rest]
+                                    for cookie in self]}
+            tmp_file = self.filename + '.tmp'
+            try:
+                with open(tmp_file, 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+                os.replace(tmp_file, self.filename)
+            except OSError as err:
+                logger.error("Failed to save cookies to file %s: %r", self.filename, err)
+                self._has_changed = True
+                return
         logger.info("Saved cookies to file %s", self.filename)
 
+    def schedule_save(self, delay=COOKIE_SAVE_DELAY):
+        """Save the cookies on a background thread in `delay` seconds' time,
+        if they have changed. Changes made in the meantime are saved along.
+
+        """
+        with self._cookies_lock:
+            if not self._has_changed or self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(delay, self._save_delayed)
+            self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _save_delayed(self):
+        with self._cookies_lock:
+            self._save_timer = None
+        self.save()
+
     def set_cookie(self, cookie, *args, **kwargs):
         super(PersistentCookieJar, self).set_cookie(cookie, *args, **kwargs)
         logger.debug("Cookiejar sets cookie %s for %s%s to %s", cookie.name, cookie.domain, cookie.path, cookie.value)
@@ -61,6 +208,265 @@ class PersistentCookieJar(RequestsCookieJar):
             pass
 
 
+_conn_stats_lock = threading.Lock()
+_conn_stats = {'requests': 0, 'opened': 0, 'prewarmed': 0}
+
+
+def connection_stats():
+    """Return a dict with the number of requests made through pooled connections,
+    the number of connections opened, of which the number opened in advance by
+    prewarm(), and the number of requests that reused an existing connection.
+
+    """
+    with _conn_stats_lock:
+        stats = dict(_conn_stats)
+    stats['reused'] = max(0, stats['requests'] - stats['opened'] + stats['prewarmed'])
+    return stats
+
+
+def _count_connection(event):
+    with _conn_stats_lock:
+        _conn_stats[event] += 1
+
+
+class DnsCache:
+    """Caches the addresses of hosts resolved by the system's resolver.
+
+    The system's resolver does not expose the TTL of DNS records, so addresses
+    are cached for a fixed `ttl`, which is well within the TTL ITVX's hosts use.
+    An address that is requested within `refresh_margin` seconds before it
+    expires is resolved again on a background thread, so hosts in regular use
+    do not have to wait for a lookup.
+
+    The cache is disabled by default. When disabled, or when connecting to
+    all cached addresses of a host fails, connections resolve the host through
+    the system's resolver as usual.
+
+    """
+    def __init__(self, ttl=DNS_CACHE_TTL, refresh_margin=DNS_REFRESH_MARGIN):
+        self.enabled = False
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'failures': 0,
+                       'lookup_time': 0.0, 'time_saved': 0.0}
+
+    def _lookup(self, host, port):
+        """Resolve `host` by the system's resolver and cache the result."""
+        from urllib3.util.connection import allowed_gai_family
+        start = time.monotonic()
+        addr_info = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+        duration = time.monotonic() - start
+        addresses = list(dict.fromkeys(info[4][0] for info in addr_info))
+        with self._lock:
+            self._entries[host] = (time.monotonic() + self.ttl, addresses, duration)
+            self._stats['lookup_time'] += duration
+        return addresses
+
+    def _refresh(self, host, port):
+        try:
+            self._lookup(host, port)
+            with self._lock:
+                self._stats['refreshes'] += 1
+        except OSError as e:
+            # Keep the current addresses until they expire.
+            logger.debug("Failed to refresh the addresses of %s: %r", host, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(host)
+
+    def resolve(self, host, port=443):
+        """Return a list of IP addresses of `host`, from cache if possible."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry and entry[0] > now:
+                expires, addresses, duration = entry
+                self._stats['hits'] += 1
+                self._stats['time_saved'] += duration
+                refresh = expires - now < self.refresh_margin and host not in self._refreshing
+                if refresh:
+                    self._refreshing.add(host)
+            else:
+                addresses = None
+                self._stats['misses'] += 1
+        if addresses is None:
+            return self._lookup(host, port)
+        if refresh:
+            threading.Thread(target=self._refresh, args=(host, port), name='viwx-dns-refresh', daemon=True).start()
+        return addresses
+
+    def invalidate(self, host):
+        with self._lock:
+            self._entries.pop(host, None)
+            self._stats['failures'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def statistics(self):
+        """Return a dict with the number of cache hits and misses, background
+        refreshes, and failures to connect to cached addresses, the total time
+        spent on lookups and the estimated time saved by cache hits, in seconds.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hosts'] = len(self._entries)
+        stats['lookup_time'] = round(stats['lookup_time'], 4)
+        stats['time_saved'] = round(stats['time_saved'], 4)
+        return stats
+
+
+dns_cache = DnsCache()
+
+
+# Per thread, the number of connections opened and the time spent on it, including
+# DNS lookup and TLS handshake, during the current request.
+_connect_state = threading.local()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    """An HTTPS connection that counts the number of times it actually
+    connects, i.e. opens a new TCP connection, including reconnects."""
+    def connect(self):
+        _count_connection('opened')
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_state.count = getattr(_connect_state, 'count', 0) + 1
+            _connect_state.duration = getattr(_connect_state, 'duration', 0.0) + time.monotonic() - start
+
+    def _new_conn(self):
+        """Open the socket to one of the addresses of the host in the DNS cache,
+        if enabled. If connecting fails, the cached addresses are dropped and
+        the system's resolver is used.
+
+        """
+        if not dns_cache.enabled:
+            return super()._new_conn()
+        from urllib3.exceptions import ConnectTimeoutError
+
+        host = self._dns_host
+        try:
+            addresses = dns_cache.resolve(host, self.port)
+        except OSError:
+            addresses = ()
+        try:
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as e:
+                    logger.debug("Failed to connect to %s at cached address %s: %r", host, address, e)
+        finally:
+            self._dns_host = host
+        if addresses:
+            dns_cache.invalidate(host)
+        return super()._new_conn()
+
+
+class _PooledHTTPSConnectionPool(HTTPSConnectionPool):
+    """A connection pool that closes connections that have been idle for more
+    than `idle_timeout` seconds, rather than trying to reuse them.
+
+    """
+    ConnectionCls = _CountingHTTPSConnection
+
+    def __init__(self, *args, idle_timeout=POOL_IDLE_TIMEOUT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle_timeout = idle_timeout
+        self._prewarm_done = None
+
+    def _get_conn(self, timeout=None):
+        prewarm_done = self._prewarm_done
+        if prewarm_done is not None:
+            # Take over the connection being prewarmed, rather than opening another one.
+            prewarm_done.wait(PREWARM_WAIT_TIMEOUT)
+        conn = super()._get_conn(timeout)
+        _count_connection('requests')
+        last_used = getattr(conn, 'last_used', None)
+        if last_used is not None and time.monotonic() - last_used > self.idle_timeout:
+            logger.debug("Closing idle connection to %s", self.host)
+            conn.close()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.last_used = time.monotonic()
+        super()._put_conn(conn)
+
+    def expect_prewarm(self):
+        """Have requests wait for the connection about to be opened by prewarm(),
+        rather than open a connection of their own.
+
+        """
+        if self._prewarm_done is None:
+            self._prewarm_done = threading.Event()
+
+    def prewarm(self):
+        """Open a connection and put it in the pool for use by a later request,
+        unless the pool already has an open connection that can be reused.
+        Return True if a connection has been opened.
+
+        """
+        conn = super()._get_conn()
+        try:
+            last_used = getattr(conn, 'last_used', None)
+            if conn.sock is not None and (last_used is None or time.monotonic() - last_used <= self.idle_timeout):
+                return False
+            conn.close()
+            conn.connect()
+            _count_connection('prewarmed')
+            if not _read_session_tickets(conn.sock):
+                conn.close()
+                return False
+            return True
+        except Exception:
+            conn.close()
+            raise
+        finally:
+            self._put_conn(conn)
+            prewarm_done, self._prewarm_done = self._prewarm_done, None
+            if prewarm_done is not None:
+                prewarm_done.set()
+
+
+def _read_session_tickets(sock, timeout=PREWARM_TICKET_TIMEOUT):
+    """Read the session tickets a TLS 1.3 server sends just after the handshake.
+
+    As long as these have not been read, the socket is readable and urllib3
+    regards a connection that has never been used as dropped by the server.
+    Return False if the server actually closed the connection, or sent
+    something else.
+
+    """
+    import ssl
+    from urllib3.util.wait import wait_for_read
+
+    if not hasattr(sock, 'version') or sock.version() != 'TLSv1.3':
+        return True
+    sock_timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        while wait_for_read(sock, timeout=timeout):
+            try:
+                sock.recv(1)
+            except ssl.SSLWantReadError:
+                # Only handshake messages have been read. Tickets are usually
+                # sent together, so don't wait long for more.
+                timeout = 0.01
+                continue
+            return False
+        return True
+    finally:
+        sock.settimeout(sock_timeout)
+
+
 class CustomHttpAdapter(HTTPAdapter):
     """A custom HTTP Adaptor to work around the issue that www.itv.com returns
     403 FORBIDDEN on OSMC 2024.05-1 and probably others systems running openssl 1.1.1.
@@ -71,7 +477,16 @@ class CustomHttpAdapter(HTTPAdapter):
     Apart from the OP_NO_TICKET option, ssl's default context appears to be very
     much like that created by urllib3, so I guess it's safe for general use here.
 
+    Connections are kept alive in pools of at most `pool_maxsize` connections
+    per host, for at most `pool_connections` hosts. Connections idle for more
+    than `idle_timeout` seconds are not reused.
+
     """
+    def __init__(self, pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 **kwargs):
+        self._idle_timeout = idle_timeout
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, **kwargs)
+
     def init_poolmanager(self, *args, **kwargs):
         import urllib3
         import ssl
@@ -80,21 +495,38 @@ class CustomHttpAdapter(HTTPAdapter):
 
         ctx = ssl.create_default_context()
         super().init_poolmanager(*args, **kwargs, ssl_context=ctx)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            self.poolmanager.pool_classes_by_scheme,
+            https=partial(_PooledHTTPSConnectionPool, idle_timeout=self._idle_timeout))
 
 
 class HttpSession(requests.sessions.Session):
+    """The session used for all regular requests.
+
+    There is only one instance, which lives as long as the python interpreter,
+    so connections are reused across invocations of the addon when Kodi's
+    LanguageInvoker is reused. The session is closed at exit.
+
+    """
     instance = None
+    _create_lock = threading.Lock()
 
     def __new__(cls):
-        if cls.instance is None:
-            cls.instance = super(HttpSession, cls).__new__(cls)
+        # The instance is fully initialised before it is made available, so
+        # threads requesting the first session concurrently can't obtain a
+        # session that has not been set up yet.
+        with cls._create_lock:
+            if cls.instance is None:
+                instance = super(HttpSession, cls).__new__(cls)
+                instance._initialise()
+                cls.instance = instance
         return cls.instance
 
     def __init__(self):
-        if hasattr(self, 'cookies'):
-            # prevent re-initialization when __new__ returns an existing instance
-            return
+        # Initialisation is done by __new__, only once.
+        pass
 
+    def _initialise(self):
         super(HttpSession, self).__init__()
         self.headers.update({
             'User-Agent': USER_AGENT,
@@ -108,7 +540,7 @@ class HttpSession(requests.sessions.Session):
             'Pragma': 'no-cache',
         })
         self.cookies = _create_cookiejar()
-        self.mount('https://', CustomHttpAdapter())
+        self.mount('https://', _new_adapter())
 
     # noinspection PyShadowingNames
     def request(
@@ -124,32 +556,379 @@ class HttpSession(requests.sessions.Session):
                 hooks=hooks, stream=stream, verify=verify, cert=cert, json=json)
 
         # noinspection PyUnresolvedReferences
-        self.cookies.save()  # type: ignore
+        self.cookies.schedule_save()  # type: ignore
+        return resp
+
+
+class _Recordings:
+    """The index of recorded HTTP responses in `directory`.
+
+    The index is a json file which maps 'METHOD url' to the status, reason,
+    headers and the name of the file with the body of the response, relative
+    to `directory`. A recorded URL without a query string matches any request
+    to that URL, so responses to requests with variable query parameters, like
+    dates, can be replayed as well. Likewise, URLs may contain shell-style
+    wildcards to match requests with variable paths, like user IDs.
+
+    Entries with 'page_props' set to true have a body of just the pageProps
+    of a Next.js page, as the json documents in test/test_docs/html. These
+    are embedded in a minimal HTML page when replayed.
+
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_file = os.path.join(directory, RECORDINGS_INDEX)
+        self._lock = threading.Lock()
+        try:
+            with open(self.index_file, 'r') as f:
+                self.responses = json.load(f)['responses']
+        except FileNotFoundError:
+            self.responses = {}
+
+    @staticmethod
+    def _key(method, url):
+        # Requests adds a slash to the URL of a site's root, like https://www.itv.com.
+        return ' '.join((method.upper(), url.rstrip('/')))
+
+    def find(self, method, url):
+        """Return the entry of the response to the request, or None if it has not been recorded."""
+        entry = self.responses.get(self._key(method, url))
+        if entry is None and '?' in url:
+            url = url.split('?', 1)[0]
+            entry = self.responses.get(self._key(method, url))
+        if entry is None:
+            key = self._key(method, url)
+            entry = next((entry for pattern, entry in self.responses.items()
+                          if '*' in pattern and fnmatch.fnmatchcase(key, pattern)),
+                         None)
+        return entry
+
+    def read_body(self, entry) -> bytes:
+        with open(os.path.join(self.directory, entry['body']), 'rb') as f:
+            body = f.read()
+        if entry.get('page_props'):
+            body = b''.join((b'<!DOCTYPE html><html><head></head><body>'
+                             b'<script id="__NEXT_DATA__" type="application/json">{"props":{"pageProps":',
+                             body,
+                             b'}}</script></body></html>'))
+        return body
+
+    def add(self, method, url, resp):
+        """Store the body of `resp` in a file and add the response to the index.
+
+        Headers that no longer apply to the stored, decoded body are dropped,
+        as are cookies. Responses of RECORDINGS_SKIP_HOSTS are not recorded,
+        tokens in json bodies are redacted, and user IDs in URLs are replaced
+        by a wildcard. Other personal data, like the programmes in 'My List',
+        is recorded as is, so recordings are not to be shared publicly.
+
+        """
+        scheme, host, path = urlsplit(url)[:3]
+        if host in RECORDINGS_SKIP_HOSTS:
+            return
+        anonymous_path = _USER_ID_IN_PATH.sub(r'\1*', path)
+        if anonymous_path != path:
+            # A wildcard only matches URLs without query string.
+            url = '{}://{}{}'.format(scheme, host, anonymous_path)
+        key = self._key(method, url)
+        body_file = os.path.join('bodies', hashlib.sha1(key.encode('utf8')).hexdigest() + '.bin')
+        headers = {name: value for name, value in resp.headers.items()
+                   if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding', 'set-cookie')}
+        body = resp.content or b''
+        if 'json' in resp.headers.get('content-type', ''):
+            body = _redact_json(body)
+        with self._lock:
+            os.makedirs(os.path.join(self.directory, 'bodies'), exist_ok=True)
+            with open(os.path.join(self.directory, body_file), 'wb') as f:
+                f.write(body)
+            self.responses[key] = {'status': resp.status_code,
+                                   'reason': resp.reason,
+                                   'headers': headers,
+                                   'body': body_file}
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump({'version': RECORDINGS_VERSION, 'responses': self.responses}, f, indent=2)
+            os.replace(tmp_file, self.index_file)
+
+
+def _redact_json(body: bytes) -> bytes:
+    """Return the json document `body` with the values of RECORDINGS_SECRET_FIELDS
+    redacted. Bodies that are not valid json are returned unchanged.
+
+    """
+    def redact(obj):
+        if isinstance(obj, dict):
+            return {k: RECORDINGS_REDACTED if k in RECORDINGS_SECRET_FIELDS else redact(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [redact(v) for v in obj]
+        return obj
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    redacted = redact(data)
+    if redacted == data:
+        return body
+    return json.dumps(redacted).encode('utf8')
+
+
+class RecordingHttpAdapter(CustomHttpAdapter):
+    """Performs requests like CustomHttpAdapter and records each response,
+    including its body, in `directory`.
+
+    The body is read entirely before the response is returned, so streamed
+    responses are no longer truly streamed while recording.
+
+    """
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.recordings = _Recordings(directory)
+
+    def send(self, request, **kwargs):
+        resp = super().send(request, **kwargs)
+        try:
+            self.recordings.add(request.method, request.url, resp)
+        except OSError as e:
+            logger.warning("Failed to record response of %s: %r", request.url, e)
         return resp
 
 
+class _ThrottledBody(io.BytesIO):
+    """The body of a replayed response, delivered at `bandwidth` bytes per second."""
+    def __init__(self, data, bandwidth=None):
+        super().__init__(data)
+        self.bandwidth = bandwidth
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if self.bandwidth and data:
+            time.sleep(len(data) / self.bandwidth)
+        return data
+
+
+class ReplayHttpAdapter(HTTPAdapter):
+    """Serves responses recorded in `directory`, without ever making a connection.
+
+    Each response is delayed by `latency` seconds, and, if `bandwidth` is
+    given, its body is transferred at `bandwidth` bytes per second. Requests
+    of which no response has been recorded get a 404 response.
+
+    """
+    def __init__(self, directory, latency=0.0, bandwidth=None):
+        super().__init__()
+        self.recordings = _Recordings(directory)
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    # noinspection PyShadowingNames
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entry = self.recordings.find(request.method, request.url)
+        if entry is None:
+            logger.warning("No recorded response to %s %s", request.method, request.url)
+            status, reason, headers, body = 404, 'Not Recorded', {}, b''
+        else:
+            status, reason, headers = entry['status'], entry.get('reason', ''), entry.get('headers', {})
+            body = self.recordings.read_body(entry)
+        if self.latency:
+            time.sleep(self.latency)
+        raw = HTTPResponse(body=_ThrottledBody(body, self.bandwidth),
+                           headers=dict(headers, **{'Content-Length': str(len(body))}),
+                           status=status,
+                           reason=reason,
+                           preload_content=False,
+                           decode_content=False,
+                           request_method=request.method)
+        return self.build_response(request, raw)
+
+
+_transport = None
+
+
+def _new_adapter():
+    """Return a new instance of the transport adapter of the HttpSession."""
+    return _transport() if _transport else CustomHttpAdapter()
+
+
+def set_transport(mode=TRANSPORT_LIVE, directory=None, latency=0.0, bandwidth=None):
+    """Set the transport of all HTTPS requests of the HttpSession.
+
+    Mode is one of:
+        - TRANSPORT_LIVE: make requests to the web, the default.
+        - TRANSPORT_RECORD: make requests to the web and record all responses in `directory`,
+          without credentials, but with other personal data, see _Recordings.add().
+        - TRANSPORT_REPLAY: don't make any request, but serve the responses
+          recorded in `directory`, with simulated `latency` in seconds and
+          `bandwidth` in bytes per second.
+
+    `Directory` defaults to RECORDINGS_DIR in the addon's profile directory.
+    Test documents in test/test_docs can be replayed as well.
+
+    """
+    global _transport
+    if mode == TRANSPORT_LIVE:
+        _transport = None
+    else:
+        if directory is None:
+            directory = os.path.join(utils.addon_info.profile, RECORDINGS_DIR)
+        if mode == TRANSPORT_RECORD:
+            _transport = partial(RecordingHttpAdapter, directory)
+        elif mode == TRANSPORT_REPLAY:
+            _transport = partial(ReplayHttpAdapter, directory, latency, bandwidth)
+        else:
+            raise ValueError("Invalid transport mode '{}'".format(mode))
+    logger.info("Transport set to '%s'", mode)
+
+    session = HttpSession.instance
+    if session is not None:
+        old_adapter = session.adapters['https://']
+        session.mount('https://', _new_adapter())
+        old_adapter.close()
+
+
+def prewarm(hosts):
+    """Open connections to `hosts` in the background, so the first request
+    to each host can skip DNS lookup, TCP connect and TLS handshake.
+
+    Each connection is opened on its own daemon thread and put in the pools
+    of the HttpSession, just like connections kept alive after a request.
+    Requests to a host briefly wait for its connection to be opened, so they
+    don't open a connection of their own meanwhile.
+    Hosts that already have an idle connection, or of which the circuit
+    breaker is open, are skipped. Return the list of threads.
+
+    """
+    session = HttpSession()
+    threads = []
+    for host in hosts:
+        if circuit_breaker.is_open(host):
+            continue
+        pool = _connection_pool(session, host)
+        if pool is None:
+            continue
+        pool.expect_prewarm()
+        thread = threading.Thread(target=_prewarm_connection, args=(pool, host),
+                                  name='viwx-prewarm', daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def _connection_pool(session, host):
+    """Return the pool of connections to `host` of `session`, or None if
+    connections to the host are not pooled by this module.
+
+    """
+    from urllib3.exceptions import HTTPError as Urllib3Error
+    url = 'https://{}/'.format(host)
+    adapter = session.get_adapter(url)
+    if not isinstance(adapter, CustomHttpAdapter):
+        # Replaying recorded responses
+        return None
+    try:
+        settings = session.merge_environment_settings(url, {}, None, None, None)
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            request = requests.Request('GET', url).prepare()
+            pool = adapter.get_connection_with_tls_context(request, settings['verify'],
+                                                           settings['proxies'], settings['cert'])
+        else:
+            # requests < 2.32.2
+            pool = adapter.get_connection(url, settings['proxies'])
+    except (OSError, ValueError, Urllib3Error, requests.RequestException) as e:
+        logger.debug("Failed to get the connection pool of %s: %r", host, e)
+        return None
+    if not isinstance(pool, _PooledHTTPSConnectionPool):
+        # Connections through a proxy
+        return None
+    return pool
+
+
+def _prewarm_connection(pool, host):
+    from urllib3.exceptions import HTTPError as Urllib3Error
+    start = time.monotonic()
+    try:
+        if pool.prewarm():
+            logger.debug("Opened connection to %s in %.3f sec", host, time.monotonic() - start)
+    except (OSError, ValueError, Urllib3Error, requests.RequestException) as e:
+        logger.debug("Failed to open connection to %s: %r", host, e)
+
+
+def close_session():
+    """Close the HttpSession and all its pooled connections, if it exists."""
+    session = HttpSession.instance
+    if session is not None:
+        HttpSession.instance = None
+        session.cookies.save()
+        session.close()
+        logger.debug("HttpSession closed, connections: %s", connection_stats())
+
+
+def save_cookies():
+    """Write changes to the cookies of the HttpSession to file now, rather
+    than waiting for the scheduled save.
+
+    """
+    session = HttpSession.instance
+    if session is not None:
+        session.cookies.save()
+
+
+atexit.register(close_session)
+
+
 def _create_cookiejar():
-    """Restore a cookiejar from file. If the file does not exist create new one and
-    apply the default cookies.
+    """Restore a cookiejar from file. If the file does not exist, convert a cookie
+    file of a previous version, or create new cookiejar and apply the default cookies.
 
     """
-    cookie_file = os.path.join(utils.addon_info.profile, 'cookies')
+    cookie_file = os.path.join(utils.addon_info.profile, COOKIE_FILE)
 
     try:
-        with open(cookie_file, 'rb') as f:
-            # TODO: handle expired consent cookies
-            cj = pickle.load(f)
-            # The internally stored filename of the saved file may be different to the current filename
-            # if the file has been copied from another system.
-            cj.filename = cookie_file
-            logger.info("Restored cookies from file")
-    except (FileNotFoundError, pickle.UnpicklingError):
+        # TODO: handle expired consent cookies
+        cj = PersistentCookieJar.load(cookie_file)
+        logger.info("Restored cookies from file")
+        return cj
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, IndexError, TypeError) as err:
+        logger.warning("Ignoring invalid cookie file: %r", err)
+
+    cj = _convert_pickled_cookies(os.path.join(utils.addon_info.profile, LEGACY_COOKIE_FILE), cookie_file)
+    if cj is None:
         cj = PersistentCookieJar(cookie_file)
         set_default_cookies(cj)
         logger.info("Created new cookiejar")
     return cj
 
 
+def _convert_pickled_cookies(legacy_file, cookie_file):
+    """Return a new cookiejar with the cookies of a pickled cookiejar saved by
+    a previous version of the addon, and save it in the current format.
+    Return None if there is no such file, or it cannot be loaded.
+
+    """
+    try:
+        with open(legacy_file, 'rb') as f:
+            legacy_jar = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        # Intentionally broad, unpickling can raise almost anything.
+        logger.warning("Failed to load pickled cookies: %r", err)
+        return None
+    cj = PersistentCookieJar(cookie_file)
+    for cookie in legacy_jar:
+        RequestsCookieJar.set_cookie(cj, cookie)
+    cj._has_changed = True
+    cj.save()
+    try:
+        os.remove(legacy_file)
+    except OSError:
+        pass
+    logger.info("Converted pickled cookies to %s", COOKIE_FILE)
+    return cj
+
+
 def set_default_cookies(cookiejar: RequestsCookieJar | None = None):
     """Post a cookie consent form rejecting all cookies.
 
@@ -235,12 +1014,254 @@ def set_default_cookies(cookiejar: RequestsCookieJar | None = None):
         s.close()
 
 
-def web_request(method, url, headers=None, data=None, **kwargs):
+class CircuitBreaker:
+    """Keeps track of consecutive failures of requests per host.
+
+    After `threshold` consecutive failures the circuit of a host opens and
+    check() raises HostUnavailableError for `cooldown` seconds. After that
+    requests are allowed again, but a single failure opens the circuit anew.
+    Any successful request closes the circuit.
+
+    """
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._open_until = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, host):
+        with self._lock:
+            return self._open_until.get(host, 0) > time.monotonic()
+
+    def is_half_open(self, host):
+        """True if the cooldown of the host has passed, but no request has succeeded since."""
+        with self._lock:
+            return self._failures.get(host, 0) >= self.threshold
+
+    def check(self, host):
+        if self.is_open(host):
+            logger.debug("Circuit of host %s is open", host)
+            raise HostUnavailableError(host)
+
+    def success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open_until.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.threshold:
+                self._open_until[host] = time.monotonic() + self.cooldown
+                logger.warning("%s consecutive failures of host %s; failing requests for %s seconds",
+                               failures, host, self.cooldown)
+
+    def reset(self):
+        with self._lock:
+            self._failures.clear()
+            self._open_until.clear()
+
+
+circuit_breaker = CircuitBreaker()
+
+
+def _backoff(attempt, url, reason):
+    delay = random.uniform(0, RETRY_BACKOFF * 2 ** (attempt - 1))
+    logger.info("Retrying request to %s in %.2f seconds after %s", url, delay, reason)
+    time.sleep(delay)
+
+
+def _send(http_session, method, url, max_retries, **kwargs):
+    """Make a request, retrying idempotent requests on connection errors and
+    temporary server errors, and register the outcome with the circuit breaker.
+
+    A request that still fails after its retries counts as one failure. A host
+    whose circuit has just been closed after a cooldown gets only one attempt.
+    """
+    host = urlsplit(url).hostname
+    circuit_breaker.check(host)
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+    if method.upper() in IDEMPOTENT_METHODS and not circuit_breaker.is_half_open(host):
+        max_attempts = 1 + max_retries
+    else:
+        max_attempts = 1
+    attempt = 1
+    while True:
+        logger.debug("Making %s request to %s", method, url)
+        try:
+            resp = http_session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            # Do not retry timeouts, another attempt would likely be just as slow.
+            if attempt >= max_attempts or not isinstance(e, requests.ConnectionError):
+                circuit_breaker.failure(host)
+                raise
+            _backoff(attempt, url, repr(e))
+        else:
+            if resp.status_code < 500:
+                circuit_breaker.success(host)
+                return resp
+            if attempt >= max_attempts or resp.status_code not in RETRY_STATUSES:
+                circuit_breaker.failure(host)
+                return resp
+            resp.close()
+            _backoff(attempt, url, 'HTTP status {}'.format(resp.status_code))
+        attempt += 1
+
+
+_timings = deque(maxlen=TIMINGS_BUFFER_SIZE)
+
+
+def endpoint_of(url):
+    """Return the logical endpoint of `url`, i.e. the host and the first two
+    segments of the path, in which segments that look like an ID, date or
+    programme slug, i.e. contain a digit or a dash, are replaced by '*'.
+
+    """
+    parts = urlsplit(url)
+    segments = ['*' if '-' in seg or any(c.isdigit() for c in seg) else seg
+                for seg in parts.path.split('/')[1:3]]
+    return '/'.join([parts.hostname or '', *segments]).rstrip('/')
+
+
+class _RequestTimer:
+    """Collects the timing of a single request into a record, which is added
+    to the ring buffer of timings when the request has finished.
+
+    Times are in seconds: 'connect' is the time to open new connections,
+    including DNS lookup and TLS handshake, 'ttfb' the time from sending the
+    request to receiving the response headers, excluding connect, 'transfer'
+    the time to download the body, and 'total' the time of the whole request,
+    including retries.
+
+    """
+    def __init__(self, method, url):
+        _connect_state.count = 0
+        _connect_state.duration = 0.0
+        self.start = time.monotonic()
+        self.headers_received = None
+        self.record = {'time': round(time.time(), 3),
+                       'method': method.upper(),
+                       'host': urlsplit(url).hostname,
+                       'endpoint': endpoint_of(url),
+                       'status': None,
+                       'reused': None,
+                       'connect': None,
+                       'ttfb': None,
+                       'transfer': None,
+                       'total': None,
+                       'size': None,
+                       'error': None}
+
+    def response(self, resp, stream=False):
+        """Register the receipt of `resp`. Unless the response is streamed,
+        its body has already been read and the record is finished.
+
+        """
+        self.headers_received = now = time.monotonic()
+        connect_time = _connect_state.duration
+        record = self.record
+        record['status'] = resp.status_code
+        record['reused'] = _connect_state.count == 0
+        record['connect'] = round(connect_time, 4)
+        elapsed = resp.elapsed.total_seconds()
+        record['ttfb'] = round(max(0.0, elapsed - connect_time), 4)
+        if stream:
+            resp.timer = self
+        else:
+            content = resp.content
+            # The body is read by requests after `elapsed` has been measured.
+            record['transfer'] = round(max(0.0, now - self.start - elapsed), 4)
+            self.finish(len(content) if content else 0)
+
+    def failed(self, err):
+        self.record['error'] = type(err).__name__
+        self.finish(None)
+
+    def finish(self, size):
+        now = time.monotonic()
+        record = self.record
+        if self.headers_received is not None and record['transfer'] is None:
+            record['transfer'] = round(now - self.headers_received, 4)
+        record['total'] = round(now - self.start, 4)
+        record['size'] = size
+        _timings.append(record)
+
+
+def request_timings():
+    """Return a list of the timing records of the most recent requests, oldest first."""
+    return list(_timings)
+
+
+def reset_timings():
+    _timings.clear()
+
+
+def export_timings(file_path=None):
+    """Write the timing records as JSON lines to `file_path`, by default a file
+    in the addon's profile directory. Return the path of the file written.
+
+    """
+    if file_path is None:
+        file_path = os.path.join(utils.addon_info.profile, TIMINGS_FILE_NAME)
+    with open(file_path, 'w') as f:
+        for record in request_timings():
+            f.write(json.dumps(record))
+            f.write('\n')
+    return file_path
+
+
+def _percentile(values, percent):
+    """Return the `percent` percentile of the sorted list `values` by the nearest-rank method."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def timing_summary():
+    """Return a dict with, per endpoint, the number of requests and failures,
+    the fraction of requests on a reused connection, the number of bytes
+    received, and the 50th and 95th percentile of each of the timings.
+
+    """
+    per_endpoint = {}
+    for record in request_timings():
+        per_endpoint.setdefault(record['endpoint'], []).append(record)
+
+    summary = {}
+    for endpoint, records in per_endpoint.items():
+        entry = {'requests': len(records),
+                 'errors': sum(1 for r in records if r['error'] or (r['status'] or 0) >= 400),
+                 'reused': round(sum(1 for r in records if r['reused']) / len(records), 3),
+                 'bytes': sum(r['size'] or 0 for r in records)}
+        for name in ('connect', 'ttfb', 'transfer', 'total'):
+            values = sorted(r[name] for r in records if r[name] is not None)
+            entry[name] = {'p50': _percentile(values, 50), 'p95': _percentile(values, 95)}
+        summary[endpoint] = entry
+    return summary
+
+
+def web_request(method, url, headers=None, data=None, max_retries=None, **kwargs):
+    """Make an HTTP request and return the response.
+
+    Idempotent requests are retried on connection errors and temporary server
+    errors at most `max_retries` times, or MAX_RETRIES if `max_retries` is None.
+    Requests to a host that has failed repeatedly raise HostUnavailableError
+    for a while. HTTP errors and other failures raise FetchError or one of its
+    subclasses.
+    """
     http_session = HttpSession()
     kwargs.setdefault('timeout', WEB_TIMEOUT)
-    logger.debug("Making %s request to %s", method, url)
+    timer = _RequestTimer(method, url)
     try:
-        resp = http_session.request(method, url, json=data, headers=headers, **kwargs)
+        try:
+            resp = _send(http_session, method, url, max_retries, json=data, headers=headers, **kwargs)
+        except requests.RequestException as e:
+            timer.failed(e)
+            raise
+        timer.response(resp, kwargs.get('stream', False))
         resp.raise_for_status()
         return resp
     except requests.HTTPError as e:
@@ -279,8 +1300,76 @@ def web_request(method, url, headers=None, data=None, **kwargs):
     except requests.RequestException as e:
         logger.error('Error connecting to %s: %r', url, e)
         raise FetchError(str(e)) from None
-    finally:
-        http_session.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker_state = threading.local()
+
+
+def _init_worker():
+    _worker_state.is_worker = True
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix='viwx-fetch', initializer=_init_worker)
+        return _executor
+
+
+def _call(func):
+    try:
+        return func(), None
+    except Exception as err:
+        return None, err
+
+
+def call_many(calls, return_exceptions=False):
+    """Call each of the callables in `calls` concurrently on a bounded thread pool
+    and return a list of their results in the order of `calls`.
+
+    Requests made by the calls share the pooled connections of the HttpSession.
+
+    If any call raises an exception, the first exception in order of `calls` is
+    raised once all calls have completed. If `return_exceptions` is True, the
+    exception is put in the list in place of the result instead.
+
+    Calls made from within a call are executed sequentially, so calls never
+    wait for a thread of the pool that is itself waiting.
+    """
+    calls = list(calls)
+    if len(calls) < 2 or getattr(_worker_state, 'is_worker', False):
+        outcomes = [_call(func) for func in calls]
+    else:
+        executor = _get_executor()
+        outcomes = [future.result() for future in [executor.submit(_call, func) for func in calls]]
+
+    results = []
+    for result, err in outcomes:
+        if err is not None:
+            if not return_exceptions:
+                raise err
+            result = err
+        results.append(result)
+    return results
+
+
+def get_many(urls, headers=None, return_exceptions=False, **kwargs):
+    """Like get_document(), but GET all `urls` concurrently and return the
+    documents in order of `urls`. See call_many() for the handling of errors.
+
+    """
+    return call_many((partial(get_document, url, headers, **kwargs) for url in urls), return_exceptions)
+
+
+def get_json_many(urls, headers=None, return_exceptions=False, **kwargs):
+    """Like get_json(), but GET all `urls` concurrently and return the
+    data in order of `urls`. See call_many() for the handling of errors.
+
+    """
+    return call_many((partial(get_json, url, headers, **kwargs) for url in urls), return_exceptions)
 
 
 def post_json(url, data, headers=None, **kwargs):
@@ -338,3 +1427,94 @@ def get_document(url, headers=None, **kwargs):
     resp = web_request('GET', url, headers, **kwargs)
     resp.encoding = 'utf8'
     return resp.text
+
+
+def conditional_get(url, validators=None, headers=None, **kwargs):
+    """Make a GET request that is conditional on the `validators` returned by
+    a previous call for the same resource.
+
+    Return a tuple (response, validators). If the server reports that the
+    resource has not been modified, response is None and the validators passed
+    in remain valid. Validators are None if the response has none.
+    """
+    req_headers = dict(headers) if headers else {}
+    if validators:
+        if 'etag' in validators:
+            req_headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            req_headers['If-Modified-Since'] = validators['last_modified']
+    resp = web_request('GET', url, req_headers, **kwargs)
+    if resp.status_code == 304:     # Not Modified
+        logger.debug("Document %s has not been modified", url)
+        if kwargs.get('stream'):
+            # Read the (empty) body, so the connection is returned to the pool
+            # and the request's timing is recorded.
+            _consume_stream(resp, lambda chunks: None)
+        return None, validators
+
+    new_validators = {}
+    etag = resp.headers.get('ETag')
+    if etag:
+        new_validators['etag'] = etag
+    last_modified = resp.headers.get('Last-Modified')
+    if last_modified:
+        new_validators['last_modified'] = last_modified
+    return resp, new_validators or None
+
+
+def _consume_stream(resp, consumer):
+    """Pass an iterator over the chunks of the body of streamed response `resp`
+    to `consumer`, and return its result. The response is closed afterwards.
+
+    """
+    timer = getattr(resp, 'timer', None)
+    size = 0
+
+    def count_bytes(chunk_iter):
+        nonlocal size
+        for chunk in chunk_iter:
+            size += len(chunk)
+            yield chunk
+
+    try:
+        chunks = count_bytes(resp.iter_content(STREAM_CHUNK_SIZE))
+        result = consumer(chunks)
+        drained = 0
+        for chunk in chunks:
+            drained += len(chunk)
+            if drained > STREAM_DRAIN_LIMIT:
+                logger.debug("Closing connection with an unread remainder of document %s", resp.url)
+                break
+        return result
+    except requests.RequestException as e:
+        logger.error('Error reading from %s: %r', resp.url, e)
+        if timer:
+            timer.record['error'] = type(e).__name__
+        raise FetchError(str(e)) from None
+    finally:
+        resp.close()
+        if timer:
+            timer.finish(size)
+
+
+def stream_document(url, consumer, headers=None, **kwargs):
+    """GET a document and return the result of `consumer`, which is called with
+    an iterator over the (decompressed) body of the response in chunks of bytes.
+
+    Only as much of the document is downloaded as `consumer` needs, save for a
+    small remainder that is read to be able to reuse the connection.
+    """
+    resp = web_request('GET', url, headers, stream=True, **kwargs)
+    return _consume_stream(resp, consumer)
+
+
+def stream_document_if_modified(url, consumer, validators=None, headers=None, **kwargs):
+    """Like stream_document(), but conditional on the validators of a previous request.
+
+    Return a tuple (result, validators). Result is None, and `consumer` is not
+    called, if the document has not been modified since the validators were obtained.
+    """
+    resp, validators = conditional_get(url, validators, headers, stream=True, **kwargs)
+    if resp is None:
+        return None, validators
+    return _consume_stream(resp, consumer), validators
@@ -15,6 +15,7 @@ from codequick.support import logger_id
 
 from . import utils
 from . import fetch
+from . import cache
 from . import kodi_utils
 from .errors import *
 
@@ -162,6 +163,8 @@ class ItvSession:
             logger.info("Sign in successful.")
             self.parse_token(session_data.get('access_token'))
             self.save_account_data()
+            # Possibly another user has signed in.
+            cache.invalidate(cache.TAG_USER)
             return True
 
     def refresh(self):
@@ -205,6 +208,7 @@ class ItvSession:
         self._user_id = None
         self._user_nickname = None
         self._tv_region = None
+        cache.invalidate(cache.TAG_USER)
         return True
 
     def parse_token(self, token):
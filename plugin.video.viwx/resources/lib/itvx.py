@@ -7,11 +7,13 @@
 # ----------------------------------------------------------------------------------------------------------------------
 
 import time
+import hashlib
 import logging
 
-import requests
 import xbmc
 
+from functools import partial
+from operator import itemgetter
 from datetime import datetime, timezone, timedelta
 
 from codequick.support import logger_id
@@ -21,6 +23,7 @@ from . import fetch
 from . import parsex
 from . import cache
 from . import itv_account
+from . import utils
 
 from .itv import get_live_schedule
 from .utils import ZoneInfo
@@ -32,28 +35,95 @@ logger = logging.getLogger(logger_id + '.itvx')
 FEATURE_SET = ('hd,progressive,single-track,mpeg-dash,widevine,widevine-download,'
                'inband-ttml,hls,aes,inband-webvtt,outband-webvtt,inband-audio-description')
 PLATFORM_TAG = 'ctv'
+DIGEST_CACHE_TIME = 30 * 86400
+# The maximum time to cache parsed listings that contain live items.
+LIVE_LISTING_TIME = 60
 
+MY_LIST_TAGS = (cache.TAG_USER, cache.TAG_MYLIST)
+RECOMMENDED_TAGS = (cache.TAG_USER, cache.TAG_RECOMMENDED)
 
-def get_page_data(url, cache_time=None):
+
+def get_page_data(url, cache_time=None, max_stale=0, projection=None):
     """Return the json data embedded in a <script> tag on a html page.
 
     Return the data from cache if present and not expired, or request the page by HTTP.
+    Data of cached pages is read-only, since it is shared with all subsequent callers.
+
+    Cached pages that have expired less than `max_stale` seconds ago are returned
+    immediately, while the page is refreshed in the background. Expired pages are
+    revalidated with the server using ETag or Last-Modified, if available.
+
+    If `projection` is given, only the parts of the data at those key paths are
+    returned and cached, see parsex.project(). The rest is discarded right after
+    the page has been parsed.
     """
+    url = _page_url(url)
+    if projection:
+        projection = tuple(sorted(projection))
+    if cache_time:
+        key = '{}#{}'.format(url, ','.join(projection)) if projection else url
+        return cache.get_or_fetch(key, partial(_fetch_page_data, url, projection), cache_time, max_stale,
+                                  conditional=True, persistent=True, frozen=True)
+    page_data = fetch.stream_document(url, parsex.scrape_json_stream)[0]
+    return parsex.project(page_data, projection) if projection else page_data
+
+
+def _page_url(url):
     if not url.startswith('https://'):
         url = 'https://www.itv.com' + url
-
     # URL's with a trailing space have actually happened, but the web app doesn't seem to have a problem with it.
-    url = url.rstrip()
-    if cache_time:
-        cached_data = cache.get_item(url)
-        if cached_data:
-            return cached_data
+    return url.rstrip()
 
-    html_doc = fetch.get_document(url)
-    data = parsex.scrape_json(html_doc)
-    if cache_time:
-        cache.set_item(url, data, cache_time)
-    return data
+
+def _fetch_page_data(url, projection, validators):
+    """Request a page conditionally and return a tuple (page data, validators).
+    Page data is cache.NOT_MODIFIED if the page has not changed since `validators`
+    were obtained, in which case the page is neither downloaded, nor parsed.
+
+    A digest of the page's complete data is cached for use by _parsed_listing().
+    """
+    result, validators = fetch.stream_document_if_modified(url, parsex.scrape_json_stream, validators)
+    if result is None:
+        return cache.NOT_MODIFIED, validators
+    page_data, digest = result
+    if projection:
+        # The digest must belong to the data _parsed_listing() gets from cache,
+        # which is the complete data, possibly of another version of the page.
+        return parsex.project(page_data, projection), validators
+    cache.set_item('digest ' + url, digest, DIGEST_CACHE_TIME, persistent=True)
+    return page_data, validators
+
+
+def _parsed_listing(url, cache_time, max_stale, listing_time, parser, *args):
+    """Get the data of the page at `url` and return the list of items produced
+    by `parser(page_data, *args)`.
+
+    Parsed listings are cached for `listing_time` seconds by the digest of the
+    page's data and the version of the parsers, so a listing is not parsed again
+    when a page is refreshed, but has not changed. Pages without a known digest
+    are just parsed.
+
+    Listings with live items are cached for LIVE_LISTING_TIME only, since the
+    parsed live items depend on the current time, e.g. whether they are on now.
+    """
+    # Obtain the digest before the page data, to ensure a listing can never be
+    # cached under the digest of newer data that a background refresh has just stored.
+    # If no digest was known yet, use that of the page that has just been fetched.
+    url = _page_url(url)
+    digest = cache.get_item('digest ' + url)
+    page_data = get_page_data(url, cache_time=cache_time, max_stale=max_stale)
+    if digest is None:
+        digest = cache.get_item('digest ' + url)
+    if digest is None:
+        return list(parser(page_data, *args))
+    key = 'parsed {}#{}:{}:{}{!r}'.format(url, parsex.PARSER_VERSION, digest, parser.__name__, args)
+    listing = cache.get_item(key)
+    if listing is None:
+        listing = list(parser(page_data, *args))
+        if any(item and item['type'] == 'simulcastspot' for item in listing):
+            listing_time = min(listing_time, LIVE_LISTING_TIME)
+        cache.set_item(key, listing, listing_time, persistent=True, frozen=True)
+    return listing
 
 
 def get_now_next_schedule(local_tz=None):
@@ -115,15 +185,15 @@ def get_live_channels(local_tz=None):
     Programme start times will be presented in the user's local time zone.
 
     """
-    cached_schedule = cache.get_item('live_schedule')
-    if cached_schedule:
-        return cached_schedule
+    return cache.get_or_fetch('live_schedule', partial(_fetch_live_channels, local_tz), expire_time=240, max_stale=900)
+
 
+def _fetch_live_channels(local_tz):
     if local_tz is None:
         local_tz = ZoneInfo('Europe/London')
 
-    schedule = get_now_next_schedule(local_tz)
-    main_schedule = get_live_schedule(6, local_tz=local_tz)
+    schedule, main_schedule = fetch.call_many((partial(get_now_next_schedule, local_tz),
+                                               partial(get_live_schedule, 6, local_tz=local_tz)))
 
     # Replace the schedule of the main channels with the longer one obtained from get_live_schedule().
     for channel in schedule:
@@ -135,7 +205,6 @@ def get_live_channels(local_tz=None):
                 if main_chan['channel']['name'] == chan_id:
                     channel['slot'] = main_chan['slot']
                     break
-    cache.set_item('live_schedule', schedule, expire_time=240)
     return schedule
 
 
@@ -146,10 +215,11 @@ def get_full_schedule():
     """
     today = datetime.now(timezone.utc)
     all_days = (today + timedelta(i) for i in range(-7, 8))
-    # schedules = (get_page_data('watch/tv-guide/' + day.strftime('%Y-%m-%d')) for day in all_days)
+    all_pages = fetch.call_many(partial(get_page_data, '/watch/tv-guide/' + day.strftime('%Y-%m-%d'),
+                                        projection=('tvGuideData',))
+                                for day in all_days)
     schedule = {}
-    for day in all_days:
-        page_data = get_page_data('/watch/tv-guide/' + day.strftime('%Y-%m-%d'))
+    for page_data in all_pages:
         guide = page_data['tvGuideData']
         for chan_name, progr_list in guide.items():
             chan_schedule = schedule.setdefault(chan_name, [])
@@ -158,8 +228,11 @@ def get_full_schedule():
 
 
 def main_page_items():
-    main_data = get_page_data('https://www.itv.com', cache_time=None)
+    # Hero items of live programmes depend on the current time.
+    return _parsed_listing('https://www.itv.com', 600, 3600, 600, _parse_main_page)
 
+
+def _parse_main_page(main_data):
     hero_content = main_data.get('heroContent')
     if hero_content:
         for hero_data in hero_content:
@@ -182,16 +255,19 @@ def main_page_items():
         logger.warning("Main page has no 'News' slider.")
 
 
-def collection_content(url=None, slider=None, hide_paid=False):
+def collection_content(url, slider=None, hide_paid=False):
     """Obtain the collection page defined by `url` and return the contents. If `slider`
     is not None, return the contents of that particular slider on the collection page.
 
     """
-    uk_tz = ZoneInfo('Europe/London')
     time_fmt = ' '.join((xbmc.getRegion('dateshort'), xbmc.getRegion('time')))
     is_main_page = url == 'https://www.itv.com'
+    return _parsed_listing(url, 3600 if is_main_page else 43200, 43200, 86400,
+                           _parse_collection, url, slider, hide_paid, time_fmt)
 
-    page_data = get_page_data(url, cache_time=3600 if is_main_page else 43200)
+
+def _parse_collection(page_data, url, slider, hide_paid, time_fmt):
+    uk_tz = ZoneInfo('Europe/London')
 
     if slider:
         # Return the contents of the specified slider
@@ -277,12 +353,12 @@ def episodes(url, use_cache=False, prefer_bsl=False):
         if cached_data is not None:
             return cached_data['series_map'], cached_data['programme_id']
 
-    page_data = get_page_data(url, cache_time=0)
+    page_data = get_page_data(url, cache_time=0, projection=('programme', 'seriesList'))
     programme = page_data['programme']
     programme_id = programme.get('encodedProgrammeId', {}).get('underscore')
     programme_title = programme['title']
-    programme_thumb = programme['image'].format(**parsex.IMG_PROPS_THUMB)
-    programme_fanart = programme['image'].format(**parsex.IMG_PROPS_FANART)
+    programme_thumb = parsex.thumb_url(programme['image'])
+    programme_fanart = parsex.fanart_url(programme['image'])
     description = programme.get('longDescription') or programme.get('description') or programme_title
     if 'FREE' in programme['tier']:
         brand_description = description
@@ -319,13 +395,13 @@ def episodes(url, use_cache=False, prefer_bsl=False):
             [parsex.parse_episode_title(episode, programme_fanart, prefer_bsl) for episode in series['titles']])
 
     programme_data = {'programme_id': programme_id, 'series_map': series_map}
-    cache.set_item(url, programme_data, expire_time=1800)
+    cache.set_item(url, programme_data, expire_time=1800, persistent=True, frozen=True, compress=True)
     return series_map, programme_id
 
 
 def categories():
     """Return all available category names."""
-    data = get_page_data('https://www.itv.com/watch/categories', cache_time=86400)
+    data = get_page_data('https://www.itv.com/watch/categories', cache_time=86400, projection=('subnav',))
     cat_list = data['subnav']['items']
     return ({'label': cat['label'], 'params': {'path': cat['url']}} for cat in cat_list)
 
@@ -343,33 +419,32 @@ def category_news(path):
 
 
 def category_content(url: str, hide_paid=False):
-    """Return all programmes in a category"""
-    cached_data = cache.get_item(url)
-    if cached_data and cached_data['hide_paid'] == hide_paid:
-        return cached_data['items_list']
+    """Return all programmes in a category, sorted by title.
 
-    cat_data = get_page_data(url + '/all', cache_time=0)
+    Programmes are returned as utils.LazyItems, so only those that are
+    actually listed are parsed. The category's page data is cached.
+    """
+    cat_data = get_page_data(url + '/all', cache_time=3600, projection=('category.id', 'programmes'))
     category = cat_data['category']['id']
     progr_list = cat_data.get('programmes')
 
-    parse_progr = parsex.parse_category_item
-
     if hide_paid:
-        items = [parse_progr(prog, category) for prog in progr_list if 'FREE' in prog['tier']]
-    else:
-        items = [parse_progr(prog, category) for prog in progr_list]
-    items.sort(key=lambda prog: prog['show']['info']['sorttitle'])
-    cache.set_item(url, {'items_list': items, 'hide_paid': hide_paid}, expire_time=3600)
-    return items
+        progr_list = [prog for prog in progr_list if 'FREE' in prog['tier']]
+    sorted_progs = sorted(((parsex.sort_title(prog['title']), prog) for prog in progr_list), key=itemgetter(0))
+    return utils.LazyItems([prog for _, prog in sorted_progs],
+                           [title for title, _ in sorted_progs],
+                           partial(parsex.parse_category_item, category_id=category))
 
 
 def category_news_content(url, sub_cat, rail=None, hide_paid=False):
     """Return the content of one of the news sub categories."""
-    page_data = get_page_data(url, cache_time=900)
-    news_sub_cats = page_data['data']
+    time_fmt = ' '.join((xbmc.getRegion('dateshort'), xbmc.getRegion('time')))
+    return _parsed_listing(url, 900, 0, 3600, _parse_news_content, sub_cat, rail, hide_paid, time_fmt)
+
 
+def _parse_news_content(page_data, sub_cat, rail, hide_paid, time_fmt):
+    news_sub_cats = page_data['data']
     uk_tz = ZoneInfo('Europe/London')
-    time_fmt = ' '.join((xbmc.getRegion('dateshort'), xbmc.getRegion('time')))
 
     # A normal listing of TV shows in the category News, like normal category content
     if sub_cat == 'longformData':
@@ -406,7 +481,7 @@ def get_playlist_url_from_episode_page(page_url, prefer_bsl=False):
 
     """
     logger.info("Get playlist from episode page - url=%s", page_url)
-    data = get_page_data(page_url)
+    data = get_page_data(page_url, projection=('episode', 'seriesList'))
 
     try:
         # news, specials and normal episodes (The latter only occurs when not
@@ -428,39 +503,45 @@ def search(search_term, hide_paid=False):
     When no search result are found itvX returns either HTTP status 204, or
     a normal json object with an emtpy list of results.
 
+    Results are cached in memory for a short while by the normalised search
+    term and `hide_paid`, so returning to a search, or repeating one from
+    Kodi's search history, does not make a new request. The cache key holds a
+    hash of the search term, so all searches share the cache statistics of
+    prefix 'search' and search terms do not end up in the statistics.
+
     """
+    query = ' '.join(search_term.lower().split())
+    key = 'search_{:d}{}'.format(hide_paid, hashlib.sha1(query.encode('utf8')).hexdigest())
+    results = cache.get_or_fetch(key, partial(_fetch_search_results, query, hide_paid),
+                                 expire_time=300, frozen=True)
+    if results is None:
+        return None
+    return (result for result in results)
+
+
+def _fetch_search_results(query, hide_paid):
     from urllib.parse import quote
     url = ('https://textsearch.prd.oasvc.itv.com/search?broadcaster=itv&channelType=simulcast&'
            'featureSet=clearkey,outband-webvtt,hls,aes,playready,widevine,fairplay,bbts,progressive,hd,rtmpe&'
-           'platform=dotcom&query={}&size=24').format(quote(search_term.lower()))
-    headers = {
-        'User-Agent': fetch.USER_AGENT,
-        'accept': 'application/json',
-        'Origin': 'https://www.itv.com',
-        'Referer': 'https://www.itv.com/',
-        'accept-language': 'en-GB,en;q=0.5',
-        'Sec-Fetch-Dest': 'empty',
-        'Sec-Fetch-Mode': 'cors',
-        'Sec-Fetch-Site': 'same-site',
-    }
-    resp = requests.get(url, headers=headers, timeout=fetch.WEB_TIMEOUT)
-
-    if resp.status_code != 200:
-        logger.debug("Search for '%s' (hide_paid=%s) failed with HTTP status %s",
-                     search_term, hide_paid, resp.status_code)
-        return None
-
+           'platform=dotcom&query={}&size=24').format(quote(query))
     try:
-        data = resp.json()
-    except:
-        logger.warning("Search for '%s' (hide_paid=%s) returned non-json content: '%s'",
-                       search_term, hide_paid, resp.content)
+        data = fetch.get_json(url)
+    except errors.ParseError:
+        logger.warning("Search for '%s' (hide_paid=%s) returned non-json content", query, hide_paid)
+        return None
+    except (errors.HttpError, errors.AuthenticationError, errors.GeoRestrictedError,
+            errors.AccessRestrictedError) as err:
+        logger.debug("Search for '%s' (hide_paid=%s) failed: %r", query, hide_paid, err)
         return None
 
+    if data is None:
+        logger.debug("Search for '%s' (hide_paid=%s) returned no content", query, hide_paid)
+        return None
     results = data.get('results')
     if not results:
-        logger.debug("Search for '%s' returned an empty list of results. (hide_paid=%s)", search_term, hide_paid)
-    return (parsex.parse_search_result(result, hide_paid) for result in results)
+        logger.debug("Search for '%s' returned an empty list of results. (hide_paid=%s)", query, hide_paid)
+        return []
+    return [parsex.parse_search_result(result, hide_paid) for result in results]
 
 
 def my_list(user_id, programme_id=None, operation='', offer_login=True, use_cache=True):
@@ -472,13 +553,20 @@ def my_list(user_id, programme_id=None, operation='', offer_login=True, use_cach
         url = 'https://my-list.prd.user.itv.com/user/{}/mylist/programme/{}?features={}&platform=ctv&size=52'.format(
             user_id, programme_id, FEATURE_SET)
     else:
-        cached_list = cache.get_item('mylist_' + user_id)
-        if use_cache and cached_list is not None:
-            return cached_list
-        else:
-            url = 'https://my-list.prd.user.itv.com/user/{}/mylist?features={}&platform=ctv&size=52'.format(
-                user_id, FEATURE_SET)
+        url = 'https://my-list.prd.user.itv.com/user/{}/mylist?features={}&platform=ctv&size=52'.format(
+            user_id, FEATURE_SET)
+        if use_cache:
+            # Never offer to sign in from a refresh in the background.
+            return cache.get_or_fetch('mylist_' + user_id, partial(_fetch_my_list, url, operation, offer_login),
+                                      expire_time=1800, max_stale=3600, tags=MY_LIST_TAGS,
+                                      refresher=partial(_fetch_my_list, url, operation, False))
+
+    my_list_items = _fetch_my_list(url, operation, offer_login)
+    cache.set_item('mylist_' + user_id, my_list_items, 1800, max_stale=3600, tags=MY_LIST_TAGS)
+    return my_list_items
+
 
+def _fetch_my_list(url, operation, offer_login):
     fetcher = {
         'get': fetch.get_json,
         'add': fetch.post_json,
@@ -490,7 +578,6 @@ def my_list(user_id, programme_id=None, operation='', offer_login=True, use_cach
         my_list_items = list(filter(None, (parsex.parse_my_list_item(item) for item in data)))
     else:
         my_list_items = []
-    cache.set_item('mylist_' + user_id, my_list_items, 1800)
     cache.my_list_programmes = list(item['programme_id'] for item in my_list_items)
     return my_list_items
 
@@ -534,7 +621,7 @@ def get_last_watched():
         watched_list = [parsex.parse_last_watched_item(item, utc_now) for item in data]
     else:
         watched_list = []
-    cache.set_item(cache_key, watched_list, 600)
+    cache.set_item(cache_key, watched_list, 600, tags=(cache.TAG_USER,))
     return watched_list
 
 
@@ -566,13 +653,11 @@ def recommended(user_id, hide_paid=False):
     """
     recommended_url = 'https://recommendations.prd.user.itv.com/recommendations/homepage/' + user_id
 
-    recom_dta = cache.get_item(recommended_url)
+    req_params = {'features': FEATURE_SET, 'platform': PLATFORM_TAG, 'size': 24, 'version': 3}
+    recom_dta = cache.get_or_fetch(recommended_url, partial(fetch.get_json, recommended_url, params=req_params),
+                                   expire_time=43200, max_stale=43200, tags=RECOMMENDED_TAGS)
     if not recom_dta:
-        req_params = {'features': FEATURE_SET, 'platform': PLATFORM_TAG, 'size': 24, 'version': 3}
-        recom_dta = fetch.get_json(recommended_url, params=req_params)
-        if not recom_dta:
-            return None
-        cache.set_item(recommended_url, recom_dta, 43200)
+        return None
     return list(filter(None, (parsex.parse_my_list_item(item, hide_paid) for item in recom_dta)))
 
 
@@ -590,7 +675,7 @@ def because_you_watched(user_id, name_only=False, hide_paid=False):
         byw = fetch.get_json(byw_url, params=req_params)
         if not byw:
             return None
-        cache.set_item(byw_url, byw, 1800)
+        cache.set_item(byw_url, byw, 1800, tags=RECOMMENDED_TAGS)
 
     if name_only:
         return byw['watched_programme']
@@ -9,6 +9,7 @@ import logging
 import typing
 import string
 import sys
+from urllib.parse import urlsplit
 
 import requests
 import xbmc
@@ -145,11 +146,21 @@ class Paginator:
             if len(filter_char) == 1:
                 # filter on a single character
                 filter_char = filter_char.lower()
-                shows_list = [prog for prog in shows_list if prog['show']['info']['sorttitle'][0] == filter_char]
+
+                def keep(sort_title):
+                    return sort_title[0] == filter_char
             else:
                 # like '0-9'. Return anything not starting with a letter
                 filter_chars = string.ascii_lowercase
-                shows_list = [prog for prog in shows_list if prog['show']['info']['sorttitle'][0] not in filter_chars]
+
+                def keep(sort_title):
+                    return sort_title[0] not in filter_chars
+
+            if isinstance(shows_list, utils.LazyItems):
+                # Filter on sort titles, without parsing the items.
+                shows_list = shows_list.filter(keep)
+            else:
+                shows_list = [prog for prog in shows_list if keep(prog['show']['info']['sorttitle'])]
             logger.debug("Filtering on '%s' produced %s items", filter_char, len(shows_list))
 
         if page_len:
@@ -631,13 +642,34 @@ def update_mylist(_, progr_id, operation, refresh=True):
             kodi_utils.msg_dlg('Failed to remove this item from My List', 'My List Error')
         return
     logger.info("Updated MyList: %s programme %s", operation, progr_id)
+    # Recommendations take the programmes in My List into account.
+    cache.invalidate(cache.TAG_RECOMMENDED)
     if refresh:
         xbmc.executebuiltin('Container.Refresh')
 
 
+def _prewarm_connections(plugin_url):
+    """Open connections to the hosts the route of `plugin_url` is likely to
+    request, while the route itself is being set up.
+
+    """
+    route = urlsplit(plugin_url).path.rstrip('/').rsplit('/', 1)[-1] or 'root'
+    hosts = prewarm_hosts.get(route)
+    if hosts:
+        fetch.prewarm(hosts)
+
+
 def run():
+    cache_mb = utils.addon_info.addon.getSettingInt('cache_max_mb')
+    if cache_mb:
+        cache.set_limits(max_bytes=cache_mb * 1024 * 1024)
+    fetch.dns_cache.enabled = utils.addon_info.addon.getSettingBool('dns_cache')
+    if utils.addon_info.addon.getSettingBool('prewarm_connections'):
+        _prewarm_connections(sys.argv[0])
     if isinstance(cc_run(), Exception):
         xbmcplugin.endOfDirectory(int(sys.argv[1]), False)
+    # The listing has been passed to Kodi by now, so saving doesn't delay it.
+    fetch.save_cookies()
     # Due to reuselanguageinvoker the addon may have been updated, while it still
     # keeps running the old version. Exit with non-zero status to force the current
     # LanguageInvoker thread to end.
@@ -668,3 +700,26 @@ callb_map = {
     'title': play_title,
     'vodstream': play_stream_catchup
 }
+
+
+"""
+Mapping of route names to the hosts a route is likely to request first.
+Used to open connections in advance when setting 'prewarm_connections' is enabled.
+"""
+
+prewarm_hosts = {
+    'root': ('www.itv.com',),
+    'sub_menu_my_itvx': ('content.prd.user.itv.com', 'recommendations.prd.user.itv.com'),
+    'generic_list': ('my-list.prd.user.itv.com', 'content.prd.user.itv.com', 'recommendations.prd.user.itv.com'),
+    'sub_menu_live': ('nownext.oasvc.itv.com', 'scheduled.oasvc.itv.com'),
+    'list_collections': ('www.itv.com',),
+    'list_collection_content': ('www.itv.com',),
+    'list_categories': ('www.itv.com',),
+    'list_category': ('www.itv.com',),
+    'list_news_sub_category': ('www.itv.com',),
+    'list_productions': ('www.itv.com',),
+    'do_search': ('textsearch.prd.oasvc.itv.com',),
+    'play_stream_live': ('simulcast.itv.com',),
+    'play_stream_catchup': ('magni.itv.com', 'content.prd.user.itv.com'),
+    'play_title': ('www.itv.com', 'magni.itv.com', 'content.prd.user.itv.com'),
+}
@@ -9,7 +9,9 @@
 import json
 import logging
 import re
+import hashlib
 from datetime import datetime, timezone
+from functools import lru_cache
 from urllib.parse import urlencode
 
 from codequick.support import logger_id
@@ -22,6 +24,10 @@ from .errors import ParseError
 TXT_PLAY_FROM_START = 30620
 TXT_VIEW_ALL_EPISODES = 30803
 
+# Increment on every change of the parse functions that alters their output.
+# Parsed listings cached by earlier versions will then no longer be used.
+PARSER_VERSION = 1
+
 logger = logging.getLogger(logger_id + '.parse')
 
 # NOTE: The resolutions below are those specified by Kodi for their respective usage. There is no guarantee that
@@ -39,13 +45,40 @@ IMG_PROPS_FANART = {'treatment': '', 'aspect_ratio': '16x9', 'class': '01_Hero_D
 
 url_trans_table = str.maketrans(' ', '-', '#/?:\'')
 
+# The maximum number of image URLs and slugs kept by each of the caches below.
+# Large enough to hold all items of the largest category.
+TEMPLATE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def thumb_url(img_template: str) -> str:
+    """Return the URL of an image of `img_template` sized as thumbnail."""
+    return img_template.format_map(IMG_PROPS_THUMB)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def fanart_url(img_template: str) -> str:
+    """Return the URL of an image of `img_template` sized as fanart."""
+    return img_template.format_map(IMG_PROPS_FANART)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def poster_url(img_template: str) -> str:
+    """Return the URL of an image of `img_template` sized as poster."""
+    return img_template.format_map(IMG_PROPS_POSTER)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def programme_slug(programme: str) -> str:
+    """Return the programme's title in the form used in the URLs of ITVX's web pages."""
+    return (programme.lower()
+                     .replace('&', 'and')
+                     .replace(' - ', '-')
+                     .translate(url_trans_table))
+
 
 def build_url(programme, programme_id, episode_id=None):
-    progr_slug = (programme.lower()
-                           .replace('&', 'and')
-                           .replace(' - ', '-')
-                           .translate(url_trans_table))
-    base_url = ('https://www.itv.com/watch/' + progr_slug)
+    base_url = ('https://www.itv.com/watch/' + programme_slug(programme))
     if episode_id:
         return '/'.join((base_url, programme_id, episode_id))
     else:
@@ -86,21 +119,103 @@ def ctx_mnu_watch_from_start(chan_id, start_time):
     return utils.addon_info.localise(TXT_PLAY_FROM_START), cmd
 
 
+# The start of the script tag holding the page's data, and the end of any script tag.
+NEXT_DATA_START = b'<script id="__NEXT_DATA__" type="application/json">'
+SCRIPT_END = b'</script>'
+_NEXT_DATA_START_STR = NEXT_DATA_START.decode()
+_SCRIPT_END_STR = SCRIPT_END.decode()
+
+
 def scrape_json(html_page):
     # noinspection GrazieInspection
     """Return the json data embedded in a script tag on an html page"""
-    result = re.search(r'<script id="__NEXT_DATA__" type="application/json">(.+?)</script>', html_page, flags=re.DOTALL)
-    if result:
-        json_str = result[1]
-        try:
-            data = json.loads(json_str)
-            return data['props']['pageProps']
-        except (json.JSONDecodeError, KeyError, TypeError) as e:
-            logger.warning("__NEXT_DATA__ in HTML page has unexpected format: %r", e)
-            raise ParseError('Invalid data received')
+    return scrape_json_and_digest(html_page)[0]
+
+
+def scrape_json_and_digest(html_page):
+    """Return a tuple of the json data embedded in a script tag on an html page
+    and a digest of that data in its original json form.
+
+    The page can be given as a string, or as the UTF-8 encoded bytes of the
+    response, which is faster, since only the json data is decoded then.
+    """
+    if isinstance(html_page, str):
+        start_tag, end_tag = _NEXT_DATA_START_STR, _SCRIPT_END_STR
+    else:
+        start_tag, end_tag = NEXT_DATA_START, SCRIPT_END
+    start = html_page.find(start_tag)
+    if start >= 0:
+        start += len(start_tag)
+        end = html_page.find(end_tag, start)
+        if end > start:
+            if isinstance(html_page, str):
+                return _load_next_data(html_page[start:end].encode('utf8'))
+            return _load_next_data(html_page[start:end])
+    raise ParseError('No data available')
+
+
+def scrape_json_stream(chunks):
+    """Like scrape_json_and_digest(), but read the html page from an iterable
+    of chunks of UTF-8 encoded bytes.
+
+    The script tag is searched for at the byte level, and only its contents
+    are retained and decoded. Iteration stops as soon as the end of the script
+    tag has been found, so the rest of the page need not be read at all.
+    """
+    buffer = bytearray()
+    found_start = False
+    search_pos = 0
+    for chunk in chunks:
+        buffer += chunk
+        if not found_start:
+            start = buffer.find(NEXT_DATA_START)
+            if start < 0:
+                # Keep only what could be the first part of a start tag split over two chunks.
+                del buffer[:-len(NEXT_DATA_START)]
+                continue
+            found_start = True
+            del buffer[:start + len(NEXT_DATA_START)]
+        end = buffer.find(SCRIPT_END, search_pos)
+        if end >= 0:
+            return _load_next_data(buffer[:end])
+        search_pos = max(0, len(buffer) - len(SCRIPT_END) + 1)
     raise ParseError('No data available')
 
 
+def _load_next_data(json_doc: bytes):
+    """Return a tuple of the page properties in `json_doc` and a digest of `json_doc`."""
+    try:
+        data = json.loads(json_doc)
+        return data['props']['pageProps'], hashlib.sha1(json_doc).hexdigest()
+    except (ValueError, KeyError, TypeError) as e:
+        # ValueError includes JSONDecodeError and UnicodeDecodeError.
+        logger.warning("__NEXT_DATA__ in HTML page has unexpected format: %r", e)
+        raise ParseError('Invalid data received')
+
+
+def project(data: dict, paths) -> dict:
+    """Return a new dict with only the items of `data` at the key `paths`.
+
+    A path is a string of dict keys separated by dots, like 'category.id'.
+    Paths do not descend into lists. Paths that are not present in `data` are
+    omitted. The items at the paths are not copied.
+
+    """
+    result = {}
+    for path in paths:
+        *parents, last_key = path.split('.')
+        src, dst = data, result
+        for key in parents:
+            src = src.get(key)
+            if not isinstance(src, dict):
+                break
+            dst = dst.setdefault(key, {})
+        else:
+            if last_key in src:
+                dst[last_key] = src[last_key]
+    return result
+
+
 def parse_simulcast_item(sim_dta: dict) -> dict:
     """Parse simulcast items from various sources like hero, search, etc"""
 
@@ -154,7 +269,7 @@ def parse_simulcast_item(sim_dta: dict) -> dict:
         'programme_id': None,
         'show': {
             'label': plain_title,
-            'art': {'thumb': img_link.format(**IMG_PROPS_THUMB)},
+            'art': {'thumb': thumb_url(img_link)},
             'info': {'plot': plot,
                      'title': title},
             'params': {'channel': channel},
@@ -183,14 +298,14 @@ def parse_hero_content(hero_data):
 
         item = {
             'label': title,
-            'art': {'thumb': hero_data['imageTemplate'].format(**IMG_PROPS_THUMB),
-                    'fanart': hero_data['imageTemplate'].format(**IMG_PROPS_FANART)},
+            'art': {'thumb': thumb_url(hero_data['imageTemplate']),
+                    'fanart': fanart_url(hero_data['imageTemplate'])},
             'info': {'title': ''.join(('[B][COLOR orange]', title, '[/COLOR][/B]'))}
         }
 
         brand_img = hero_data.get('brandImageTemplate')
         if brand_img:
-            item['art']['fanart'] = brand_img.format(**IMG_PROPS_FANART)
+            item['art']['fanart'] = fanart_url(brand_img)
 
         if item_type == 'fastchannelspot':
             item['params'] = {'channel': hero_data['channel'], 'url': None}
@@ -354,8 +469,8 @@ def parse_collection_item(show_data, hide_paid=False):
         img = show_data.get('imageTemplate') or show_data.get('imageUrl', '')
         programme_item = {
             'label': title,
-            'art': {'thumb': img.format(**IMG_PROPS_THUMB),
-                    'fanart': img.format(**IMG_PROPS_FANART)},
+            'art': {'thumb': thumb_url(img),
+                    'fanart': fanart_url(img)},
             'info': {'title': title if is_playable else '[B]{}[/B] {}'.format(title, content_info),
                      'plot': plot,
                      'sorttitle': sort_title(title)},
@@ -370,7 +485,7 @@ def parse_collection_item(show_data, hide_paid=False):
                                         show_data.get('encodedEpisodeId', {}).get('letterA'))}
 
         if 'FILMS' in show_data.get('categories', ''):
-            programme_item['art']['poster'] = show_data['imageTemplate'].format(**IMG_PROPS_POSTER)
+            programme_item['art']['poster'] = poster_url(show_data['imageTemplate'])
 
         if is_playable:
             programme_item['info']['duration'] = utils.duration_2_seconds(content_info)
@@ -435,7 +550,7 @@ def parse_shortform_item(item_data, time_zone, time_fmt, hide_paid=False):
             'type': 'title',
             'show': {
                 'label': title,
-                'art': {'thumb': item_data['imageUrl'].format(**IMG_PROPS_THUMB)},
+                'art': {'thumb': thumb_url(item_data['imageUrl'])},
                 'info': {'plot': plot, 'sorttitle': sort_title(title), 'duration': item_data.get('duration')},
                 'params': {'url': url}
             }
@@ -469,8 +584,8 @@ def parse_category_item(prog, category_id):
 
     programme_item = {
         'label': title,
-        'art': {'thumb': prog['imageTemplate'].format(**IMG_PROPS_THUMB),
-                'fanart': prog['imageTemplate'].format(**IMG_PROPS_FANART)},
+        'art': {'thumb': thumb_url(prog['imageTemplate']),
+                'fanart': fanart_url(prog['imageTemplate'])},
         'info': {'title': title if is_playable
                           else '[B]{}[/B] {}'.format(title, prog['contentInfo'] if not playtime else ''),
                  'plot': plot,
@@ -480,7 +595,7 @@ def parse_category_item(prog, category_id):
     # Currently the films category has id 'FILM' while in other data the plural 'FILMS' is used.
     # Ensure a future change to 'FILMS' will not break the add-on again.
     if category_id and 'FILM' in category_id:
-        programme_item['art']['poster'] = prog['imageTemplate'].format(**IMG_PROPS_POSTER)
+        programme_item['art']['poster'] = poster_url(prog['imageTemplate'])
 
     if is_playable:
         programme_item['info']['duration'] = playtime
@@ -527,8 +642,8 @@ def parse_item_type_collection(item_data):
     img_template = item_data.get('imageTemplate') or item_data['partnershipTileImageTemplate']
     item = {
         'label': title,
-        'art': {'thumb': img_template.format(**IMG_PROPS_THUMB),
-                'fanart': img_template.format(**IMG_PROPS_FANART)},
+        'art': {'thumb': thumb_url(img_template),
+                'fanart': fanart_url(img_template)},
         'info': {'title': '[B]{}[/B]'.format(title),
                  'plot': descr,
                  'sorttitle': sort_title(title)},
@@ -583,9 +698,9 @@ def parse_episode_title(title_data, brand_fanart=None, prefer_bsl=False):
 
     title_obj = {
         'label': title,
-        'art': {'thumb': img_url.format(**IMG_PROPS_THUMB),
+        'art': {'thumb': thumb_url(img_url),
                 'fanart': brand_fanart,
-                # 'poster': img_url.format(**IMG_PROPS_POSTER)
+                # 'poster': poster_url(img_url)
                 },
         'info': {'title': info_title,
                  'plot': plot,
@@ -654,7 +769,7 @@ def parse_search_result(search_data, hide_paid=False):
         'programme_id': api_prod_id,
         'show': {
             'label': prog_name,
-            'art': {'thumb': img_url.format(**IMG_PROPS_THUMB)},
+            'art': {'thumb': thumb_url(img_url)},
             'info': {'plot': plot,
                      'title': title},
             'params': {'url': build_url(prog_name, api_prod_id.replace('_', 'a'), api_episode_id.replace('/', 'a'))}
@@ -684,8 +799,8 @@ def parse_my_list_item(item, hide_paid=False):
             'programme_id': progr_id,
             'show': {
                 'label': progr_name,
-                'art': {'thumb': img_link.format(**IMG_PROPS_THUMB),
-                        'fanart': img_link.format(**IMG_PROPS_FANART)},
+                'art': {'thumb': thumb_url(img_link),
+                        'fanart': fanart_url(img_link)},
                 'info': {'title': progr_name if is_playable else '[B]{}[/B]{}'.format(progr_name, content_info),
                          'plot':  description,
                          'duration': utils.iso_duration_2_seconds(item.get('duration')),
@@ -695,7 +810,7 @@ def parse_my_list_item(item, hide_paid=False):
             }
         }
         if item['contentType'] == 'FILM':
-            item_dict['show']['art']['poster'] = img_link.format(**IMG_PROPS_POSTER)
+            item_dict['show']['art']['poster'] = poster_url(img_link)
         return item_dict
     except:
         logger.warning("Unexpected error parsing MyList item:\n", exc_info=True)
@@ -744,8 +859,8 @@ def parse_last_watched_item(item, utc_now):
         'programme_id': progr_id,
         'show': {
             'label': episode_name or progr_name,
-            'art': {'thumb': img_link.format(**IMG_PROPS_THUMB),
-                    'fanart': img_link.format(**IMG_PROPS_FANART)},
+            'art': {'thumb': thumb_url(img_link),
+                    'fanart': fanart_url(img_link)},
             'info': {'title': title,
                      'plot': info,
                      'sorttitle': sort_title(title),
@@ -767,7 +882,7 @@ def parse_last_watched_item(item, utc_now):
         }
     }
     if item['contentType'] == 'FILM':
-        item_dict['show']['art']['poster'] = img_link.format(**IMG_PROPS_POSTER)
+        item_dict['show']['art']['poster'] = poster_url(img_link)
     elif item['contentType'] == 'EPISODE' and progr_id:
         item_dict['ctx_mnu'] = [ctx_mnu_all_episodes(progr_id)]
     return item_dict
@@ -28,6 +28,7 @@ TXT_EXPORT_FAIL = 30625
 TXT_IMPORT_SUCCESS = 30626
 TXT_IMPORT_INVALID_DATA = 30627
 TXT_IMPORT_FAILED_REFRESH = 30268
+TXT_CACHE_STATS_SAVED = 30629
 
 
 @Script.register()
@@ -212,3 +213,28 @@ def change_logger(_):
 
     addon_log.set_log_handler(handler_type)
     addon_data.setSettingString('log-handler', handler_name)
+
+
+@Script.register()
+def cache_diagnostics(_):
+    """Callback for settings->general->cache_diagnostics.
+    Save statistics of the data cache, of the reuse of HTTP connections, of the
+    DNS cache and a summary of the timings of HTTP requests as JSON to a file
+    in the addon's profile directory. The timings of the individual requests are exported as well.
+
+    """
+    import os
+    from resources.lib import cache
+    from resources.lib import fetch
+    from resources.lib import utils
+
+    stats = cache.statistics()
+    stats['connections'] = fetch.connection_stats()
+    stats['dns'] = fetch.dns_cache.statistics()
+    stats['requests'] = fetch.timing_summary()
+    fetch.export_timings()
+    file_path = os.path.join(utils.addon_info.profile, 'cache_stats.json')
+    with open(file_path, 'w') as f:
+        json.dump(stats, f, indent=4)
+    logger.info("Saved cache statistics to '%s'.", file_path)
+    kodi_utils.msg_dlg(TXT_CACHE_STATS_SAVED, file_path=file_path)
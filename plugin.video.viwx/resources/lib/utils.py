@@ -9,6 +9,7 @@ from __future__ import annotations
 import logging
 import time
 import string
+from collections.abc import Sequence
 from datetime import datetime
 
 try:
@@ -233,6 +234,45 @@ def paginate(items: list, page_nr: int, page_len: int, merge_count: int = 5) ->
         return items[start:end + merge_count], None
 
 
+class LazyItems(Sequence):
+    """A list of items of a listing that are parsed only when accessed.
+
+    Holds the raw data of the items together with their sort titles, so the
+    list can be filtered, paginated and divided in A-Z sections without
+    parsing items that are not listed. An item is produced by `parser(raw_item)`
+    on first access. `sort_titles` must be the sort titles the parser gives
+    the items. Slices and filtered lists are LazyItems as well.
+
+    """
+    def __init__(self, raw_items: list, sort_titles: list[str], parser):
+        self._raw_items = raw_items
+        self.sort_titles = sort_titles
+        self._parser = parser
+        self._parsed = [None] * len(raw_items)
+
+    def __len__(self):
+        return len(self._raw_items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._subset(range(len(self._raw_items))[index])
+        item = self._parsed[index]
+        if item is None:
+            item = self._parsed[index] = self._parser(self._raw_items[index])
+        return item
+
+    def filter(self, predicate) -> LazyItems:
+        """Return the items for which `predicate(sort_title)` is true."""
+        return self._subset([idx for idx, title in enumerate(self.sort_titles) if predicate(title)])
+
+    def _subset(self, indexes) -> LazyItems:
+        subset = LazyItems([self._raw_items[idx] for idx in indexes],
+                           [self.sort_titles[idx] for idx in indexes],
+                           self._parser)
+        subset._parsed = [self._parsed[idx] for idx in indexes]
+        return subset
+
+
 def list_start_chars(items: list) -> list[str]:
     """Return a list of all starting character present in the sorttitles in the list `items`.
 
@@ -240,7 +280,10 @@ def list_start_chars(items: list) -> list[str]:
     characters that have actual items.
 
     """
-    start_chars = set(item['show']['info']['sorttitle'][0].upper() for item in items)
+    if isinstance(items, LazyItems):
+        start_chars = set(title[0].upper() for title in items.sort_titles)
+    else:
+        start_chars = set(item['show']['info']['sorttitle'][0].upper() for item in items)
     az_chars = list(string.ascii_uppercase)
     char_list = sorted(start_chars.intersection(az_chars))
     if start_chars.difference(char_list):
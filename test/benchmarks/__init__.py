@@ -0,0 +1,7 @@
+# ----------------------------------------------------------------------------------------------------------------------
+#  Copyright (c) 2025 Dimitri Kroon.
+#  This file is part of plugin.video.viwx.
+#  SPDX-License-Identifier: GPL-2.0-or-later
+#  See LICENSE.txt
+# ----------------------------------------------------------------------------------------------------------------------
+
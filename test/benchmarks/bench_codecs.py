@@ -0,0 +1,83 @@
+# ----------------------------------------------------------------------------------------------------------------------
+#  Copyright (c) 2025 Dimitri Kroon.
+#  This file is part of plugin.video.viwx.
+#  SPDX-License-Identifier: GPL-2.0-or-later
+#  See LICENSE.txt
+# ----------------------------------------------------------------------------------------------------------------------
+
+"""
+Compare the codecs of the data cache on the json documents in test_docs/html.
+
+For each document and codec it prints the memory used by the document as a
+python structure, the size of the encoded blob, and the time it takes to store
+an item and to retrieve it as a frozen structure. For reference, the first rows
+of each document are for storing and retrieving uncompressed, frozen and copied data.
+
+Run from the project's root directory, like:
+
+    python -m test.benchmarks.bench_codecs [number of repeats]
+
+"""
+
+from test.support import fixtures
+fixtures.global_setup()
+
+import os
+import sys
+import glob
+import json
+import timeit
+from copy import deepcopy
+
+from resources.lib import cache
+
+from test.support.testutils import doc_path
+
+
+def best_of(func, repeat):
+    """Return the fastest time of `repeat` calls of `func` in milliseconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def bench_document(file_name, repeat):
+    with open(file_name, 'r') as f:
+        data = json.load(f)
+    mem_size = cache._estimate_size(data)
+    frozen = cache.freeze(data)
+
+    results = [('frozen', mem_size, best_of(lambda: cache.freeze(data), repeat), 0.0),
+               ('copied', mem_size, best_of(lambda: deepcopy(data), repeat), best_of(lambda: deepcopy(data), repeat))]
+    for name in cache.codecs():
+        codec = cache._codecs[name]
+        blob = codec.encode(frozen)
+        results.append((name,
+                        sys.getsizeof(blob),
+                        best_of(lambda: codec.encode(frozen), repeat),
+                        best_of(lambda: cache.freeze(codec.decode(blob)), repeat)))
+    return mem_size, results
+
+
+def main(repeat=5):
+    print('{:<40} {:<14} {:>10} {:>7} {:>10} {:>10}'.format(
+        'document', 'codec', 'bytes', 'ratio', 'store ms', 'hit ms'))
+    totals = {}
+    for file_name in sorted(glob.glob(os.path.join(doc_path('html'), '*.json'))):
+        mem_size, results = bench_document(file_name, repeat)
+        doc_name = os.path.basename(file_name)
+        for name, size, store_time, hit_time in results:
+            print('{:<40} {:<14} {:>10} {:>7.2f} {:>10.2f} {:>10.2f}'.format(
+                doc_name, name, size, size / mem_size, store_time, hit_time))
+            doc_name = ''
+            total = totals.setdefault(name, [0, 0, 0.0, 0.0])
+            total[0] += mem_size
+            total[1] += size
+            total[2] += store_time
+            total[3] += hit_time
+    print()
+    for name, (mem_size, size, store_time, hit_time) in totals.items():
+        print('{:<40} {:<14} {:>10} {:>7.2f} {:>10.2f} {:>10.2f}'.format(
+            'total', name, size, size / mem_size, store_time, hit_time))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,97 @@
+# ----------------------------------------------------------------------------------------------------------------------
+#  Copyright (c) 2025 Dimitri Kroon.
+#  This file is part of plugin.video.viwx.
+#  SPDX-License-Identifier: GPL-2.0-or-later
+#  See LICENSE.txt
+# ----------------------------------------------------------------------------------------------------------------------
+
+"""
+Benchmark the fetch layer end to end over real sockets, using a local
+stand-in of ITVX's servers with simulated latency and a slow transfer.
+
+Compares
+    - new connections for each request vs. pooled connections,
+    - sequential vs. concurrent requests,
+    - reading a whole page and parsing it vs. streaming and scraping only its data.
+
+Run from the project's root directory, like:
+
+    python -m test.benchmarks.bench_fetch [repeat [latency_ms [chunk_delay_ms]]]
+
+"""
+
+from test.support import fixtures
+fixtures.global_setup()
+
+import sys
+import timeit
+
+from resources.lib import fetch
+from resources.lib import parsex
+
+from test.support.local_server import LocalItvServer
+
+
+CHUNK_SIZE = 16 * 1024
+
+NOWNEXT_URL = 'https://nownext.oasvc.itv.com/channels'
+PAGE_URLS = ['https://www.itv.com/watch/categories/{}/all'.format(cat)
+             for cat in ('children', 'drama-soaps', 'factual', 'films', 'sport')]
+MAIN_PAGE_URL = 'https://www.itv.com'
+
+
+def best_of(func, repeat):
+    """Return the fastest time of `repeat` calls of `func` in milliseconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def new_connections():
+    for _ in range(5):
+        fetch.close_session()
+        fetch.get_json(NOWNEXT_URL)
+
+
+def pooled_connections():
+    for _ in range(5):
+        fetch.get_json(NOWNEXT_URL)
+
+
+def sequential_pages():
+    for url in PAGE_URLS:
+        fetch.stream_document(url, parsex.scrape_json_stream)
+
+
+def concurrent_pages():
+    fetch.call_many([lambda u=url: fetch.stream_document(u, parsex.scrape_json_stream) for url in PAGE_URLS])
+
+
+def full_page():
+    parsex.scrape_json(fetch.web_request('GET', MAIN_PAGE_URL).content)
+
+
+def streamed_page():
+    fetch.stream_document(MAIN_PAGE_URL, parsex.scrape_json_stream)
+
+
+def main(repeat=5, latency_ms=50, chunk_delay_ms=5):
+    benchmarks = (
+        ('5 requests, new connections', new_connections),
+        ('5 requests, pooled connections', pooled_connections),
+        ('5 pages, sequential', sequential_pages),
+        ('5 pages, concurrent', concurrent_pages),
+        ('main page, read whole', full_page),
+        ('main page, streamed', streamed_page),
+    )
+    server = LocalItvServer(delay=latency_ms / 1000, chunk_size=CHUNK_SIZE, chunk_delay=chunk_delay_ms / 1000)
+    with server, server.redirect():
+        print('{:<40} {:>10} {:>12}'.format('benchmark', 'ms', 'connections'))
+        for name, func in benchmarks:
+            # Warm up and open connections.
+            func()
+            server.reset_counters()
+            duration = best_of(func, repeat)
+            print('{:<40} {:>10.1f} {:>12}'.format(name, duration, server.connections))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,81 @@
+# ----------------------------------------------------------------------------------------------------------------------
+#  Copyright (c) 2025 Dimitri Kroon.
+#  This file is part of plugin.video.viwx.
+#  SPDX-License-Identifier: GPL-2.0-or-later
+#  See LICENSE.txt
+# ----------------------------------------------------------------------------------------------------------------------
+
+"""
+Time the addon's routes from route, via fetch, to parsing, without network.
+
+All HTTP requests are served from the responses recorded in a directory, by
+default the test documents in test_docs, as listed in test_docs/recordings.json.
+Each route is run with an empty cache (cold) and again with the cache filled
+by the previous run (warm). Latency and bandwidth of the simulated network
+can be given to get an idea of the time spent waiting for the network.
+
+Run from the project's root directory, like:
+
+    python -m test.benchmarks.bench_routes [repeat [latency_ms [bandwidth_kbps [recordings_dir]]]]
+
+Responses of the real web can be recorded for use with this benchmark by
+calling `fetch.set_transport(fetch.TRANSPORT_RECORD, directory)` before
+browsing the addon.
+
+"""
+
+from test.support import fixtures
+fixtures.global_setup()
+
+import sys
+import timeit
+
+from resources.lib import cache
+from resources.lib import fetch
+from resources.lib import main
+
+from test.support.testutils import doc_path
+
+
+ROUTES = (
+    ('root', main.root, {}),
+    ('sub_menu_live', main.sub_menu_live, {}),
+    ('list_categories', main.list_categories, {}),
+    ('list_category drama-soaps', main.list_category, {'path': '/watch/categories/drama-soaps'}),
+    ('list_category news', main.list_category, {'path': '/watch/categories/news'}),
+    ('list_productions', main.list_productions, {'url': 'https://www.itv.com/watch/midsomer-murders/Ya1096'}),
+    ('do_search', main.do_search, {'search_query': 'midsomer'}),
+)
+
+
+def run_route(route, kwargs):
+    # A route returns a generator, or a list of items. Consume all items to run it completely.
+    result = route.test(**kwargs)
+    return list(result) if result else result
+
+
+def cold_run(route, kwargs):
+    cache.purge()
+    return timeit.timeit(lambda: run_route(route, kwargs), number=1)
+
+
+def main_bench(repeat=5, latency_ms=0, bandwidth_kbps=0, recordings_dir=None):
+    fetch.set_transport(fetch.TRANSPORT_REPLAY,
+                        recordings_dir or doc_path(''),
+                        latency=latency_ms / 1000,
+                        bandwidth=bandwidth_kbps * 1000 / 8 or None)
+    fetch.reset_timings()
+    print('{:<30} {:>10} {:>10} {:>10}'.format('route', 'cold ms', 'warm ms', 'requests'))
+    for name, route, kwargs in ROUTES:
+        nr_of_requests = len(fetch.request_timings())
+        cold_time = min(cold_run(route, kwargs) for _ in range(repeat))
+        nr_of_requests = (len(fetch.request_timings()) - nr_of_requests) // repeat
+        warm_time = min(timeit.repeat(lambda: run_route(route, kwargs), number=1, repeat=repeat))
+        print('{:<30} {:>10.2f} {:>10.2f} {:>10}'.format(name, cold_time * 1000, warm_time * 1000, nr_of_requests))
+    cache.purge()
+    fetch.set_transport(fetch.TRANSPORT_LIVE)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main_bench(*(int(arg) for arg in args[:3]), *args[3:4])
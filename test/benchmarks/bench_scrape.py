@@ -0,0 +1,92 @@
+# ----------------------------------------------------------------------------------------------------------------------
+#  Copyright (c) 2025 Dimitri Kroon.
+#  This file is part of plugin.video.viwx.
+#  SPDX-License-Identifier: GPL-2.0-or-later
+#  See LICENSE.txt
+# ----------------------------------------------------------------------------------------------------------------------
+
+"""
+Compare ways of scraping the __NEXT_DATA__ from the HTML pages in test_docs/html.
+
+For each page it prints the time and peak memory allocated to get the page's
+data from the body of the response as received, i.e. as UTF-8 encoded bytes:
+
+    - regex: decode the whole page and search it with a regular expression,
+      the way pages used to be scraped,
+    - str: decode the whole page and scrape the string,
+    - bytes: scrape the bytes and decode only the json data,
+    - stream: scrape the bytes in chunks, like pages streamed from the web.
+
+Run from the project's root directory, like:
+
+    python -m test.benchmarks.bench_scrape [number of repeats]
+
+"""
+
+from test.support import fixtures
+fixtures.global_setup()
+
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+from resources.lib import fetch
+from resources.lib import parsex
+
+from test.support.testutils import doc_path
+
+
+PAGES = ('index.html', 'film.html')
+
+
+def scrape_regex(page):
+    result = re.search(r'<script id="__NEXT_DATA__" type="application/json">(.+?)</script>',
+                       page.decode('utf8'), flags=re.DOTALL)
+    return parsex._load_next_data(result[1].encode('utf8'))
+
+
+def scrape_str(page):
+    return parsex.scrape_json_and_digest(page.decode('utf8'))
+
+
+def scrape_bytes(page):
+    return parsex.scrape_json_and_digest(page)
+
+
+def scrape_stream(page):
+    chunk_size = fetch.STREAM_CHUNK_SIZE
+    return parsex.scrape_json_stream(page[i:i + chunk_size] for i in range(0, len(page), chunk_size))
+
+
+def best_of(func, repeat):
+    """Return the fastest time of `repeat` calls of `func` in milliseconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def peak_memory(func):
+    """Return the peak of memory allocated during a call of `func` in kB."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def main(repeat=20):
+    scrapers = (('regex', scrape_regex), ('str', scrape_str), ('bytes', scrape_bytes), ('stream', scrape_stream))
+    print('{:<20} {:>10} {:<10} {:>10} {:>12}'.format('page', 'kB', 'scraper', 'ms', 'peak kB'))
+    for page_name in PAGES:
+        with open(os.path.join(doc_path('html'), page_name), 'rb') as f:
+            page = f.read()
+        name, size = page_name, '{:.0f}'.format(len(page) / 1024)
+        for scraper_name, scraper in scrapers:
+            print('{:<20} {:>10} {:<10} {:>10.2f} {:>12.0f}'.format(
+                name, size, scraper_name, best_of(lambda: scraper(page), repeat), peak_memory(lambda: scraper(page))))
+            name = size = ''
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
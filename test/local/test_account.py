@@ -22,6 +22,7 @@ from resources.lib import errors
 from resources.lib import itv_account
 from resources.lib import fetch
 from resources.lib import utils
+from resources.lib import cache
 
 from test.support.object_checks import has_keys
 from test.support.testutils import is_uuid, HttpResponse, SessionMock
@@ -158,6 +159,13 @@ class TestLogin(unittest.TestCase):
         has_keys(headers, 'user-agent', 'accept', 'accept-language', 'accept-encoding', 'content-type',
                  'origin', 'referer', 'sec-fetch-dest', 'sec-fetch-mode', 'sec-fetch-site', 'priority', 'te')
 
+    @patch('requests.post', return_value=HttpResponse(content=b'{"access_token": "new_token", "refresh_token": "new_refresh"}'))
+    def test_login_invalidates_user_data(self, _, __):
+        ct_sess = itv_account.ItvSession()
+        with patch('resources.lib.cache.invalidate') as p_invalidate:
+            ct_sess.login('my_name', 'my_passw')
+        p_invalidate.assert_called_once_with(cache.TAG_USER)
+
     def test_login_encounters_http_errors(self, p_save):
         # with patch('requests.post', side_effect=errors.AuthenticationError):
         #     ct_sess = itv_account.ItvSession()
@@ -416,6 +424,13 @@ class Misc(unittest.TestCase):
         self.assertEqual('', ct_sess.user_id)
         self.assertEqual('', ct_sess.user_nickname)
 
+    @patch("resources.lib.itv_account.ItvSession.save_account_data")
+    def test_logout_invalidates_user_data(self, _):
+        ct_sess = itv_account.ItvSession()
+        with patch('resources.lib.cache.invalidate') as p_invalidate:
+            ct_sess.log_out()
+        p_invalidate.assert_called_once_with(cache.TAG_USER)
+
     @patch('resources.lib.itv_account.ItvSession.read_account_data')
     def test_parse_token(self, _):
         access_tkn, _, __ = build_test_tokens('My username')
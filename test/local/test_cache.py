@@ -7,7 +7,11 @@
 from test.support import fixtures
 fixtures.global_setup()
 
+import time
 import unittest
+import sqlite3
+import threading
+from unittest.mock import patch, Mock
 
 from resources.lib import cache
 
@@ -64,3 +68,661 @@ class TestCache(unittest.TestCase):
         item1 = cache.get_item('1')
         item2 = cache.get_item('1')
         self.assertIsNot(item1, item2)
+
+
+class TestMemoryLimits(unittest.TestCase):
+    def setUp(self):
+        cache.purge()
+
+    def tearDown(self):
+        cache.set_limits(cache.DFLT_MAX_ITEMS, cache.DFLT_MAX_BYTES)
+        cache.purge()
+
+    def test_evict_least_recently_used_on_max_items(self):
+        cache.set_limits(max_items=3)
+        for key in ('1', '2', '3'):
+            cache.set_item(key, key, 10)
+        # use item 1, so 2 becomes the least recently used
+        cache.get_item('1')
+        cache.set_item('4', '4', 10)
+        self.assertEqual(3, cache.size())
+        self.assertIsNone(cache.get_item('2'))
+        for key in ('1', '3', '4'):
+            self.assertEqual(key, cache.get_item(key))
+
+    def test_evict_on_max_bytes(self):
+        cache.set_limits(max_bytes=1000)
+        evictions = cache.residency()['evictions']
+        cache.set_item('1', 'a', 10, size=400)
+        cache.set_item('2', 'b', 10, size=400)
+        cache.set_item('3', 'c', 10, size=400)
+        self.assertEqual(2, cache.size())
+        self.assertIsNone(cache.get_item('1'))
+        residency = cache.residency()
+        self.assertEqual(800, residency['bytes'])
+        self.assertEqual(evictions + 1, residency['evictions'])
+
+    def test_item_larger_than_max_bytes_is_not_cached(self):
+        cache.set_limits(max_bytes=1000)
+        cache.set_item('1', 'a', 10, size=400)
+        cache.set_item('2', 'b', 10, size=1200)
+        self.assertEqual(0, cache.size())
+        self.assertEqual(0, cache.residency()['bytes'])
+
+    def test_lower_limits_evicts_immediately(self):
+        for key in ('1', '2', '3'):
+            cache.set_item(key, key, 10)
+        cache.set_limits(max_items=1)
+        self.assertEqual(1, cache.size())
+        self.assertEqual('3', cache.get_item('3'))
+
+    def test_replace_item_updates_size(self):
+        cache.set_item('1', 'a', 10, size=400)
+        cache.set_item('1', 'b', 10, size=100)
+        self.assertEqual(100, cache.residency()['bytes'])
+
+    def test_estimated_size(self):
+        cache.set_item('1', {'a': [1, 2, 3], 'b': 'some text'})
+        small = cache.residency()['bytes']
+        self.assertGreater(small, 0)
+        cache.set_item('2', {'a': list(range(1000))})
+        self.assertGreater(cache.residency()['bytes'] - small, 1000 * 8)
+
+    def test_clean_ignores_replaced_items(self):
+        cache.set_item('1', 'old', -10)
+        cache.set_item('1', 'new', 10)
+        cache.clean()
+        self.assertEqual('new', cache.get_item('1'))
+        cache.set_item('2', 'a', -10)
+        cache.clean()
+        self.assertEqual(1, cache.size())
+
+
+class TestFrozenItems(unittest.TestCase):
+    data = {'a': [1, {'b': 2}], 'c': ({'d': [3]},)}
+
+    def setUp(self):
+        cache.purge()
+
+    def test_frozen_item_is_not_copied(self):
+        cache.set_item('1', self.data, 10, frozen=True)
+        item1 = cache.get_item('1')
+        item2 = cache.get_item('1')
+        self.assertIs(item1, item2)
+        self.assertDictEqual(self.data, item1)
+        self.assertIsInstance(item1, dict)
+        self.assertIsInstance(item1['a'], list)
+
+    def test_frozen_item_is_read_only(self):
+        cache.set_item('1', self.data, 10, frozen=True)
+        item = cache.get_item('1')
+        with self.assertRaises(TypeError):
+            item['x'] = 1
+        with self.assertRaises(TypeError):
+            item.update({'x': 1})
+        with self.assertRaises(TypeError):
+            item['a'].append(1)
+        with self.assertRaises(TypeError):
+            item['a'][1].pop('b')
+        with self.assertRaises(TypeError):
+            del item['c'][0]['d'][0]
+
+    def test_original_data_does_not_alter_cache(self):
+        data = {'a': [1, 2]}
+        cache.set_item('1', data, 10, frozen=True)
+        data['a'].append(3)
+        self.assertListEqual([1, 2], cache.get_item('1')['a'])
+
+    def test_get_mutable_copy(self):
+        cache.set_item('1', self.data, 10, frozen=True)
+        item = cache.get_item('1', copy=True)
+        self.assertDictEqual(self.data, item)
+        item['a'].append(5)
+        self.assertListEqual([1, {'b': 2}], cache.get_item('1')['a'])
+        self.assertIs(type(item), dict)
+        self.assertIs(type(item['a'][1]), dict)
+
+    def test_freeze_and_thaw(self):
+        frozen = cache.freeze(self.data)
+        self.assertIs(frozen, cache.freeze(frozen))
+        self.assertIsInstance(frozen, cache.FrozenDict)
+        thawed = cache.thaw(frozen)
+        self.assertDictEqual(self.data, thawed)
+        self.assertIs(type(thawed['c'][0]), dict)
+
+    def test_frozen_data_can_be_copied_and_pickled(self):
+        import copy
+        import pickle
+        frozen = cache.freeze(self.data)
+        for cpy in (copy.deepcopy(frozen), pickle.loads(pickle.dumps(frozen))):
+            self.assertDictEqual(self.data, cpy)
+            self.assertIsInstance(cpy, cache.FrozenDict)
+            self.assertIsInstance(cpy['a'], cache.FrozenList)
+
+    def test_frozen_persistent_item(self):
+        cache.set_item('1', self.data, 10, persistent=True, frozen=True)
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            item = cache.get_item('1')
+            self.assertIs(item, cache.get_item('1'))
+            self.assertIsInstance(item, cache.FrozenDict)
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        cache.purge()
+
+    def tearDown(self):
+        cache.purge()
+
+    def test_persistent_item_survives_loss_of_memory_cache(self):
+        cache.set_item('p', {'a': [1, 2]}, 10, persistent=True)
+        cache.set_item('v', {'b': [3, 4]}, 10)
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertEqual(0, cache.size())
+            self.assertDictEqual({'a': [1, 2]}, cache.get_item('p'))
+            # The item is now back in memory
+            self.assertEqual(1, cache.size())
+            self.assertIsNone(cache.get_item('v'))
+
+    def test_persistent_item_keeps_data_types(self):
+        data = {1: ('a', 2.5), '1': None}
+        cache.set_item('p', data, 10, persistent=True)
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertDictEqual(data, cache.get_item('p'))
+
+    def test_expired_persistent_item(self):
+        cache.set_item('p', 'some data', -1, persistent=True)
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertIsNone(cache.get_item('p'))
+
+    def test_purge_clears_disk(self):
+        cache.set_item('p', 'some data', 10, persistent=True)
+        cache.purge()
+        self.assertIsNone(cache.get_item('p'))
+
+    def test_unpicklable_data_is_kept_in_memory_only(self):
+        data = {'f': lambda x: x}
+        cache.set_item('p', data, 10, persistent=True)
+        self.assertIs(data['f'], cache.get_item('p')['f'])
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertIsNone(cache.get_item('p'))
+
+    def test_database_error_disables_disk_cache(self):
+        with patch.object(cache._disk, '_open', side_effect=sqlite3.OperationalError):
+            with patch.object(cache._disk, '_db', new=None):
+                cache.set_item('p', 'some data', 10, persistent=True)
+                self.assertEqual('some data', cache.get_item('p'))
+        self.assertTrue(cache._disk._failed)
+        cache._disk._failed = False
+
+
+class SyncThread:
+    """Stand-in for threading.Thread that runs the target on start()."""
+    def __init__(self, target, args, daemon=None):
+        self.target = target
+        self.args = args
+
+    def start(self):
+        self.target(*self.args)
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+    def setUp(self):
+        cache.purge()
+
+    def tearDown(self):
+        cache.purge()
+
+    def test_fetch_on_miss_and_hit(self):
+        fetcher = Mock(return_value={'a': 1})
+        self.assertDictEqual({'a': 1}, cache.get_or_fetch('k', fetcher, 10))
+        self.assertDictEqual({'a': 1}, cache.get_or_fetch('k', fetcher, 10))
+        fetcher.assert_called_once()
+
+    def test_none_is_not_cached(self):
+        fetcher = Mock(return_value=None)
+        self.assertIsNone(cache.get_or_fetch('k', fetcher, 10))
+        self.assertIsNone(cache.get_or_fetch('k', fetcher, 10))
+        self.assertEqual(2, fetcher.call_count)
+
+    @patch('resources.lib.cache.threading.Thread', new=SyncThread)
+    def test_stale_item_is_returned_and_refreshed(self):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'old data', 10, max_stale=20)
+        fetcher = Mock(return_value='new data')
+        with patch('resources.lib.cache.time.monotonic', return_value=1015):
+            # Stale items are not returned by get_item()
+            self.assertIsNone(cache.get_item('k'))
+            self.assertEqual('old data', cache.get_or_fetch('k', fetcher, 10, max_stale=20))
+            fetcher.assert_called_once()
+            self.assertEqual('new data', cache.get_item('k'))
+
+    @patch('resources.lib.cache.threading.Thread')
+    def test_only_one_refresh_at_a_time(self, p_thread):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'old data', 10, max_stale=20)
+        with patch('resources.lib.cache.time.monotonic', return_value=1015):
+            cache.get_or_fetch('k', lambda: 'new data', 10, max_stale=20)
+            cache.get_or_fetch('k', lambda: 'new data', 10, max_stale=20)
+        p_thread.assert_called_once()
+        cache._in_flight.clear()
+
+    @patch('resources.lib.cache.threading.Thread', new=SyncThread)
+    def test_failed_refresh_keeps_stale_data(self):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'old data', 10, max_stale=20)
+        fetcher = Mock(side_effect=ValueError)
+        with patch('resources.lib.cache.time.monotonic', return_value=1015):
+            self.assertEqual('old data', cache.get_or_fetch('k', fetcher, 10, max_stale=20))
+            self.assertEqual('old data', cache.get_or_fetch('k', fetcher, 10, max_stale=20))
+        self.assertEqual(2, fetcher.call_count)
+        self.assertFalse(cache._in_flight)
+
+    @patch('resources.lib.cache.threading.Thread', new=SyncThread)
+    def test_refresh_by_refresher(self):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'old data', 10, max_stale=20)
+        fetcher = Mock(return_value='new data')
+        refresher = Mock(return_value='refreshed data')
+        with patch('resources.lib.cache.time.monotonic', return_value=1015):
+            self.assertEqual('old data', cache.get_or_fetch('k', fetcher, 10, max_stale=20, refresher=refresher))
+            self.assertEqual('refreshed data', cache.get_item('k'))
+        fetcher.assert_not_called()
+        refresher.assert_called_once()
+
+    @patch('resources.lib.cache.threading.Thread', new=SyncThread)
+    def test_refresh_ended_by_system_exit(self):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'old data', 10, max_stale=20)
+        with patch('resources.lib.cache.time.monotonic', return_value=1015):
+            self.assertEqual('old data', cache.get_or_fetch('k', Mock(side_effect=SystemExit(1)), 10, max_stale=20))
+        self.assertFalse(cache._in_flight)
+
+    @patch('resources.lib.cache.threading.Thread')
+    def test_fetch_in_foreground_beyond_max_stale(self, p_thread):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'old data', 10, max_stale=20)
+        with patch('resources.lib.cache.time.monotonic', return_value=1031):
+            self.assertEqual('new data', cache.get_or_fetch('k', lambda: 'new data', 10, max_stale=20))
+        p_thread.assert_not_called()
+
+    @patch('resources.lib.cache.threading.Thread')
+    def test_max_stale_of_caller_applies(self, p_thread):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'old data', 10, max_stale=43200)
+        fetcher = Mock(return_value='new data')
+        with patch('resources.lib.cache.time.monotonic', return_value=1025):
+            self.assertEqual('new data', cache.get_or_fetch('k', fetcher, 10, max_stale=5))
+        fetcher.assert_called_once()
+        p_thread.assert_not_called()
+        # Within the max_stale of the caller
+        with patch('resources.lib.cache.time.monotonic', return_value=1038):
+            self.assertEqual('new data', cache.get_or_fetch('k', fetcher, 10, max_stale=20))
+        p_thread.assert_called_once()
+        cache._in_flight.clear()
+
+    @patch('resources.lib.cache.threading.Thread')
+    def test_stale_persistent_item(self, p_thread):
+        with patch('resources.lib.cache.time.time', return_value=time.time() - 15):
+            cache.set_item('k', 'old data', 10, persistent=True, max_stale=20)
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertIsNone(cache.get_item('k'))
+            self.assertEqual('old data', cache.get_or_fetch('k', lambda: 'new data', 10, max_stale=20))
+        p_thread.assert_called_once()
+        cache._in_flight.clear()
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        cache.purge()
+        self.release = threading.Event()
+        self.results = {}
+
+    def tearDown(self):
+        self.release.set()
+        cache.purge()
+
+    def fetcher(self, result=None, error=None):
+        def fetch():
+            self.release.wait(5)
+            if error:
+                raise error
+            return result
+        return Mock(side_effect=fetch)
+
+    def request(self, name, fetcher, **kwargs):
+        """Call get_or_fetch on a new thread and wait until a fetch of 'k' is in progress."""
+        def run():
+            try:
+                self.results[name] = cache.get_or_fetch('k', fetcher, 10, **kwargs)
+            except Exception as err:
+                self.results[name] = err
+        thread = threading.Thread(target=run)
+        thread.start()
+        for _ in range(500):
+            if 'k' in cache._in_flight:
+                break
+            time.sleep(0.01)
+        return thread
+
+    def wait_for(self, *threads):
+        time.sleep(0.05)
+        self.release.set()
+        for t in threads:
+            t.join(5)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        fetcher = self.fetcher({'a': [1]})
+        threads = [self.request(i, fetcher) for i in range(3)]
+        self.wait_for(*threads)
+        fetcher.assert_called_once()
+        self.assertEqual(3, len(self.results))
+        for result in self.results.values():
+            self.assertDictEqual({'a': [1]}, result)
+        # Each caller has its own copy of mutable data.
+        self.assertIsNot(self.results[0], self.results[1])
+        self.assertFalse(cache._in_flight)
+
+    def test_concurrent_misses_share_frozen_data(self):
+        fetcher = self.fetcher({'a': [1]})
+        threads = [self.request(i, fetcher, frozen=True) for i in range(2)]
+        self.wait_for(*threads)
+        fetcher.assert_called_once()
+        self.assertIs(self.results[0], self.results[1])
+
+    def test_concurrent_misses_share_an_exception(self):
+        fetcher = self.fetcher(error=ValueError('failed'))
+        threads = [self.request(i, fetcher) for i in range(2)]
+        self.wait_for(*threads)
+        fetcher.assert_called_once()
+        self.assertIsInstance(self.results[0], ValueError)
+        self.assertIs(self.results[0], self.results[1])
+        self.assertFalse(cache._in_flight)
+        # The failure is not cached.
+        self.assertEqual('data', cache.get_or_fetch('k', lambda: 'data', 10))
+
+    def test_miss_waits_for_background_refresh(self):
+        with patch('resources.lib.cache.time.monotonic', return_value=time.monotonic() - 15):
+            cache.set_item('k', 'old data', 10, max_stale=20)
+        refresher = self.fetcher('new data')
+        self.assertEqual('old data', cache.get_or_fetch('k', refresher, 10, max_stale=20))
+        # When the stale period ends during the refresh, a new request waits for the refresh.
+        fetcher = Mock()
+        with patch('resources.lib.cache.time.monotonic', return_value=time.monotonic() + 30):
+            thread = self.request('foreground', fetcher)
+            self.wait_for(thread)
+        fetcher.assert_not_called()
+        refresher.assert_called_once()
+        self.assertEqual('new data', self.results['foreground'])
+
+
+    @patch('resources.lib.cache.FLIGHT_TIMEOUT', 0.1)
+    def test_miss_stops_waiting_for_a_lost_fetch(self):
+        cache._join_flight('k')
+        self.assertEqual('data', cache.get_or_fetch('k', lambda: 'data', 10))
+        self.assertEqual('data', cache.get_item('k'))
+        cache._in_flight.clear()
+
+
+class TestRevalidation(unittest.TestCase):
+    def setUp(self):
+        cache.purge()
+
+    def tearDown(self):
+        cache.purge()
+
+    def test_not_modified_extends_lifetime(self):
+        fetcher = Mock(return_value=({'a': 1}, {'etag': 'abc'}))
+        stats = cache.revalidation_stats()
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            data_1 = cache.get_or_fetch('k', fetcher, 10, conditional=True, frozen=True)
+        fetcher.assert_called_once_with(None)
+        fetcher.return_value = (cache.NOT_MODIFIED, {'etag': 'abc'})
+        with patch('resources.lib.cache.time.monotonic', return_value=2000):
+            self.assertIsNone(cache.get_item('k'))
+            data_2 = cache.get_or_fetch('k', fetcher, 10, conditional=True, frozen=True)
+            fetcher.assert_called_with({'etag': 'abc'})
+            self.assertIs(data_1, data_2)
+            self.assertIs(data_1, cache.get_item('k'))
+        new_stats = cache.revalidation_stats()
+        self.assertEqual(1, new_stats['requests'] - stats['requests'])
+        self.assertEqual(1, new_stats['not_modified'] - stats['not_modified'])
+
+    def test_modified_data_replaces_item(self):
+        fetcher = Mock(return_value=([1], {'etag': 'abc'}))
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.get_or_fetch('k', fetcher, 10, conditional=True)
+        fetcher.return_value = ([2], {'etag': 'def'})
+        with patch('resources.lib.cache.time.monotonic', return_value=2000):
+            self.assertListEqual([2], cache.get_or_fetch('k', fetcher, 10, conditional=True))
+            fetcher.return_value = (cache.NOT_MODIFIED, {'etag': 'def'})
+        with patch('resources.lib.cache.time.monotonic', return_value=3000):
+            self.assertListEqual([2], cache.get_or_fetch('k', fetcher, 10, conditional=True))
+            fetcher.assert_called_with({'etag': 'def'})
+
+    def test_items_without_validators_are_not_retained(self):
+        fetcher = Mock(return_value=([1], None))
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.get_or_fetch('k', fetcher, 10, conditional=True)
+        with patch('resources.lib.cache.time.monotonic', return_value=1020):
+            cache.clean()
+        self.assertEqual(0, cache.size())
+
+    def test_revalidate_persistent_item(self):
+        fetcher = Mock(return_value=({'a': 1}, {'etag': 'abc'}))
+        with patch('resources.lib.cache.time.time', return_value=time.time() - 100):
+            cache.get_or_fetch('k', fetcher, 10, conditional=True, persistent=True)
+        fetcher.return_value = (cache.NOT_MODIFIED, {'etag': 'abc'})
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertDictEqual({'a': 1}, cache.get_or_fetch('k', fetcher, 10, conditional=True, persistent=True))
+            fetcher.assert_called_with({'etag': 'abc'})
+        # The renewed lifetime has been written to disk as well.
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertDictEqual({'a': 1}, cache.get_item('k'))
+
+
+class TestStatistics(unittest.TestCase):
+    def setUp(self):
+        cache.purge()
+        cache.reset_statistics()
+
+    def tearDown(self):
+        cache.purge()
+
+    def test_key_prefix(self):
+        self.assertEqual('www.itv.com', cache.key_prefix('https://www.itv.com'))
+        self.assertEqual('www.itv.com/watch/categories', cache.key_prefix('https://www.itv.com/watch/categories'))
+        self.assertEqual('www.itv.com/watch/collections',
+                         cache.key_prefix('https://www.itv.com/watch/collections/just-in/2e4f5?a=1'))
+        # Programme slugs and IDs are collapsed
+        for url in ('https://www.itv.com/watch/midsomer-murders/Ya1096',
+                    'https://www.itv.com/watch/the-chase/1a7842',
+                    'https://www.itv.com/watch/coronation-street/1a1234/1a1234a0001',
+                    'https://www.itv.com/watch/tv-guide/2025-06-01'):
+            self.assertEqual('www.itv.com/watch/*', cache.key_prefix(url))
+        self.assertEqual('www.itv.com/watch/*', cache.key_prefix('https://www.itv.com/watch/ncis-los-angeles/2a5k'))
+        self.assertEqual('parsed www.itv.com/watch/*',
+                         cache.key_prefix("parsed https://www.itv.com/watch/the-chase/1a7842#1:a4f3:parse('a b')"))
+        self.assertEqual('digest www.itv.com/watch/vera', cache.key_prefix('digest https://www.itv.com/watch/vera/2a34'))
+        self.assertEqual('mylist', cache.key_prefix('mylist_156-45xsghf75-4sf569'))
+        self.assertEqual('last_watched', cache.key_prefix('last_watched_156-45xsghf75-4sf569'))
+        self.assertEqual('live_schedule', cache.key_prefix('live_schedule'))
+
+    def test_hits_and_misses_per_prefix(self):
+        cache.get_item('mylist_1')
+        cache.set_item('mylist_1', [1], 10)
+        cache.get_item('mylist_1')
+        cache.get_item('mylist_2')
+        cache.get_or_fetch('live_schedule', lambda: [2], 10)
+        cache.get_or_fetch('live_schedule', lambda: [2], 10)
+        prefixes = cache.statistics()['prefixes']
+        self.assertEqual(1, prefixes['mylist']['hits'])
+        self.assertEqual(2, prefixes['mylist']['misses'])
+        self.assertEqual(0.333, prefixes['mylist']['hit_ratio'])
+        self.assertEqual(1, prefixes['mylist']['items'])
+        self.assertGreater(prefixes['mylist']['bytes'], 0)
+        self.assertEqual(1, prefixes['live_schedule']['hits'])
+        self.assertEqual(1, prefixes['live_schedule']['misses'])
+
+    @patch('resources.lib.cache.threading.Thread')
+    def test_stale_hits_and_age(self, _):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            cache.set_item('k', 'data', 10, max_stale=20)
+        with patch('resources.lib.cache.time.monotonic', return_value=1004):
+            cache.get_item('k')
+        with patch('resources.lib.cache.time.monotonic', return_value=1016):
+            cache.get_or_fetch('k', lambda: 'new data', 10, max_stale=20)
+            stats = cache.statistics()['prefixes']['k']
+        cache._in_flight.clear()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['stale_hits'])
+        self.assertEqual(10.0, stats['mean_age_at_hit'])
+        self.assertEqual(16.0, stats['max_age'])
+
+    def test_evictions_per_prefix(self):
+        with patch.dict(cache._limits, max_items=2):
+            for i in range(4):
+                cache.set_item('item_{}'.format(i), i, 10)
+        self.assertEqual(2, cache.statistics()['prefixes']['item']['evictions'])
+
+    def test_number_of_prefixes_is_limited(self):
+        with patch('resources.lib.cache.MAX_STATS_PREFIXES', 2):
+            for key in ('a', 'b', 'c', 'd'):
+                cache.get_item(key)
+        prefixes = cache.statistics()['prefixes']
+        self.assertListEqual(['a', 'b', cache.OTHER_PREFIX], list(prefixes))
+        self.assertEqual(2, prefixes[cache.OTHER_PREFIX]['misses'])
+
+    def test_statistics_are_json_serialisable(self):
+        import json
+        cache.set_item('p', 'some data', 10, persistent=True)
+        cache.get_item('p')
+        stats = json.loads(json.dumps(cache.statistics()))
+        self.assertEqual(1, stats['disk']['items'])
+        self.assertTrue(stats['disk']['available'])
+
+
+class TestTags(unittest.TestCase):
+    def setUp(self):
+        cache.purge()
+
+    def tearDown(self):
+        cache.purge()
+
+    def test_invalidate_tag(self):
+        cache.set_item('mylist_1', [1], 10, tags=(cache.TAG_USER, cache.TAG_MYLIST))
+        cache.set_item('recommended_1', [2], 10, tags=(cache.TAG_USER, cache.TAG_RECOMMENDED))
+        cache.set_item('page', {'a': 1}, 10)
+        self.assertEqual(1, cache.invalidate(cache.TAG_MYLIST))
+        self.assertIsNone(cache.get_item('mylist_1'))
+        self.assertListEqual([2], cache.get_item('recommended_1'))
+        self.assertEqual(1, cache.invalidate(cache.TAG_USER))
+        self.assertIsNone(cache.get_item('recommended_1'))
+        self.assertDictEqual({'a': 1}, cache.get_item('page'))
+        self.assertEqual(0, cache.invalidate(cache.TAG_USER))
+        self.assertEqual(0, cache.invalidate('unknown tag'))
+
+    def test_replaced_item_loses_old_tags(self):
+        cache.set_item('k', 1, 10, tags=('a',))
+        cache.set_item('k', 2, 10)
+        self.assertEqual(0, cache.invalidate('a'))
+        self.assertEqual(2, cache.get_item('k'))
+
+    def test_invalidate_persistent_items(self):
+        cache.set_item('user_data', 1, 10, persistent=True, tags=('user', 'b'))
+        cache.set_item('user_data_2', 2, 10, persistent=True, tags=('users',))
+        cache.set_item('public', 3, 10, persistent=True)
+        cache.invalidate('user')
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            self.assertIsNone(cache.get_item('user_data'))
+            self.assertEqual(2, cache.get_item('user_data_2'))
+            self.assertEqual(3, cache.get_item('public'))
+
+    def test_tags_are_restored_from_disk(self):
+        cache.set_item('user_data', 1, 10, persistent=True, tags=('user', 'b'))
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            cache.get_item('user_data')
+            self.assertEqual(1, cache.invalidate('b'))
+
+    def test_no_caching_of_data_invalidated_while_fetching(self):
+        def fetcher():
+            cache.invalidate(cache.TAG_USER)
+            return [1]
+
+        self.assertListEqual([1], cache.get_or_fetch('k', fetcher, 10, tags=(cache.TAG_USER,)))
+        self.assertIsNone(cache.get_item('k'))
+
+
+class TestCompression(unittest.TestCase):
+    data = {'items': [{'title': 'programme {}'.format(i), 'episodes': list(range(20))} for i in range(100)]}
+
+    def setUp(self):
+        cache.purge()
+        cache.set_compression(threshold=1000)
+
+    def tearDown(self):
+        cache.purge()
+        cache.set_compression(cache.DFLT_CODEC, cache.DFLT_COMPRESS_THRESHOLD)
+
+    def test_available_codecs(self):
+        codecs = cache.codecs()
+        for name in (cache.CODEC_PLAIN, 'zlib-pickle', 'zlib-marshal'):
+            self.assertIn(name, codecs)
+        self.assertRaises(ValueError, cache.set_compression, 'unknown')
+
+    def test_compressed_item(self):
+        for codec in cache.codecs():
+            cache.set_compression(codec)
+            cache.set_item('k', self.data, 10, compress=True)
+            self.assertLess(cache.residency()['bytes'], cache._estimate_size(self.data))
+            self.assertDictEqual(self.data, cache.get_item('k'))
+            # Each hit returns a new copy.
+            cache.get_item('k')['items'].clear()
+            self.assertDictEqual(self.data, cache.get_item('k'))
+
+    def test_small_data_is_not_compressed(self):
+        cache.set_compression(threshold=cache._estimate_size(self.data) + 1)
+        cache.set_item('k', self.data, 10, compress=True)
+        self.assertGreaterEqual(cache.residency()['bytes'], cache._estimate_size(self.data))
+        self.assertDictEqual(self.data, cache.get_item('k'))
+
+    def test_compressed_frozen_item(self):
+        for codec in ('zlib-pickle', 'zlib-marshal'):
+            cache.set_compression(codec)
+            cache.set_item('k', self.data, 10, frozen=True, compress=True)
+            data = cache.get_item('k')
+            self.assertIsInstance(data, cache.FrozenDict)
+            self.assertIsInstance(data['items'][0], cache.FrozenDict)
+            self.assertDictEqual(self.data, data)
+            data = cache.get_item('k', copy=True)
+            self.assertIs(type(data), dict)
+            self.assertIs(type(data['items']), list)
+
+    def test_data_that_cannot_be_encoded_is_stored_uncompressed(self):
+        cache.set_compression('zlib-marshal')
+        data = {'f': lambda x: x, 'items': self.data['items']}
+        cache.set_item('k', data, 10, compress=True)
+        self.assertIs(data['f'], cache.get_item('k')['f'])
+
+    def test_compressed_persistent_item(self):
+        cache.set_item('k', self.data, 10, persistent=True, frozen=True, compress=True)
+        with patch.dict('resources.lib.cache.__cache', clear=True):
+            with patch.object(cache.Codec, 'decode', side_effect=cache.Codec.decode, autospec=True) as p_decode:
+                cache.get_or_fetch('k', Mock(), 10)
+                # Loaded in memory still compressed, decoded only to be returned.
+                self.assertEqual(1, p_decode.call_count)
+                data = cache.get_item('k')
+                self.assertEqual(2, p_decode.call_count)
+            self.assertIsInstance(data, cache.FrozenDict)
+            self.assertDictEqual(self.data, data)
+
+    def test_undecodable_item_is_a_miss(self):
+        cache.set_item('k', self.data, 10, persistent=True, compress=True)
+        with patch.object(cache.Codec, 'decode', side_effect=ValueError):
+            self.assertIsNone(cache.get_item('k'))
+        self.assertEqual(0, cache.size())
+        self.assertIsNone(cache.get_item('k'))
+        cache.set_item('k', self.data, 10, compress=True)
+        with patch.object(cache.Codec, 'decode', side_effect=ValueError):
+            self.assertEqual('new data', cache.get_or_fetch('k', lambda: 'new data', 10))
+        self.assertEqual('new data', cache.get_item('k'))
@@ -8,18 +8,26 @@
 from test.support import fixtures
 fixtures.global_setup()
 
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 from unittest.mock import MagicMock, patch, mock_open
+from functools import partial
 
+import os
 import json
+import time
+import pickle
+import tempfile
 import requests
 from requests.cookies import RequestsCookieJar
+from urllib3.util import connection as urllib3_connection
 
 from resources.lib import fetch
 from resources.lib import errors
 from resources.lib import utils
+from resources.lib import parsex
 
-from test.support.testutils import HttpResponse
+from test.support.testutils import HttpResponse, doc_path
+from test.support.local_server import LocalItvServer, RESET, tls_available
 from test.support.object_checks import has_keys
 
 
@@ -37,12 +45,60 @@ class TestPersistentCookieJar(TestCase):
 
     def test_save(self):
         jar = fetch.PersistentCookieJar('my/file')
-        with patch('builtins.open', mock_open()) as m:
+        with patch('builtins.open', mock_open()) as m, patch('os.replace') as p_replace:
             jar.save()
             m.assert_not_called()
             jar._has_changed = True
             jar.save()
-            m.assert_called_once()
+            # Written to a temporary file, which then replaces the cookie file.
+            m.assert_called_once_with('my/file.tmp', 'w')
+            p_replace.assert_called_once_with('my/file.tmp', 'my/file')
+            self.assertIs(jar._has_changed, False)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'cookies.json')
+            jar = fetch.PersistentCookieJar(file_name)
+            jar.set('Itv.Cid', 'abc', domain='.itv.com', expires=time.time() + 3600, discard=False)
+            jar.set('other', '{"a": 1}', domain='www.itv.com', path='/watch', secure=True, rest={'HttpOnly': None})
+            jar.save()
+            self.assertListEqual(['cookies.json'], os.listdir(tmp_dir))
+            new_jar = fetch.PersistentCookieJar.load(file_name)
+            self.assertIs(new_jar._has_changed, False)
+            self.assertEqual(file_name, new_jar.filename)
+            cookies = {c.name: c for c in jar}
+            new_cookies = {c.name: c for c in new_jar}
+            self.assertEqual(cookies.keys(), new_cookies.keys())
+            for name, cookie in cookies.items():
+                self.assertDictEqual(vars(cookie), vars(new_cookies[name]))
+
+    def test_load_unsupported_version(self):
+        with patch('builtins.open', mock_open(read_data='{"version": 999, "cookies": []}')):
+            self.assertRaises(ValueError, fetch.PersistentCookieJar.load, 'my/file')
+
+    def test_save_fails(self):
+        jar = fetch.PersistentCookieJar('/non/existing/dir/file')
+        jar._has_changed = True
+        jar.save()
+        # The changes will be saved on a next attempt.
+        self.assertIs(jar._has_changed, True)
+
+    @patch('resources.lib.fetch.threading.Timer')
+    def test_schedule_save(self, p_timer):
+        jar = fetch.PersistentCookieJar('my/file')
+        jar.schedule_save()
+        p_timer.assert_not_called()
+        jar._has_changed = True
+        jar.schedule_save()
+        jar.schedule_save()
+        # Only one save is pending at a time.
+        p_timer.assert_called_once_with(fetch.COOKIE_SAVE_DELAY, jar._save_delayed)
+        p_timer.return_value.start.assert_called_once()
+        with patch.object(jar, 'save') as p_save:
+            jar._save_delayed()
+            p_save.assert_called_once()
+        jar.schedule_save()
+        self.assertEqual(2, p_timer.call_count)
 
     def test_set_cookie(self):
         jar = fetch.PersistentCookieJar('my/file')
@@ -89,13 +145,105 @@ class TestHttpSession(TestCase):
         # The session's __init__() creates a cookiejar, check that it has happend only once.
         p_create.assert_called_once()
 
+    def test_convert_pickled_cookies(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            legacy_jar = RequestsCookieJar()
+            legacy_jar.set('Itv.Cid', 'abc', domain='.itv.com')
+            with open(os.path.join(tmp_dir, 'cookies'), 'wb') as f:
+                pickle.dump(legacy_jar, f)
+            with patch.object(utils.addon_info, 'profile', new=tmp_dir):
+                jar = fetch._create_cookiejar()
+            self.assertEqual('abc', jar['Itv.Cid'])
+            self.assertListEqual(['cookies.json'], os.listdir(tmp_dir))
+            self.assertEqual('abc', fetch.PersistentCookieJar.load(jar.filename)['Itv.Cid'])
+
+    @patch('resources.lib.fetch.set_default_cookies')
+    def test_invalid_cookie_file(self, p_set_default):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, 'cookies.json'), 'w') as f:
+                f.write('{"version": 1, "cookies": [["invalid"]]}')
+            with patch.object(utils.addon_info, 'profile', new=tmp_dir):
+                jar = fetch._create_cookiejar()
+            self.assertIsInstance(jar, fetch.PersistentCookieJar)
+            p_set_default.assert_called_once_with(jar)
+
+    @patch('requests.sessions.Session.request', return_value=HttpResponse(status_code=200))
+    def test_cookies_are_saved_in_the_background(self, _):
+        session = fetch.HttpSession()
+        with patch.object(session.cookies, 'schedule_save') as p_schedule, \
+                patch.object(session.cookies, 'save') as p_save:
+            session.request('GET', URL)
+            p_schedule.assert_called_once()
+            p_save.assert_not_called()
+            fetch.save_cookies()
+            p_save.assert_called_once()
+
     def test_http_session_non_existing_cookie_file(self):
         fetch.HttpSession.instance = None  # remove a possible existing instance
         with patch.object(utils.addon_info, 'profile', new='my/non/existing/path/'):
             s = fetch.HttpSession()
         jar = s.cookies
         self.assertIsInstance(jar, fetch.PersistentCookieJar)
-        self.assertEqual('my/non/existing/path/cookies', jar.filename)
+        self.assertEqual('my/non/existing/path/cookies.json', jar.filename)
+
+
+class ConnectionPool(TestCase):
+    def setUp(self):
+        fetch.HttpSession.instance = None
+
+    def tearDown(self):
+        fetch.HttpSession.instance = None
+
+    def test_pool_configuration(self):
+        adapter = fetch.HttpSession().get_adapter('https://www.itv.com')
+        self.assertIsInstance(adapter, fetch.CustomHttpAdapter)
+        self.assertEqual(fetch.POOL_MAXSIZE, adapter.poolmanager.connection_pool_kw['maxsize'])
+        pool = adapter.poolmanager.connection_from_url('https://www.itv.com/')
+        self.assertIsInstance(pool, fetch._PooledHTTPSConnectionPool)
+        self.assertEqual(fetch.POOL_IDLE_TIMEOUT, pool.idle_timeout)
+        self.assertIs(pool.ConnectionCls, fetch._CountingHTTPSConnection)
+        adapter = fetch.CustomHttpAdapter(pool_maxsize=2, idle_timeout=5)
+        pool = adapter.poolmanager.connection_from_url('https://www.itv.com/')
+        self.assertEqual(2, pool.pool.maxsize)
+        self.assertEqual(5, pool.idle_timeout)
+
+    @patch('requests.sessions.Session.request',
+           side_effect=[HttpResponse(status_code=200), HttpResponse(status_code=404)])
+    def test_web_request_keeps_session_open(self, _):
+        session = fetch.HttpSession()
+        with patch.object(session, 'close') as p_close:
+            fetch.web_request('GET', URL)
+            self.assertRaises(errors.HttpError, fetch.web_request, 'GET', URL)
+            p_close.assert_not_called()
+            self.assertIs(session, fetch.HttpSession.instance)
+            fetch.close_session()
+            p_close.assert_called_once()
+        self.assertIsNone(fetch.HttpSession.instance)
+        # Nothing to close
+        fetch.close_session()
+
+    @patch('urllib3.connection.HTTPSConnection.connect')
+    @patch('urllib3.connectionpool.is_connection_dropped', return_value=False)
+    def test_idle_connections_are_not_reused(self, *_):
+        pool = fetch._PooledHTTPSConnectionPool('www.itv.com', maxsize=1, idle_timeout=10)
+        stats = fetch.connection_stats()
+        with patch('resources.lib.fetch.time.monotonic', return_value=1000):
+            conn = pool._get_conn()
+            conn.connect()
+            pool._put_conn(conn)
+        with patch('resources.lib.fetch.time.monotonic', return_value=1005):
+            conn = pool._get_conn()
+            with patch.object(conn, 'close') as p_close:
+                pool._put_conn(conn)
+                p_close.assert_not_called()
+        with patch('resources.lib.fetch.time.monotonic', return_value=1016):
+            with patch.object(conn, 'close') as p_close:
+                self.assertIs(conn, pool._get_conn())
+                p_close.assert_called_once()
+            conn.connect()
+        new_stats = fetch.connection_stats()
+        self.assertEqual(3, new_stats['requests'] - stats['requests'])
+        self.assertEqual(2, new_stats['opened'] - stats['opened'])
 
 
 class SetDefaultCookies(TestCase):
@@ -134,6 +282,12 @@ class SetDefaultCookies(TestCase):
 
 
 class WebRequest(TestCase):
+    def setUp(self):
+        fetch.circuit_breaker.reset()
+
+    def tearDown(self):
+        fetch.circuit_breaker.reset()
+
     @patch('requests.sessions.Session.request', return_value=HttpResponse(status_code=200))
     def test_web_request_get_plain(self, mocked_req):
         fetch.web_request('get', URL)
@@ -212,6 +366,102 @@ class WebRequest(TestCase):
         self.assertRaises(errors.FetchError, fetch.web_request, 'get', URL)
 
 
+@patch('resources.lib.fetch.time.sleep')
+class RetryAndCircuitBreaker(TestCase):
+    def setUp(self):
+        fetch.circuit_breaker.reset()
+
+    def tearDown(self):
+        fetch.circuit_breaker.reset()
+
+    def test_retry_on_connection_errors(self, p_sleep):
+        with patch('requests.sessions.Session.request',
+                   side_effect=[requests.ConnectionError, requests.ConnectTimeout, HttpResponse(200)]) as p_req:
+            resp = fetch.web_request('get', URL)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(3, p_req.call_count)
+        self.assertEqual(2, p_sleep.call_count)
+        # Exponential backoff with jitter.
+        self.assertLessEqual(p_sleep.call_args_list[0].args[0], fetch.RETRY_BACKOFF)
+        self.assertLessEqual(p_sleep.call_args_list[1].args[0], 2 * fetch.RETRY_BACKOFF)
+
+    def test_retry_on_temporary_server_errors(self, p_sleep):
+        with patch('requests.sessions.Session.request',
+                   side_effect=[HttpResponse(503, content=b''), HttpResponse(200)]) as p_req:
+            self.assertEqual(200, fetch.web_request('GET', URL).status_code)
+        self.assertEqual(2, p_req.call_count)
+        with patch('requests.sessions.Session.request',
+                   side_effect=lambda *a, **k: HttpResponse(502, reason='Bad Gateway', content=b'')) as p_req:
+            with self.assertRaises(errors.HttpError) as cm:
+                fetch.web_request('GET', URL, max_retries=1)
+        self.assertEqual(502, cm.exception.code)
+        self.assertEqual(2, p_req.call_count)
+
+    def test_no_retries(self, p_sleep):
+        # Non-idempotent requests
+        with patch('requests.sessions.Session.request', side_effect=requests.ConnectionError) as p_req:
+            self.assertRaises(errors.FetchError, fetch.web_request, 'POST', URL, data={'a': 1})
+        p_req.assert_called_once()
+        # Other errors
+        for response in (requests.ReadTimeout, HttpResponse(500), HttpResponse(404)):
+            fetch.circuit_breaker.reset()
+            with patch('requests.sessions.Session.request', side_effect=[response]) as p_req:
+                self.assertRaises(errors.FetchError, fetch.web_request, 'GET', URL)
+            p_req.assert_called_once()
+        # Retries disabled
+        with patch('requests.sessions.Session.request', side_effect=requests.ConnectionError) as p_req:
+            self.assertRaises(errors.FetchError, fetch.web_request, 'GET', URL, max_retries=0)
+        p_req.assert_called_once()
+        p_sleep.assert_not_called()
+
+    def test_circuit_breaker(self, _):
+        with patch('requests.sessions.Session.request', side_effect=requests.ConnectionError) as p_req:
+            # A request that fails after all retries counts as one failure.
+            for _ in range(fetch.BREAKER_THRESHOLD):
+                self.assertFalse(fetch.circuit_breaker.is_open('mydoc'))
+                self.assertRaises(errors.FetchError, fetch.web_request, 'GET', URL)
+            self.assertEqual(fetch.BREAKER_THRESHOLD * (1 + fetch.MAX_RETRIES), p_req.call_count)
+            self.assertTrue(fetch.circuit_breaker.is_open('mydoc'))
+            # Fail fast, without making a request
+            p_req.reset_mock()
+            with self.assertRaises(errors.HostUnavailableError) as cm:
+                fetch.web_request('GET', URL + '/other/path')
+            self.assertEqual('mydoc', cm.exception.host)
+            p_req.assert_not_called()
+        # Other hosts are not affected
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(200)):
+            fetch.web_request('GET', 'https://otherhost/doc')
+        # After the cooldown requests are let through again, but one failure opens the circuit again.
+        with patch('resources.lib.fetch.time.monotonic', return_value=time.monotonic() + fetch.BREAKER_COOLDOWN + 1):
+            with patch('requests.sessions.Session.request', side_effect=requests.ConnectionError) as p_req:
+                self.assertRaises(errors.FetchError, fetch.web_request, 'GET', URL)
+                p_req.assert_called_once()
+                self.assertRaises(errors.HostUnavailableError, fetch.web_request, 'GET', URL)
+
+    def test_failed_attempts_do_not_open_circuit(self, _):
+        with patch('requests.sessions.Session.request',
+                   side_effect=[requests.ConnectionError, requests.ConnectionError, HttpResponse(200)]):
+            fetch.web_request('GET', URL)
+        with patch('requests.sessions.Session.request', side_effect=requests.ConnectionError):
+            self.assertRaises(errors.FetchError, fetch.web_request, 'GET', URL)
+        with patch('requests.sessions.Session.request',
+                   side_effect=lambda *a, **k: HttpResponse(503, content=b'')) as p_req:
+            self.assertRaises(errors.HttpError, fetch.web_request, 'GET', URL)
+        self.assertEqual(1 + fetch.MAX_RETRIES, p_req.call_count)
+        self.assertFalse(fetch.circuit_breaker.is_open('mydoc'))
+
+    def test_success_closes_circuit(self, _):
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(503)):
+            self.assertRaises(errors.HttpError, fetch.web_request, 'GET', URL, max_retries=0)
+            self.assertRaises(errors.HttpError, fetch.web_request, 'GET', URL, max_retries=0)
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(200)):
+            fetch.web_request('GET', URL)
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(503)):
+            self.assertRaises(errors.HttpError, fetch.web_request, 'GET', URL, max_retries=0)
+            self.assertRaises(errors.HttpError, fetch.web_request, 'GET', URL, max_retries=0)
+        self.assertFalse(fetch.circuit_breaker.is_open('mydoc'))
+
+
 class PostJson(TestCase):
     @patch("resources.lib.fetch.web_request", return_value=HttpResponse(content=b'{"a": 1}'))
     def test_post_json_plain_with_response(self, mocked_req):
@@ -342,3 +592,549 @@ class GetDocument(TestCase):
     def test_get_document_no_response(self, _):
         resp = fetch.get_document(URL)
         self.assertEqual('', resp)
+
+
+class ConditionalGet(TestCase):
+    @patch("resources.lib.fetch.web_request",
+           return_value=HttpResponse(content=b'blabla', headers={'ETag': '"abc"', 'Last-Modified': 'yesterday'}))
+    def test_get_without_validators(self, mocked_req):
+        resp, validators = fetch.conditional_get(URL)
+        mocked_req.assert_called_once_with('GET', URL, {})
+        self.assertEqual(b'blabla', resp.content)
+        self.assertDictEqual({'etag': '"abc"', 'last_modified': 'yesterday'}, validators)
+
+    @patch("resources.lib.fetch.web_request", return_value=HttpResponse(content=b'blabla'))
+    def test_response_without_validators(self, _):
+        resp, validators = fetch.conditional_get(URL, {'etag': '"abc"'})
+        self.assertEqual(b'blabla', resp.content)
+        self.assertIsNone(validators)
+
+    @patch("resources.lib.fetch.web_request", return_value=HttpResponse(status_code=304))
+    def test_not_modified(self, mocked_req):
+        validators = {'etag': '"abc"', 'last_modified': 'yesterday'}
+        resp, new_validators = fetch.conditional_get(URL, validators, headers={'MyHeader': 'myval'})
+        self.assertIsNone(resp)
+        self.assertIs(validators, new_validators)
+        headers = mocked_req.call_args[0][2]
+        self.assertEqual('"abc"', headers['If-None-Match'])
+        self.assertEqual('yesterday', headers['If-Modified-Since'])
+        self.assertEqual('myval', headers['MyHeader'])
+
+
+class CallMany(TestCase):
+    def test_results_in_order(self):
+        import time
+
+        def call(delay, result):
+            time.sleep(delay)
+            return result
+        calls = [partial(call, 0.03, 1), partial(call, 0.01, 2), partial(call, 0.02, 3), partial(call, 0, 4)]
+        self.assertListEqual([1, 2, 3, 4], fetch.call_many(calls))
+        self.assertListEqual([], fetch.call_many([]))
+
+    def test_calls_run_concurrently(self):
+        import threading
+        barrier = threading.Barrier(3, timeout=5)
+        # Each call can only complete when all are running at the same time.
+        self.assertListEqual([0, 1, 2], fetch.call_many(partial(barrier.wait) for _ in range(3)))
+
+    def test_nested_calls(self):
+        calls = [partial(fetch.call_many, [partial(int, i), partial(int, i + 1)]) for i in range(fetch.MAX_WORKERS + 1)]
+        result = fetch.call_many(calls)
+        self.assertListEqual([[i, i + 1] for i in range(fetch.MAX_WORKERS + 1)], result)
+
+    def test_errors(self):
+        err_1 = errors.FetchError()
+        err_2 = errors.HttpError(404, 'Not Found')
+        calls = [partial(int, 1), MagicMock(side_effect=err_1), partial(int, 3), MagicMock(side_effect=err_2)]
+        results = fetch.call_many(calls, return_exceptions=True)
+        self.assertListEqual([1, err_1, 3, err_2], results)
+        with self.assertRaises(errors.FetchError) as cm:
+            fetch.call_many(calls)
+        self.assertIs(err_1, cm.exception)
+
+    def test_get_many(self):
+        def request(method, url, **kwargs):
+            if url.endswith('404'):
+                return HttpResponse(status_code=404)
+            return HttpResponse(content=json.dumps({'url': url}).encode())
+
+        with patch('requests.sessions.Session.request', side_effect=request) as p_req:
+            docs = fetch.get_many(['https://a/1', 'https://a/2'])
+            self.assertListEqual(['{"url": "https://a/1"}', '{"url": "https://a/2"}'], docs)
+            data = fetch.get_json_many(['https://a/1', 'https://a/404', 'https://a/3'], return_exceptions=True)
+            self.assertDictEqual({'url': 'https://a/1'}, data[0])
+            self.assertIsInstance(data[1], errors.HttpError)
+            self.assertDictEqual({'url': 'https://a/3'}, data[2])
+            self.assertRaises(errors.HttpError, fetch.get_json_many, ['https://a/404', 'https://a/2'])
+            self.assertEqual(7, p_req.call_count)
+
+
+class StreamDocument(TestCase):
+    @staticmethod
+    def response(content, **kwargs):
+        resp = HttpResponse(content=content, **kwargs)
+        resp.close = MagicMock()
+        return resp
+
+    @staticmethod
+    def read_first_chunk(chunks):
+        return next(chunks)
+
+    def test_stream_document(self):
+        resp = self.response(b'a' * (fetch.STREAM_CHUNK_SIZE + 10))
+        with patch('resources.lib.fetch.web_request', return_value=resp) as p_req:
+            result = fetch.stream_document(URL, self.read_first_chunk)
+        p_req.assert_called_once_with('GET', URL, None, stream=True)
+        self.assertEqual(b'a' * fetch.STREAM_CHUNK_SIZE, result)
+        resp.close.assert_called_once()
+
+    def test_large_remainder_is_not_read(self):
+        chunks_read = []
+
+        def iter_content(chunk_size):
+            for i in range(10):
+                chunks_read.append(i)
+                yield b'a' * chunk_size
+
+        resp = self.response(b'')
+        resp.iter_content = iter_content
+        with patch('resources.lib.fetch.web_request', return_value=resp):
+            fetch.stream_document(URL, self.read_first_chunk)
+        self.assertLess(len(chunks_read), 10)
+        self.assertGreater(len(chunks_read) * fetch.STREAM_CHUNK_SIZE, fetch.STREAM_DRAIN_LIMIT)
+        resp.close.assert_called_once()
+
+    def test_read_errors(self):
+        resp = self.response(b'')
+        resp.iter_content = MagicMock(side_effect=requests.exceptions.ChunkedEncodingError)
+        with patch('resources.lib.fetch.web_request', return_value=resp):
+            self.assertRaises(errors.FetchError, fetch.stream_document, URL, list)
+        resp.close.assert_called_once()
+
+    def test_stream_document_if_modified(self):
+        consumer = MagicMock(return_value='result')
+        with patch('resources.lib.fetch.web_request',
+                   return_value=self.response(b'doc', headers={'ETag': 'abc'})) as p_req:
+            self.assertEqual(('result', {'etag': 'abc'}), fetch.stream_document_if_modified(URL, consumer))
+            p_req.assert_called_once_with('GET', URL, {}, stream=True)
+        consumer.reset_mock()
+        with patch('resources.lib.fetch.web_request', return_value=self.response(b'', status_code=304)):
+            self.assertEqual((None, {'etag': 'abc'}), fetch.stream_document_if_modified(URL, consumer, {'etag': 'abc'}))
+        consumer.assert_not_called()
+
+
+class RequestTimings(TestCase):
+    def setUp(self):
+        fetch.reset_timings()
+        fetch.circuit_breaker.reset()
+
+    def tearDown(self):
+        fetch.reset_timings()
+        fetch.circuit_breaker.reset()
+
+    def test_endpoint_of(self):
+        self.assertEqual('www.itv.com/watch/news', fetch.endpoint_of('https://www.itv.com/watch/news'))
+        self.assertEqual('www.itv.com/watch/*', fetch.endpoint_of('https://www.itv.com/watch/some-show/10a1234?q=1'))
+        self.assertEqual('www.itv.com', fetch.endpoint_of('https://www.itv.com/'))
+        self.assertEqual('scheduled.oasvc.itv.com/scheduled/itvxapi',
+                         fetch.endpoint_of('https://scheduled.oasvc.itv.com/scheduled/itvxapi/v2/schedule'))
+
+    def test_timing_of_request(self):
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(content=b'abcd')):
+            fetch.web_request('get', URL)
+        timings = fetch.request_timings()
+        self.assertEqual(1, len(timings))
+        record = timings[0]
+        has_keys(record, 'time', 'method', 'host', 'endpoint', 'status', 'reused', 'connect',
+                 'ttfb', 'transfer', 'total', 'size', 'error')
+        self.assertEqual('GET', record['method'])
+        self.assertEqual(200, record['status'])
+        self.assertEqual(4, record['size'])
+        # No connection has been opened by the mocked request.
+        self.assertTrue(record['reused'])
+        self.assertIsNone(record['error'])
+        self.assertGreaterEqual(record['total'], record['ttfb'])
+
+    def test_timing_of_failed_requests(self):
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(status_code=404, content=b'')):
+            self.assertRaises(errors.HttpError, fetch.web_request, 'get', URL)
+        with patch('requests.sessions.Session.request', side_effect=requests.Timeout):
+            self.assertRaises(errors.FetchError, fetch.web_request, 'post', URL)
+        failed_status, failed_conn = fetch.request_timings()
+        self.assertEqual(404, failed_status['status'])
+        self.assertIsNone(failed_conn['status'])
+        self.assertEqual('Timeout', failed_conn['error'])
+        self.assertIsNone(failed_conn['size'])
+
+    def test_timing_of_streamed_request(self):
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(content=b'a' * 100)):
+            fetch.stream_document(URL, lambda chunks: next(chunks))
+        record = fetch.request_timings()[0]
+        self.assertEqual(100, record['size'])
+        self.assertIsNotNone(record['transfer'])
+
+    def test_ring_buffer(self):
+        with patch.object(fetch, '_timings', new=fetch.deque(maxlen=3)):
+            with patch('requests.sessions.Session.request', return_value=HttpResponse(content=b'')):
+                for i in range(5):
+                    fetch.web_request('get', URL + '/' + str(i))
+            self.assertEqual(3, len(fetch.request_timings()))
+
+    def test_timing_summary(self):
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(content=b'ab')):
+            for _ in range(3):
+                fetch.web_request('get', 'https://www.itv.com/watch/news')
+            fetch.web_request('get', 'https://www.itv.com/watch/some-show/10a1234')
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(status_code=500, content=b'')):
+            self.assertRaises(errors.HttpError, fetch.web_request, 'get', 'https://www.itv.com/watch/news',
+                              max_retries=0)
+        summary = fetch.timing_summary()
+        self.assertEqual({'www.itv.com/watch/news', 'www.itv.com/watch/*'}, set(summary))
+        news = summary['www.itv.com/watch/news']
+        self.assertEqual(4, news['requests'])
+        self.assertEqual(1, news['errors'])
+        self.assertEqual(6, news['bytes'])
+        self.assertEqual(1.0, news['reused'])
+        has_keys(news['total'], 'p50', 'p95')
+        self.assertLessEqual(news['total']['p50'], news['total']['p95'])
+
+    def test_percentile(self):
+        self.assertIsNone(fetch._percentile([], 50))
+        self.assertEqual(1, fetch._percentile([1], 95))
+        values = list(range(1, 101))
+        self.assertEqual(50, fetch._percentile(values, 50))
+        self.assertEqual(95, fetch._percentile(values, 95))
+
+    def test_export_timings(self):
+        with patch('requests.sessions.Session.request', return_value=HttpResponse(content=b'')):
+            fetch.web_request('get', URL)
+            fetch.web_request('get', URL)
+        file_path = fetch.export_timings()
+        try:
+            self.assertEqual(os.path.join(utils.addon_info.profile, fetch.TIMINGS_FILE_NAME), file_path)
+            with open(file_path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(fetch.request_timings(), records)
+        finally:
+            os.remove(file_path)
+
+
+class Transport(TestCase):
+    def setUp(self):
+        fetch.close_session()
+        fetch.circuit_breaker.reset()
+
+    def tearDown(self):
+        fetch.set_transport(fetch.TRANSPORT_LIVE)
+        fetch.close_session()
+        fetch.circuit_breaker.reset()
+
+    def test_set_transport(self):
+        session = fetch.HttpSession()
+        self.assertIs(type(session.adapters['https://']), fetch.CustomHttpAdapter)
+        fetch.set_transport(fetch.TRANSPORT_REPLAY, doc_path(''))
+        self.assertIsInstance(session.adapters['https://'], fetch.ReplayHttpAdapter)
+        fetch.set_transport(fetch.TRANSPORT_RECORD)
+        adapter = session.adapters['https://']
+        self.assertIsInstance(adapter, fetch.RecordingHttpAdapter)
+        self.assertEqual(os.path.join(utils.addon_info.profile, fetch.RECORDINGS_DIR), adapter.recordings.directory)
+        fetch.set_transport(fetch.TRANSPORT_LIVE)
+        self.assertIs(type(session.adapters['https://']), fetch.CustomHttpAdapter)
+        self.assertRaises(ValueError, fetch.set_transport, 'some mode')
+
+    def test_new_session_uses_transport(self):
+        fetch.set_transport(fetch.TRANSPORT_REPLAY, doc_path(''))
+        self.assertIsInstance(fetch.HttpSession().adapters['https://'], fetch.ReplayHttpAdapter)
+
+    @patch('requests.sessions.Session.send', new=fixtures.real_session_send)
+    def test_replay_test_docs(self):
+        fetch.set_transport(fetch.TRANSPORT_REPLAY, doc_path(''))
+        # A page of which only the page props are in test_docs.
+        page = fetch.get_document('https://www.itv.com/watch/categories')
+        self.assertTrue(page.startswith('<!DOCTYPE html>'))
+        with open(doc_path('html/categories_data.json')) as f:
+            self.assertEqual(json.load(f), json.loads(page.split('"pageProps":', 1)[1][:-len('}}</script></body></html>')]))
+        # Recorded without query, requested with a query string.
+        data = fetch.get_json('https://scheduled.oasvc.itv.com/scheduled/itvonline/schedules?from=202501011200')
+        with open(doc_path('schedule/live_4hrs.json')) as f:
+            self.assertEqual(json.load(f), data)
+        # The root page of a site
+        self.assertTrue(fetch.get_document('https://www.itv.com').startswith('<!DOCTYPE html>'))
+
+    @patch('requests.sessions.Session.send', new=fixtures.real_session_send)
+    def test_replay_unrecorded_request(self):
+        fetch.set_transport(fetch.TRANSPORT_REPLAY, doc_path(''))
+        with self.assertRaises(errors.HttpError) as cm:
+            fetch.get_document('https://www.itv.com/watch/unknown')
+        self.assertEqual(404, cm.exception.code)
+        self.assertRaises(errors.HttpError, fetch.post_json, 'https://www.itv.com/watch/categories', {})
+
+    @patch('requests.sessions.Session.send', new=fixtures.real_session_send)
+    def test_replay_latency_and_bandwidth(self):
+        fetch.set_transport(fetch.TRANSPORT_REPLAY, doc_path(''), latency=0.5, bandwidth=1000)
+        with patch('resources.lib.fetch.time.sleep') as p_sleep:
+            fetch.get_json('https://nownext.oasvc.itv.com/channels')
+        self.assertEqual(0.5, p_sleep.call_args_list[0].args[0])
+        slept = sum(call.args[0] for call in p_sleep.call_args_list[1:])
+        self.assertAlmostEqual(os.path.getsize(doc_path('schedule/now_next.json')) / 1000, slept)
+
+    @patch('requests.sessions.Session.send', new=fixtures.real_session_send)
+    def test_record_and_replay(self):
+        url = 'https://www.itv.com/watch/some-page?q=1'
+        resp = HttpResponse(content=b'{"a": 1}',
+                            headers={'Content-Type': 'application/json', 'Set-Cookie': 'a=b',
+                                     'Content-Encoding': 'gzip', 'ETag': 'abc'})
+        with tempfile.TemporaryDirectory() as rec_dir:
+            fetch.set_transport(fetch.TRANSPORT_RECORD, rec_dir)
+            with patch.object(fetch.CustomHttpAdapter, 'send', return_value=resp) as p_send:
+                self.assertEqual({'a': 1}, fetch.get_json(url))
+                p_send.assert_called_once()
+            with open(os.path.join(rec_dir, fetch.RECORDINGS_INDEX)) as f:
+                index = json.load(f)
+            self.assertEqual(fetch.RECORDINGS_VERSION, index['version'])
+            entry = index['responses']['GET ' + url]
+            self.assertEqual(200, entry['status'])
+            self.assertEqual({'Content-Type': 'application/json', 'ETag': 'abc'}, entry['headers'])
+            with open(os.path.join(rec_dir, entry['body']), 'rb') as f:
+                self.assertEqual(b'{"a": 1}', f.read())
+
+            fetch.set_transport(fetch.TRANSPORT_REPLAY, rec_dir)
+            resp = fetch.web_request('GET', url)
+            self.assertEqual({'a': 1}, resp.json())
+            self.assertEqual('abc', resp.headers['ETag'])
+            self.assertEqual('8', resp.headers['Content-Length'])
+
+
+    def test_record_without_credentials(self):
+        resp = HttpResponse(content=b'{"access_token": "abc", "user": {"refresh_token": "def", "name": "me"}}',
+                            headers={'Content-Type': 'application/json'})
+        with tempfile.TemporaryDirectory() as rec_dir:
+            recordings = fetch._Recordings(rec_dir)
+            recordings.add('POST', 'https://auth.prd.user.itv.com/token', resp)
+            self.assertFalse(recordings.responses)
+            recordings.add('GET', 'https://my-list.prd.user.itv.com/user/156-45xsghf75-4sf569/mylist?size=52', resp)
+            recordings.add('GET', 'https://recommendations.prd.user.itv.com/recommendations/byw/156-45xsghf75', resp)
+            self.assertListEqual(['GET https://my-list.prd.user.itv.com/user/*/mylist',
+                                  'GET https://recommendations.prd.user.itv.com/recommendations/byw/*'],
+                                 list(recordings.responses))
+            entry = recordings.find('GET', 'https://my-list.prd.user.itv.com/user/other-user/mylist?size=10')
+            self.assertEqual({'access_token': 'REDACTED', 'user': {'refresh_token': 'REDACTED', 'name': 'me'}},
+                             json.loads(recordings.read_body(entry)))
+
+def addr_info(*addresses):
+    return [(2, 1, 6, '', (address, 443)) for address in addresses]
+
+
+class DnsCache(TestCase):
+    @patch('socket.getaddrinfo', return_value=addr_info('10.1.1.1', '10.1.1.2', '10.1.1.1'))
+    def test_resolve(self, p_gai):
+        dns = fetch.DnsCache()
+        self.assertEqual(['10.1.1.1', '10.1.1.2'], dns.resolve('www.itv.com'))
+        self.assertEqual(['10.1.1.1', '10.1.1.2'], dns.resolve('www.itv.com'))
+        p_gai.assert_called_once()
+        self.assertEqual('www.itv.com', p_gai.call_args.args[0])
+        stats = dns.statistics()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['hosts'])
+        self.assertGreaterEqual(stats['time_saved'], 0)
+
+    @patch('socket.getaddrinfo', return_value=addr_info('10.1.1.1'))
+    def test_expiry(self, p_gai):
+        dns = fetch.DnsCache(ttl=100, refresh_margin=0)
+        now = time.monotonic()
+        with patch('resources.lib.fetch.time.monotonic', return_value=now):
+            dns.resolve('www.itv.com')
+        with patch('resources.lib.fetch.time.monotonic', return_value=now + 99):
+            dns.resolve('www.itv.com')
+            self.assertEqual(1, p_gai.call_count)
+        with patch('resources.lib.fetch.time.monotonic', return_value=now + 101):
+            dns.resolve('www.itv.com')
+            self.assertEqual(2, p_gai.call_count)
+        dns.invalidate('www.itv.com')
+        dns.resolve('www.itv.com')
+        self.assertEqual(3, p_gai.call_count)
+        self.assertEqual(1, dns.statistics()['failures'])
+
+    def test_refresh_before_expiry(self):
+        dns = fetch.DnsCache(ttl=100, refresh_margin=30)
+        now = time.monotonic()
+        with patch('socket.getaddrinfo', return_value=addr_info('10.1.1.1')):
+            with patch('resources.lib.fetch.time.monotonic', return_value=now):
+                dns.resolve('www.itv.com')
+            with patch('resources.lib.fetch.threading.Thread') as p_thread:
+                with patch('resources.lib.fetch.time.monotonic', return_value=now + 60):
+                    dns.resolve('www.itv.com')
+                p_thread.assert_not_called()
+                with patch('resources.lib.fetch.time.monotonic', return_value=now + 80):
+                    self.assertEqual(['10.1.1.1'], dns.resolve('www.itv.com'))
+                    # Only one refresh at a time
+                    dns.resolve('www.itv.com')
+                p_thread.assert_called_once()
+        refresh = p_thread.call_args.kwargs
+        # A failed refresh keeps the current addresses
+        with patch('socket.getaddrinfo', side_effect=OSError):
+            refresh['target'](*refresh['args'])
+        self.assertEqual(['10.1.1.1'], dns.resolve('www.itv.com'))
+        self.assertEqual(0, dns.statistics()['refreshes'])
+        # A successful refresh
+        with patch('socket.getaddrinfo', return_value=addr_info('10.1.1.2')):
+            refresh['target'](*refresh['args'])
+        self.assertEqual(['10.1.1.2'], dns.resolve('www.itv.com'))
+        self.assertEqual(1, dns.statistics()['refreshes'])
+
+
+@skipUnless(tls_available(), 'Requires openssl to create a certificate')
+class LocalServer(TestCase):
+    """End-to-end tests over real sockets with a local stand-in of ITVX's servers."""
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalItvServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        server = self.server
+        server.delay = 0
+        server.chunk_size = None
+        server.reset_counters()
+        fetch.circuit_breaker.reset()
+        self.redirect = server.redirect()
+        self.redirect.__enter__()
+
+    def tearDown(self):
+        self.redirect.__exit__(None, None, None)
+        fetch.circuit_breaker.reset()
+
+    def test_connections_are_reused(self):
+        stats = fetch.connection_stats()
+        for _ in range(5):
+            fetch.get_json('https://nownext.oasvc.itv.com/channels')
+        self.assertEqual(5, len(self.server.requests))
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(stats['opened'] + 1, fetch.connection_stats()['opened'])
+
+    def test_connection_reused_after_streamed_not_modified(self):
+        url = 'https://www.itv.com/watch/categories'
+        self.server.inject_error('*/watch/categories', 304, count=5)
+        timings = len(fetch.request_timings())
+        for _ in range(5):
+            result, validators = fetch.stream_document_if_modified(url, parsex.scrape_json_stream, {'etag': '"abc"'})
+            self.assertIsNone(result)
+            self.assertEqual({'etag': '"abc"'}, validators)
+        self.assertEqual(5, len(self.server.requests))
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(timings + 5, len(fetch.request_timings()))
+        self.assertEqual(304, fetch.request_timings()[-1]['status'])
+
+    def test_stream_chunked_page(self):
+        self.server.chunk_size = 4096
+        page_data = fetch.stream_document('https://www.itv.com', parsex.scrape_json_stream)[0]
+        self.assertEqual(parsex.scrape_json(fetch.get_document('https://www.itv.com')), page_data)
+
+    def test_concurrent_requests(self):
+        self.server.delay = 0.2
+        urls = ['https://nownext.oasvc.itv.com/channels'] * 4
+        start = time.monotonic()
+        results = fetch.get_json_many(urls)
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(4, len(results))
+        self.assertLessEqual(self.server.connections, fetch.POOL_MAXSIZE)
+
+    @patch('resources.lib.fetch.time.sleep')
+    def test_injected_errors_are_retried(self, _):
+        url = 'https://nownext.oasvc.itv.com/channels'
+        self.server.inject_error('*/channels', 503)
+        self.assertIsInstance(fetch.get_json(url), dict)
+        self.assertEqual(2, len(self.server.requests))
+        self.server.inject_error('*/channels', RESET)
+        self.assertIsInstance(fetch.get_json(url), dict)
+        self.assertEqual(4, len(self.server.requests))
+        self.server.inject_error('*/channels', 404)
+        self.assertRaises(errors.HttpError, fetch.get_json, url)
+
+    @staticmethod
+    def prewarm(hosts):
+        for thread in fetch.prewarm(hosts):
+            thread.join()
+
+    def test_prewarm(self):
+        stats = fetch.connection_stats()
+        self.prewarm(['www.itv.com', 'nownext.oasvc.itv.com'])
+        self.assertEqual(2, self.server.connections)
+        self.assertEqual(0, len(self.server.requests))
+        fetch.get_json('https://nownext.oasvc.itv.com/channels')
+        fetch.get_document('https://www.itv.com')
+        self.assertEqual(2, self.server.connections)
+        new_stats = fetch.connection_stats()
+        self.assertEqual(stats['prewarmed'] + 2, new_stats['prewarmed'])
+        # Both requests used a prewarmed connection.
+        self.assertEqual(stats['opened'] + 2, new_stats['opened'])
+        self.assertEqual(stats['requests'] + 2, new_stats['requests'])
+        # Hosts with an idle connection are skipped
+        self.prewarm(['www.itv.com'])
+        self.assertEqual(2, self.server.connections)
+        self.assertEqual(new_stats['prewarmed'], fetch.connection_stats()['prewarmed'])
+
+    def test_request_takes_over_connection_being_prewarmed(self):
+        read_tickets = fetch._read_session_tickets
+
+        def slow_read_tickets(sock):
+            time.sleep(0.2)
+            return read_tickets(sock)
+
+        with patch('resources.lib.fetch._read_session_tickets', new=slow_read_tickets):
+            threads = fetch.prewarm(['nownext.oasvc.itv.com'])
+            fetch.get_json('https://nownext.oasvc.itv.com/channels')
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.server.connections)
+
+    def test_prewarm_skips_unavailable_hosts(self):
+        for _ in range(fetch.circuit_breaker.threshold):
+            fetch.circuit_breaker.failure('www.itv.com')
+        self.prewarm(['www.itv.com'])
+        self.assertEqual(0, self.server.connections)
+
+    def test_prewarm_connection_errors(self):
+        with patch('urllib3.util.connection.create_connection', side_effect=OSError) as p_connect:
+            self.prewarm(['www.itv.com', 'nownext.oasvc.itv.com'])
+        self.assertEqual(2, p_connect.call_count)
+        self.assertEqual(0, self.server.connections)
+
+    def test_connect_by_dns_cache(self):
+        connect_local = urllib3_connection.create_connection
+        entries = {'nownext.oasvc.itv.com': (time.monotonic() + 300, ['10.1.1.1'], 0.01)}
+        with patch.object(fetch.dns_cache, 'enabled', True), \
+                patch.object(fetch.dns_cache, '_entries', entries), \
+                patch.object(fetch.dns_cache, '_lookup') as p_lookup, \
+                patch('urllib3.util.connection.create_connection', wraps=connect_local) as p_connect:
+            fetch.get_json('https://nownext.oasvc.itv.com/channels')
+            fetch.close_session()
+            fetch.get_json('https://nownext.oasvc.itv.com/channels')
+        p_lookup.assert_not_called()
+        self.assertEqual(2, p_connect.call_count)
+        self.assertEqual(('10.1.1.1', 443), p_connect.call_args.args[0])
+
+    def test_dns_cache_falls_back_to_system_resolver(self):
+        connect_local = urllib3_connection.create_connection
+
+        def connect(address, *args, **kwargs):
+            if address[0] == '10.1.1.1':
+                raise TimeoutError('timed out')
+            return connect_local(address, *args, **kwargs)
+
+        entries = {'nownext.oasvc.itv.com': (time.monotonic() + 300, ['10.1.1.1'], 0.01)}
+        with patch.object(fetch.dns_cache, 'enabled', True), \
+                patch.object(fetch.dns_cache, '_entries', entries), \
+                patch('urllib3.util.connection.create_connection', side_effect=connect) as p_connect:
+            self.assertIsInstance(fetch.get_json('https://nownext.oasvc.itv.com/channels'), dict)
+            self.assertNotIn('nownext.oasvc.itv.com', entries)
+        self.assertEqual(('nownext.oasvc.itv.com', 443), p_connect.call_args.args[0])
+
+    def test_post_with_wildcard_url(self):
+        playlist = fetch.post_json('https://magni.itv.com/playlist/itvonline/ITV/1_7317_0001.001', {'a': 1})
+        self.assertIn('Playlist', playlist)
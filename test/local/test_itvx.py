@@ -11,13 +11,14 @@ fixtures.global_setup()
 from unittest import TestCase
 from unittest.mock import patch
 from datetime import timezone
+import json
 import types
 import time
 
 from test.support.testutils import open_json, open_doc, HttpResponse
 from test.support.object_checks import has_keys, is_li_compatible_dict, is_url, is_not_empty
 
-from resources.lib import itvx, errors, main, cache, utils, itv_account
+from resources.lib import itvx, errors, main, cache, utils, itv_account, parsex, fetch
 
 
 setUpModule = fixtures.setup_local_tests
@@ -30,42 +31,98 @@ def check_item(testcase, item):
     is_li_compatible_dict(testcase, item['show'])
 
 
-@patch('resources.lib.cache.set_item')
-@patch('resources.lib.fetch.get_document', return_value=open_doc('html/index.html')())
+@patch('resources.lib.fetch.web_request', return_value=HttpResponse(text=open_doc('html/index.html')()))
 class GetPageData(TestCase):
+    def setUp(self):
+        cache.purge()
+
+    @patch('resources.lib.cache.set_item')
     @patch('resources.lib.cache.get_item', return_value="Cached data")
-    def test_get_page_data(self, p_get_item, p_get_doc, p_set_item):
+    def test_get_page_data(self, p_get_item, p_set_item, p_req):
         data = itvx.get_page_data('/my/url')
         self.assertIsInstance(data, dict)
         p_get_item.assert_not_called()
         p_set_item.assert_not_called()
-        p_get_doc.assert_called_with('https://www.itv.com/my/url')
+        p_req.assert_called_with('GET', 'https://www.itv.com/my/url', None, stream=True)
         # full url with protocol
-        p_get_doc.reset_mock()
+        p_req.reset_mock()
         itvx.get_page_data('https://www.itv.com/my/url')
-        p_get_doc.assert_called_with('https://www.itv.com/my/url')
+        p_req.assert_called_with('GET', 'https://www.itv.com/my/url', None, stream=True)
         # with trailing space
-        p_get_doc.reset_mock()
+        p_req.reset_mock()
         itvx.get_page_data('/my/url ')
-        p_get_doc.assert_called_with('https://www.itv.com/my/url')
+        p_req.assert_called_with('GET', 'https://www.itv.com/my/url', None, stream=True)
 
-    @patch('resources.lib.cache.get_item', return_value="Cached data")
-    def test_get_page_from_cache(self, p_get_item, _, p_set_item):
+    def test_get_page_from_cache(self, p_req):
         url = 'some/url'
-        data = itvx.get_page_data(url, 20)
-        self.assertEqual("Cached data", data)
-        full_url = "https://www.itv.com" + url
-        p_get_item.assert_called_with(full_url)
-        p_set_item.assert_not_called()
+        data_1 = itvx.get_page_data(url, 20)
+        self.assertIsInstance(data_1, dict)
+        p_req.assert_called_once()
+        self.assertEqual("https://www.itv.com" + url, p_req.call_args[0][1])
+        data_2 = itvx.get_page_data(url, 20)
+        p_req.assert_called_once()
+        self.assertIs(data_1, data_2)
+
+    def test_get_stale_page(self, p_req):
+        url = 'some/url'
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            itvx.get_page_data(url, 20, max_stale=60)
+        p_req.reset_mock()
+        with patch('resources.lib.cache.threading.Thread') as p_thread:
+            # Stale data is returned, while the page is refreshed in the background
+            with patch('resources.lib.cache.time.monotonic', return_value=1030):
+                data = itvx.get_page_data(url, 20, max_stale=60)
+            self.assertIsInstance(data, dict)
+            p_thread.assert_called_once()
+            p_req.assert_not_called()
+            # The mocked refresh never completes; a foreground fetch would wait for it.
+            cache._in_flight.clear()
+            # Beyond max_stale the page is fetched in the foreground
+            p_thread.reset_mock()
+            with patch('resources.lib.cache.time.monotonic', return_value=1100):
+                itvx.get_page_data(url, 20, max_stale=60)
+            p_thread.assert_not_called()
+            p_req.assert_called_once()
+
+    def test_get_page_data_projected(self, p_req):
+        full_data = itvx.get_page_data('some/url')
+        data = itvx.get_page_data('some/url', projection=('heroContent', 'editorialSliders'))
+        self.assertEqual(['editorialSliders', 'heroContent'], sorted(data.keys()))
+        self.assertEqual(full_data['heroContent'], data['heroContent'])
+        # Projected data is cached separately from the full data, and the order of paths doesn't matter.
+        p_req.reset_mock()
+        data_1 = itvx.get_page_data('some/url', 20, projection=('heroContent',))
+        self.assertEqual(['heroContent'], list(data_1.keys()))
+        data_2 = itvx.get_page_data('some/url', 20, projection=['heroContent'])
+        self.assertIs(data_1, data_2)
+        data_3 = itvx.get_page_data('some/url', 20)
+        self.assertEqual(full_data, data_3)
+        self.assertEqual(2, p_req.call_count)
+        # Only the full data sets the digest used by parsed listings.
+        p_req.reset_mock()
+        cache.purge()
+        itvx.get_page_data('some/url', 20, projection=('heroContent',))
+        self.assertIsNone(cache.get_item('digest https://www.itv.com/some/url'))
 
-    @patch('resources.lib.cache.get_item', return_value=None)
-    def test_get_page_from_empty_cache(self, p_get_item, _, p_set_item):
+    def test_revalidate_expired_page(self, p_req):
         url = 'some/url'
-        data = itvx.get_page_data(url, 20)
-        self.assertIsInstance(data, dict)
-        full_url = "https://www.itv.com" + url
-        p_get_item.assert_called_with(full_url)
-        p_set_item.assert_called_with(full_url, data, 20)
+        p_req.return_value = HttpResponse(text=open_doc('html/index.html')(), headers={'ETag': '"abc"'})
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            data_1 = itvx.get_page_data(url, 20)
+        # Not modified; the cached data is used for another 20 seconds.
+        p_req.return_value = HttpResponse(status_code=304, content=b'')
+        with patch('resources.lib.cache.time.monotonic', return_value=1030):
+            data_2 = itvx.get_page_data(url, 20)
+        self.assertIs(data_1, data_2)
+        self.assertEqual('"abc"', p_req.call_args[0][2]['If-None-Match'])
+        p_req.reset_mock()
+        with patch('resources.lib.cache.time.monotonic', return_value=1045):
+            itvx.get_page_data(url, 20)
+        p_req.assert_not_called()
+        # Modified
+        p_req.return_value = HttpResponse(text='<html></html>', headers={'ETag': '"def"'})
+        with patch('resources.lib.cache.time.monotonic', return_value=1060):
+            self.assertRaises(errors.ParseError, itvx.get_page_data, url, 20)
 
 
 @patch('resources.lib.fetch.get_json', new=lambda *a, **k: open_json('schedule/now_next.json'))
@@ -144,36 +201,100 @@ class MainPageItem(TestCase):
             self.assertListEqual([], items)
 
 
+class ParsedListings(TestCase):
+    def setUp(self):
+        cache.purge()
+
+    def tearDown(self):
+        cache.purge()
+
+    @patch('resources.lib.fetch.web_request', return_value=HttpResponse(text=open_doc('html/index.html')()))
+    def test_unchanged_page_is_parsed_once(self, p_req):
+        with patch('resources.lib.parsex.parse_collection_item', wraps=parsex.parse_collection_item) as p_parse:
+            items_1 = itvx.collection_content('https://www.itv.com', slider='trendingSliderContent')
+            parse_count = p_parse.call_count
+            self.assertGreater(parse_count, 0)
+            items_2 = itvx.collection_content('https://www.itv.com', slider='trendingSliderContent')
+            self.assertEqual(parse_count, p_parse.call_count)
+            self.assertListEqual(items_1, items_2)
+            # Other arguments are other listings
+            itvx.collection_content('https://www.itv.com', slider='trendingSliderContent', hide_paid=True)
+            self.assertEqual(2 * parse_count, p_parse.call_count)
+            # A new version of the parsers does not use listings of the previous version.
+            with patch('resources.lib.parsex.PARSER_VERSION', parsex.PARSER_VERSION + 1):
+                itvx.collection_content('https://www.itv.com', slider='trendingSliderContent')
+                self.assertEqual(3 * parse_count, p_parse.call_count)
+        p_req.assert_called_once()
+
+    @patch('resources.lib.fetch.web_request', return_value=HttpResponse(text=open_doc('html/index.html')()))
+    def test_changed_page_is_parsed_again(self, p_req):
+        url = 'https://www.itv.com'
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            items_1 = itvx.collection_content(url, slider='trendingSliderContent')
+        with patch('resources.lib.parsex.parse_collection_item', wraps=parsex.parse_collection_item) as p_parse:
+            # The page has expired, but its content has not changed.
+            with patch('resources.lib.cache.time.monotonic', return_value=1000 + 50000):
+                items_2 = itvx.collection_content(url, slider='trendingSliderContent')
+            self.assertEqual(2, p_req.call_count)
+            p_parse.assert_not_called()
+            self.assertListEqual(items_1, items_2)
+            # The page has changed.
+            page = open_doc('html/index.html')().replace('"isPaid":false', '"isPaid":true', 1)
+            p_req.return_value = HttpResponse(text=page)
+            with patch('resources.lib.cache.time.monotonic', return_value=1000 + 100000):
+                itvx.collection_content(url, slider='trendingSliderContent')
+            p_parse.assert_called()
+
+    @patch('resources.lib.fetch.web_request')
+    def test_listing_with_live_items_is_parsed_again(self, p_req):
+        # A main page with a live hero item.
+        page_data = {'props': {'pageProps': open_json('json/index-data.json')}}
+        p_req.return_value = HttpResponse(
+            text='<script id="__NEXT_DATA__" type="application/json">{}</script>'.format(json.dumps(page_data)))
+        with patch('resources.lib.parsex.parse_simulcast_item', wraps=parsex.parse_simulcast_item) as p_parse:
+            with patch('resources.lib.cache.time.monotonic', return_value=1000):
+                itvx.main_page_items()
+                parse_count = p_parse.call_count
+                self.assertGreater(parse_count, 0)
+                itvx.main_page_items()
+                self.assertEqual(parse_count, p_parse.call_count)
+            # The page data is still valid, but the listing's live items have expired.
+            with patch('resources.lib.cache.time.monotonic', return_value=1000 + itvx.LIVE_LISTING_TIME + 1):
+                itvx.main_page_items()
+            self.assertEqual(2 * parse_count, p_parse.call_count)
+        p_req.assert_called_once()
+
+
 class Collections(TestCase):
     def setUp(self):
         cache.purge()
 
     @patch('resources.lib.itvx.get_page_data', return_value=open_json('json/index-data.json'))
     def test_collection_news(self, _):
-        items = list(filter(None, itvx.collection_content(slider='newsShortForm')))
+        items = list(filter(None, itvx.collection_content('https://www.itv.com', slider='newsShortForm')))
         self.assertEqual(3, len(items))
         for item in items:
             check_item(self, item)
-        items2 = list(filter(None, itvx.collection_content(slider='newsShortForm', hide_paid=True)))
+        items2 = list(filter(None, itvx.collection_content('https://www.itv.com', slider='newsShortForm', hide_paid=True)))
         self.assertListEqual(items, items2)
 
     @patch('resources.lib.itvx.get_page_data', return_value=open_json('json/test_collection.json'))
     def test_collection_content_shortForm(self, _):
         """The contents of a shortForm slider on a collection page."""
-        items = list(filter(None, itvx.collection_content(slider='shortFormSlider')))
+        items = list(filter(None, itvx.collection_content('https://www.itv.com', slider='shortFormSlider')))
         self.assertEqual(2, len(items))
         for item in items:
             check_item(self, item)
-        items2 = list(filter(None, itvx.collection_content(slider='shortFormSlider', hide_paid=True)))
+        items2 = list(filter(None, itvx.collection_content('https://www.itv.com', slider='shortFormSlider', hide_paid=True)))
         self.assertListEqual(items, items2)
 
     @patch('resources.lib.itvx.get_page_data', return_value=open_json('json/index-data.json'))
     def test_collection_trending(self, _):
-        items = list(filter(None, itvx.collection_content(slider='trendingSliderContent')))
+        items = list(filter(None, itvx.collection_content('https://www.itv.com', slider='trendingSliderContent')))
         self.assertGreater(len(items), 10)
         for item in items:
             check_item(self, item)
-        items2 = list(filter(None, itvx.collection_content(slider='trendingSliderContent', hide_paid=True)))
+        items2 = list(filter(None, itvx.collection_content('https://www.itv.com', slider='trendingSliderContent', hide_paid=True)))
         self.assertListEqual(items, items2)
 
     @patch('resources.lib.itvx.get_page_data', return_value=open_json('json/index-data.json'))
@@ -294,6 +415,22 @@ class Categories(TestCase):
                 self.assertGreater(playables, 0)
                 self.assertLess(playables, len(program_list) / 2)
 
+    @patch('resources.lib.itvx.get_page_data', return_value=open_json('html/category_drama-soaps.json'))
+    def test_category_content_is_parsed_lazily(self, _):
+        page_data = open_json('html/category_drama-soaps.json')
+        expected = sorted((parsex.parse_category_item(prog, 'DRAMA_AND_SOAPS') for prog in page_data['programmes']),
+                          key=lambda item: item['show']['info']['sorttitle'])
+        with patch('resources.lib.itvx.parsex.parse_category_item', wraps=parsex.parse_category_item) as p_parse:
+            program_list = itvx.category_content('asdgf')
+            self.assertEqual(len(expected), len(program_list))
+            self.assertListEqual([item['show']['info']['sorttitle'] for item in expected], program_list.sort_titles)
+            p_parse.assert_not_called()
+            page = program_list[10:20]
+            self.assertListEqual(expected[10:20], list(page))
+            self.assertEqual(10, p_parse.call_count)
+            self.assertEqual('DRAMA_AND_SOAPS', p_parse.call_args.kwargs['category_id'])
+        self.assertListEqual(expected, list(program_list))
+
     @patch('resources.lib.itvx.get_page_data', return_value=open_json('html/category_films.json'))
     def test_category_films(self, _):
         program_list = list(itvx.category_content('asdgf'))
@@ -387,6 +524,9 @@ class Episodes(TestCase):
 
 
 class Search(TestCase):
+    def setUp(self):
+        cache.purge()
+
     @patch('requests.sessions.Session.send', return_value=HttpResponse(text=open_doc('search/test_results.json')()))
     def test_simple_search(self, _):
         result = itvx.search('the_chase')
@@ -402,6 +542,7 @@ class Search(TestCase):
         with patch('requests.sessions.Session.send', return_value=HttpResponse(200, content=b'{"results": []}')):
             result = itvx.search('xprs')
             self.assertListEqual([], list(result))
+        cache.purge()
         with patch('requests.sessions.Session.send', return_value=HttpResponse(200, content=b'no content')):
             result = itvx.search('xprs')
             self.assertIsNone(result)
@@ -413,6 +554,47 @@ class Search(TestCase):
         results = list(itvx.search('blbl', hide_paid=True))
         self.assertIsNone(results[0])
 
+    def test_search_results_are_cached(self):
+        with patch('requests.sessions.Session.send',
+                   return_value=HttpResponse(text=open_doc('search/test_results.json')())) as p_send:
+            results_1 = list(itvx.search('The Chase'))
+            p_send.assert_called_once()
+            self.assertIn('query=the%20chase&', p_send.call_args.args[0].url)
+            # Same query after normalisation
+            results_2 = list(itvx.search('  the   CHASE '))
+            self.assertEqual(results_1, results_2)
+            p_send.assert_called_once()
+            # Another value of hide_paid is another query
+            itvx.search('the chase', hide_paid=True)
+            self.assertEqual(2, p_send.call_count)
+
+    def test_search_results_are_cached_in_memory_only(self):
+        with patch('requests.sessions.Session.send',
+                   return_value=HttpResponse(text=open_doc('search/test_results.json')())), \
+                patch('resources.lib.cache.set_item', wraps=cache.set_item) as p_set:
+            itvx.search('The Chase')
+            itvx.search('my_show 2', hide_paid=True)
+        self.assertEqual(2, p_set.call_count)
+        for call in p_set.call_args_list:
+            key = call.args[0]
+            self.assertEqual('search', cache.key_prefix(key))
+            self.assertNotIn('chase', key)
+            self.assertFalse(call.kwargs.get('persistent', False))
+
+    def test_failed_search_is_not_cached(self):
+        with patch('requests.sessions.Session.send', return_value=HttpResponse(204)) as p_send:
+            self.assertIsNone(itvx.search('xprs'))
+            self.assertIsNone(itvx.search('xprs'))
+            self.assertEqual(2, p_send.call_count)
+        with patch('requests.sessions.Session.send', return_value=HttpResponse(404, content=b'')):
+            self.assertIsNone(itvx.search('xprs'))
+
+    def test_search_uses_http_session(self):
+        with patch.object(fetch.HttpSession, 'request',
+                          return_value=HttpResponse(text=open_doc('search/test_results.json')())) as p_req:
+            self.assertEqual(8, len(list(itvx.search('the chase'))))
+            p_req.assert_called_once()
+
 
 class LastWatched(TestCase):
     def setUp(self):
@@ -478,8 +660,8 @@ class LastWatched(TestCase):
 
 
 class GetPLaylistUrl(TestCase):
-    @patch('resources.lib.fetch.get_document', new=open_doc('html/film.html'))
-    def test_get_playlist_from_film_page(self):
+    @patch('resources.lib.fetch.web_request', return_value=HttpResponse(text=open_doc('html/film.html')()))
+    def test_get_playlist_from_film_page(self, _):
         result = itvx.get_playlist_url_from_episode_page('page')
         self.assertTrue(is_url(result))
 
@@ -494,8 +676,8 @@ class GetPLaylistUrl(TestCase):
         result = itvx.get_playlist_url_from_episode_page('page')
         self.assertTrue(is_url(result))
 
-    @patch('resources.lib.fetch.get_document', new=open_doc('html/news-short_item.html'))
-    def test_get_playlist_from_news_shortform_item(self):
+    @patch('resources.lib.fetch.web_request', return_value=HttpResponse(text=open_doc('html/news-short_item.html')()))
+    def test_get_playlist_from_news_shortform_item(self, _):
         result = itvx.get_playlist_url_from_episode_page('page')
         self.assertTrue(is_url(result))
 
@@ -541,6 +723,19 @@ class GetMyList(TestCase):
     def test_get_mylist_not_signed_in(self, _):
         self.assertRaises(SystemExit, itvx.my_list, '156-45xsghf75-4sf569')
 
+    @patch('resources.lib.itv_account.fetch_authenticated', return_value=open_json('usercontent/mylist_test_data.json'))
+    def test_stale_mylist_refreshed_without_login(self, p_fetch):
+        with patch('resources.lib.cache.time.monotonic', return_value=1000):
+            itvx.my_list('156-45xsghf75-4sf569')
+        self.assertIs(True, p_fetch.call_args.kwargs['login'])
+        with patch('resources.lib.cache.time.monotonic', return_value=3000):
+            with patch('resources.lib.cache.threading.Thread') as p_thread:
+                itvx.my_list('156-45xsghf75-4sf569')
+            p_fetch.assert_called_once()
+            cache._refresh(*p_thread.call_args.kwargs['args'])
+        self.assertEqual(2, p_fetch.call_count)
+        self.assertIs(False, p_fetch.call_args.kwargs['login'])
+
     @patch('resources.lib.itv_account.fetch_authenticated', return_value=open_json('usercontent/mylist_test_data.json'))
     def test_get_my_list_cache_not_used_after_user_change(self, p_fetch):
         itvx.my_list('156-45xsghf75-4sf569')
@@ -550,6 +745,13 @@ class GetMyList(TestCase):
         itvx.my_list('xxx')
         p_fetch.assert_called_once()
 
+    @patch('resources.lib.itv_account.fetch_authenticated', return_value=open_json('usercontent/mylist_test_data.json'))
+    def test_get_mylist_after_sign_out(self, p_fetch):
+        itvx.my_list('156-45xsghf75-4sf569')
+        cache.invalidate(cache.TAG_USER)
+        itvx.my_list('156-45xsghf75-4sf569')
+        self.assertEqual(2, p_fetch.call_count)
+
     @patch('resources.lib.itv_account.fetch_authenticated', return_value=open_json('usercontent/mylist_test_data.json'))
     def test_add_mylist_item(self, p_fetch):
         result = itvx.my_list('156-45xsghf75-4sf569', '10_3408', 'add')
@@ -25,7 +25,10 @@ from test.support import object_checks
 from resources.lib import main
 from resources.lib import errors
 from resources.lib import cache
+from resources.lib import fetch
 from resources.lib import itv_account
+from resources.lib import itvx
+from resources.lib import parsex
 
 
 setUpModule = fixtures.setup_local_tests
@@ -49,6 +52,23 @@ class Paginator(TestCase):
         result = list(pg)
         self.assertListEqual([], result)
 
+    def test_lazy_items_are_parsed_only_when_listed(self):
+        with patch('resources.lib.itvx.parsex.parse_category_item', wraps=parsex.parse_category_item) as p_parse:
+            with patch('resources.lib.itvx.get_page_data', return_value=open_json('html/category_children.json')):
+                items = itvx.category_content('sdfg')
+            # A-Z listing
+            with patch('xbmcaddon.Addon.getSettingInt', return_value=20):
+                result = list(main.Paginator(items, filter_char=None, page_nr=0, path='sdfg'))
+                self.assertEqual('A', result[0].label)
+                p_parse.assert_not_called()
+            # The first page of programmes starting with 'b'
+            with patch('xbmcaddon.Addon.getSettingInt', side_effect=(20, 5)):
+                result = list(main.Paginator(items, filter_char='B', page_nr=0, path='sdfg'))
+            nr_of_b_items = sum(1 for title in items.sort_titles if title.startswith('b'))
+            self.assertGreater(nr_of_b_items, 10)
+            self.assertEqual(6, len(result))      # 5 programmes and a 'next page' item.
+            self.assertEqual(5, p_parse.call_count)
+
 
 @patch('resources.lib.itvx.get_page_data', return_value=open_json('json/index-data.json'))
 class MainMenu(TestCase):
@@ -401,6 +421,9 @@ class Productions(TestCase):
 
 
 class Search(TestCase):
+    def setUp(self):
+        cache.purge()
+
     @patch('requests.sessions.Session.send',
            return_value=HttpResponse(text=open_doc('search/test_results.json')()))
     def test_search_all_result_types(self, _):
@@ -424,6 +447,8 @@ class Search(TestCase):
         with patch('requests.sessions.Session.send', return_value=HttpResponse(text=json.dumps(search_data))):
             results_1 = main.do_search.test('kjhbn')
             self.assertEqual(8, len(results_1))
+        # Results of the first search are cached.
+        cache.purge()
         # check again with one item having an unknown entity type
         search_data['results'][3]['entityType'] = 'video'
         with patch('requests.sessions.Session.send', return_value=HttpResponse(text=json.dumps(search_data))):
@@ -617,13 +642,37 @@ class PlayTitle(TestCase):
 
 
 class Run(TestCase):
+    def tearDown(self):
+        fetch.dns_cache.enabled = False
+
     @patch('sys.argv', return_value=['script', '1'])
+    @patch('xbmcaddon.Addon.getSettingBool', return_value=False)
     @patch('resources.lib.main.cc_run', return_value=ValueError())
     @patch('xbmcplugin.endOfDirectory')
-    def test_run_failure(self, p_end_of_dir, _, __):
+    def test_run_failure(self, p_end_of_dir, _, __, ___):
         main.run()
         p_end_of_dir.assert_called_once_with(1, False)
 
+    @patch('resources.lib.main.cc_run', return_value=None)
+    @patch('resources.lib.fetch.prewarm')
+    def test_run_prewarm_connections(self, p_prewarm, _):
+        with patch('xbmcaddon.Addon.getSettingBool', return_value=False):
+            with patch('sys.argv', ['plugin://plugin.video.viwx/', '1']):
+                main.run()
+                p_prewarm.assert_not_called()
+        with patch('xbmcaddon.Addon.getSettingBool', return_value=True):
+            with patch('sys.argv', ['plugin://plugin.video.viwx/', '1']):
+                main.run()
+                p_prewarm.assert_called_once_with(('www.itv.com',))
+            p_prewarm.reset_mock()
+            with patch('sys.argv', ['plugin://plugin.video.viwx/resources/lib/main/sub_menu_live/', '1']):
+                main.run()
+                p_prewarm.assert_called_once_with(('nownext.oasvc.itv.com', 'scheduled.oasvc.itv.com'))
+            p_prewarm.reset_mock()
+            with patch('sys.argv', ['plugin://plugin.video.viwx/resources/lib/settings/cache_diagnostics/', '1']):
+                main.run()
+                p_prewarm.assert_not_called()
+
     @patch('resources.lib.main.cc_run', return_value=None)
     @patch.object(main, 'running_version', '1.0.0')
     @patch('xbmcaddon.Addon.getAddonInfo', lambda _, s: '2.0.0' if s == 'version' else '')
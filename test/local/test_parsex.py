@@ -31,14 +31,97 @@ class TestScrapeJson(unittest.TestCase):
         data = parsex.scrape_json(get_page())
         self.assertIsInstance(data, dict)
 
+    def test_scrape_json_and_digest(self):
+        page = open_doc('html/index.html')()
+        data, digest = parsex.scrape_json_and_digest(page)
+        self.assertIsInstance(data, dict)
+        self.assertEqual(40, len(digest))
+        self.assertEqual(digest, parsex.scrape_json_and_digest(page)[1])
+        # A change of anything outside __NEXT_DATA__ does not change the digest.
+        self.assertEqual(digest, parsex.scrape_json_and_digest(page.replace('<html', '<html class="x"', 1))[1])
+
+    def test_scrape_json_from_bytes(self):
+        for doc in ('html/index.html', 'html/film.html'):
+            page = open_doc(doc)()
+            self.assertEqual(parsex.scrape_json_and_digest(page), parsex.scrape_json_and_digest(page.encode('utf8')))
+            self.assertEqual(parsex.scrape_json_and_digest(page),
+                             parsex.scrape_json_and_digest(bytearray(page.encode('utf8'))))
+
+    def test_stops_reading_at_end_of_empty_data(self):
+        chunks = iter([b'<script id="__NEXT_DATA__" type="application/json">', b'</script>', b'<script>more'])
+        self.assertRaises(errors.ParseError, parsex.scrape_json_stream, chunks)
+        self.assertEqual(b'<script>more', next(chunks))
+
     def test_invalid_page(self):
         # no __NEXT_DATA___
         self.assertRaises(errors.ParseError, parsex.scrape_json, '<html></html')
+        self.assertRaises(errors.ParseError, parsex.scrape_json, b'<html></html')
+        # no end tag, or no data
+        self.assertRaises(errors.ParseError, parsex.scrape_json,
+                          b'<script id="__NEXT_DATA__" type="application/json">{"props": {}}')
+        self.assertRaises(errors.ParseError, parsex.scrape_json,
+                          b'<script id="__NEXT_DATA__" type="application/json"></script>')
+        # invalid utf-8
+        self.assertRaises(errors.ParseError, parsex.scrape_json,
+                          b'<script id="__NEXT_DATA__" type="application/json">{"props": "\xff"}</script>')
         # invalid json
         self.assertRaises(errors.ParseError, parsex.scrape_json,
                           '<script id="__NEXT_DATA__" type="application/json">{data=[1,2]}</script>')
 
 
+class Project(unittest.TestCase):
+    def test_project(self):
+        data = {'a': {'b': 1, 'c': [{'d': 2}]}, 'e': 'x', 'f': None}
+        self.assertEqual({'e': 'x'}, parsex.project(data, ('e',)))
+        self.assertEqual({'a': {'b': 1}, 'f': None}, parsex.project(data, ('a.b', 'f')))
+        self.assertEqual({'a': {'b': 1, 'c': [{'d': 2}]}}, parsex.project(data, ('a.b', 'a.c')))
+        self.assertIs(data['a']['c'], parsex.project(data, ('a.c',))['a']['c'])
+        self.assertEqual(data, parsex.project(data, ('a', 'e', 'f')))
+
+    def test_project_missing_paths(self):
+        data = {'a': {'b': 1}, 'e': 'x'}
+        self.assertEqual({}, parsex.project(data, ('x',)))
+        self.assertEqual({}, parsex.project(data, ('e.b',)))
+        self.assertEqual({}, parsex.project(data, ('x.b',)))
+        self.assertEqual({'a': {}}, parsex.project(data, ('a.x',)))
+        self.assertEqual({}, parsex.project(data, ()))
+
+
+class TestScrapeJsonStream(unittest.TestCase):
+    @staticmethod
+    def chunks(doc, size):
+        return (doc[i:i + size] for i in range(0, len(doc), size))
+
+    def test_same_result_as_scrape_json(self):
+        page = open_doc('html/index.html')()
+        expected = parsex.scrape_json_and_digest(page)
+        doc = page.encode('utf8')
+        # Include chunk sizes that split the start and end tags.
+        for size in (1, 7, 1000, 32 * 1024, len(doc)):
+            self.assertEqual(expected, parsex.scrape_json_stream(self.chunks(doc, size)))
+
+    def test_stops_reading_at_end_of_data(self):
+        doc = b'<html><script id="__NEXT_DATA__" type="application/json">{"props": {"pageProps": {"a": 1}}}' \
+              b'</script><script>more</script></html>'
+        chunks = self.chunks(doc, 10)
+        data, _ = parsex.scrape_json_stream(chunks)
+        self.assertDictEqual({'a': 1}, data)
+        self.assertEqual(b'<script>mo', next(chunks))
+
+    def test_invalid_page(self):
+        self.assertRaises(errors.ParseError, parsex.scrape_json_stream, [b'<html>', b'</html>'])
+        self.assertRaises(errors.ParseError, parsex.scrape_json_stream, [])
+        # Data without end tag
+        self.assertRaises(errors.ParseError, parsex.scrape_json_stream,
+                          [b'<script id="__NEXT_DATA__" type="application/json">{"props": {}}'])
+        # invalid json
+        self.assertRaises(errors.ParseError, parsex.scrape_json_stream,
+                          [b'<script id="__NEXT_DATA__" type="application/json">{data=[1,2]}</script>'])
+        # invalid utf-8
+        self.assertRaises(errors.ParseError, parsex.scrape_json_stream,
+                          [b'<script id="__NEXT_DATA__" type="application/json">{"a": "\xff"}</script>'])
+
+
 class ParseSimulcastItem(unittest.TestCase):
     def check_result(self, result):
         is_li_compatible_dict(self, result['show'])
@@ -136,6 +219,26 @@ class Generic(unittest.TestCase):
         url = parsex.build_url("Watch Thursday's ITV Evening News", '10a3819')
         self.assertEqual('https://www.itv.com/watch/watch-thursdays-itv-evening-news/10a3819', url)
 
+    def test_image_urls(self):
+        template = open_json('html/category_films.json')['programmes'][0]['imageTemplate']
+        for url_func, props in ((parsex.thumb_url, parsex.IMG_PROPS_THUMB),
+                                (parsex.fanart_url, parsex.IMG_PROPS_FANART),
+                                (parsex.poster_url, parsex.IMG_PROPS_POSTER)):
+            url_func.cache_clear()
+            url = url_func(template)
+            self.assertEqual(template.format(**props), url)
+            self.assertNotIn('{', url)
+            self.assertIs(url, url_func(template))
+            self.assertEqual(1, url_func.cache_info().hits)
+            self.assertEqual(parsex.TEMPLATE_CACHE_SIZE, url_func.cache_info().maxsize)
+
+    def test_programme_slug_is_cached(self):
+        parsex.programme_slug.cache_clear()
+        parsex.build_url('Astrid & Lily Save the World', '10a2921')
+        parsex.build_url('Astrid & Lily Save the World', '10a2921', '10a2921a0001')
+        self.assertEqual('astrid-and-lily-save-the-world', parsex.programme_slug('Astrid & Lily Save the World'))
+        self.assertEqual(2, parsex.programme_slug.cache_info().hits)
+
     def test_sort_title(self):
         self.assertEqual('my title', parsex.sort_title('My Title'))
         self.assertEqual('title', parsex.sort_title('The Title'))
@@ -267,3 +267,23 @@ class TestSettings(unittest.TestCase):
             with patch.object(logger, 'handlers', new=[py_logging.Handler()]):
                 settings.change_logger(MagicMock())
                 p_ask.assert_called_with(0)
+
+    @patch("resources.lib.kodi_utils.msg_dlg")
+    def test_cache_diagnostics(self, p_dlg):
+        import json
+        import os
+        from resources.lib import cache, fetch, utils
+
+        cache.set_item('https://www.itv.com/watch/collections/some_collection', {'a': 1}, 10)
+        cache.get_item('https://www.itv.com/watch/collections/some_collection')
+        settings.cache_diagnostics(MagicMock())
+        file_path = os.path.join(utils.addon_info.profile, 'cache_stats.json')
+        with open(file_path) as f:
+            stats = json.load(f)
+        self.assertEqual(1, stats['prefixes']['www.itv.com/watch/collections']['hits'])
+        self.assertIn('reused', stats['connections'])
+        self.assertIsInstance(stats['requests'], dict)
+        self.assertIn('time_saved', stats['dns'])
+        p_dlg.assert_called_once_with(settings.TXT_CACHE_STATS_SAVED, file_path=file_path)
+        os.remove(file_path)
+        os.remove(os.path.join(utils.addon_info.profile, fetch.TIMINGS_FILE_NAME))
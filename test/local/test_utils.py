@@ -137,6 +137,63 @@ class Generic(TestCase):
         char_list = utils.list_start_chars(items)
         self.assertListEqual(char_list, ['0-9'])
 
+    def test_list_start_chars_of_lazy_items(self):
+        items = utils.LazyItems(['asgf', 'bhfl', '#maf'], ['asgf', 'bhfl', '#maf'], None)
+        self.assertListEqual(['A', 'B', '0-9'], utils.list_start_chars(items))
+
+
+class LazyItems(TestCase):
+    @staticmethod
+    def lazy_items(nr_of_items=10):
+        parsed = []
+
+        def parser(raw_item):
+            parsed.append(raw_item)
+            return {'show': {'info': {'sorttitle': raw_item.lower()}}}
+
+        raw_items = [string.ascii_uppercase[i] for i in range(nr_of_items)]
+        return utils.LazyItems(raw_items, [item.lower() for item in raw_items], parser), parsed
+
+    def test_items_are_parsed_on_access(self):
+        items, parsed = self.lazy_items()
+        self.assertEqual(10, len(items))
+        self.assertListEqual([], parsed)
+        self.assertEqual('c', items[2]['show']['info']['sorttitle'])
+        self.assertEqual('j', items[-1]['show']['info']['sorttitle'])
+        self.assertListEqual(['C', 'J'], parsed)
+        # Parsed once
+        self.assertIs(items[2], items[2])
+        self.assertListEqual(['C', 'J'], parsed)
+        self.assertRaises(IndexError, items.__getitem__, 10)
+        self.assertEqual(10, len(list(items)))
+        self.assertEqual(10, len(parsed))
+
+    def test_slice(self):
+        items, parsed = self.lazy_items()
+        first = items[2]
+        page = items[1:4]
+        self.assertIsInstance(page, utils.LazyItems)
+        self.assertListEqual(['b', 'c', 'd'], page.sort_titles)
+        self.assertListEqual(['C'], parsed)
+        self.assertIs(first, page[1])
+        self.assertListEqual(['b', 'c', 'd'], [item['show']['info']['sorttitle'] for item in page])
+        self.assertListEqual(['C', 'B', 'D'], parsed)
+        self.assertEqual(0, len(items[20:30]))
+
+    def test_filter(self):
+        items, parsed = self.lazy_items()
+        filtered = items.filter(lambda title: title in 'aeiou')
+        self.assertIsInstance(filtered, utils.LazyItems)
+        self.assertListEqual(['a', 'e', 'i'], filtered.sort_titles)
+        self.assertListEqual([], parsed)
+
+    def test_paginate(self):
+        items, parsed = self.lazy_items(26)
+        page, next_page_nr = utils.paginate(items, 1, 5, merge_count=2)
+        self.assertEqual(2, next_page_nr)
+        self.assertListEqual(['f', 'g', 'h', 'i', 'j'], [item['show']['info']['sorttitle'] for item in page])
+        self.assertListEqual(['F', 'G', 'H', 'I', 'J'], parsed)
+
 
 # noinspection PyMethodMayBeStatic
 class VttToSrt(TestCase):
@@ -14,6 +14,7 @@ from unittest.mock import patch
 
 import xbmcvfs
 import xbmcaddon
+import requests
 
 
 patch_g = None
@@ -53,6 +54,11 @@ def global_setup():
             os.remove(os.path.join(profile_dir, info_map['name'] + '.log'))
         except FileNotFoundError:
             pass
+        # Start each test run with an empty disk cache.
+        try:
+            os.remove(os.path.join(profile_dir, 'cache.db'))
+        except FileNotFoundError:
+            pass
         patch('xbmcaddon.Addon.getSettingString',
               new=lambda self, item: 'file' if item == 'log-handler' else '').start()
         # Import module to setup logging
@@ -69,6 +75,10 @@ class RealWebRequestMadeError(Exception):
     pass
 
 
+# The unpatched Session.send, for local tests that make requests to a local server.
+real_session_send = requests.sessions.Session.send
+
+
 def setup_local_tests():
     """Module level fixture for all local tests. Ensures that no unintentional real
     web requests can occur.
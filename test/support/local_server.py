@@ -0,0 +1,272 @@
+# ----------------------------------------------------------------------------------------------------------------------
+#  Copyright (c) 2025 Dimitri Kroon.
+#  This file is part of plugin.video.viwx.
+#  SPDX-License-Identifier: GPL-2.0-or-later
+#  See LICENSE.txt
+# ----------------------------------------------------------------------------------------------------------------------
+
+"""
+A local stand-in for ITVX's web servers.
+
+Serves the documents in test_docs, as listed in test_docs/recordings.json,
+over real sockets, so that connection reuse, TLS, streaming and concurrency
+of the fetch layer can be tested and benchmarked end to end.
+
+Typical use:
+
+    with LocalItvServer(delay=0.05) as server, server.redirect():
+        itvx.get_page_data('https://www.itv.com')
+
+Within `redirect()` all connections, to whatever host, are made to the local
+server and the server's self-signed certificate is trusted by the HttpSession,
+so the addon's code can use the real URLs of ITVX. A request is served by the
+recorded response to the requested URL, or, if the server is requested by its
+own address, by the first recorded response with the same path.
+
+TLS requires the openssl command line tool to create a certificate; without
+it, the server can only be used with plain HTTP at its address `url`.
+
+"""
+
+import os
+import ssl
+import atexit
+import time
+import shutil
+import fnmatch
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from unittest.mock import patch
+
+from urllib3.util import connection as urllib3_connection
+
+from resources.lib import fetch
+
+from test.support import fixtures
+from test.support.testutils import doc_path
+
+
+# Instead of sending a response, close the connection.
+RESET = 'reset'
+
+_cert_files = None
+
+
+def tls_available():
+    return shutil.which('openssl') is not None
+
+
+def _create_certificate(hosts):
+    """Create a self-signed certificate for localhost and all `hosts`.
+    Return a tuple of the paths to the certificate and the key file.
+
+    The certificate is created once and shared by all servers. Its temporary
+    directory is removed when the process exits.
+
+    """
+    global _cert_files
+    if _cert_files is None:
+        cert_dir = tempfile.mkdtemp(prefix='viwx-test-')
+        atexit.register(shutil.rmtree, cert_dir, ignore_errors=True)
+        cert_file = os.path.join(cert_dir, 'cert.pem')
+        key_file = os.path.join(cert_dir, 'key.pem')
+        alt_names = ','.join(['DNS:localhost', 'IP:127.0.0.1'] + ['DNS:' + host for host in sorted(hosts)])
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                        '-keyout', key_file, '-out', cert_file, '-subj', '/CN=localhost',
+                        '-addext', 'subjectAltName=' + alt_names],
+                       check=True, capture_output=True)
+        _cert_files = cert_file, key_file
+    return _cert_files
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Enables keep-alive connections
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.stand_in.count_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond()
+
+    do_POST = do_PUT = do_DELETE = do_HEAD = do_GET
+
+    def respond(self):
+        stand_in = self.server.stand_in
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length:
+            self.rfile.read(content_length)
+
+        host = self.headers.get('Host', '').split(':')[0]
+        url = 'https://{}{}'.format(host, self.path)
+        stand_in.register_request(self.command, url)
+
+        error = stand_in.pop_error(url)
+        if error == RESET:
+            self.close_connection = True
+            return
+        if error:
+            status, reason, headers, body = error, None, {}, b''
+        else:
+            status, reason, headers, body = stand_in.find_response(self.command, url)
+
+        if stand_in.delay:
+            time.sleep(stand_in.delay)
+        self.send_response(status, reason)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        chunk_size = stand_in.chunk_size
+        if chunk_size:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+
+        if chunk_size:
+            for i in range(0, len(body), chunk_size):
+                chunk = body[i:i + chunk_size]
+                self.wfile.write(b'%X\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.flush()
+                if stand_in.chunk_delay:
+                    time.sleep(stand_in.chunk_delay)
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.wfile.write(body)
+
+
+class LocalItvServer:
+    """A threaded HTTP(S) server on 127.0.0.1 that serves recorded responses.
+
+    `delay` is the time in seconds before the response is sent. If
+    `chunk_size` is given, bodies are sent using chunked transfer encoding,
+    with `chunk_delay` seconds between chunks. These can be changed while
+    the server is running.
+
+    """
+    def __init__(self, recordings_dir=None, tls=True, delay=0.0, chunk_size=None, chunk_delay=0.0):
+        self.recordings = fetch._Recordings(recordings_dir or doc_path(''))
+        self.tls = tls
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.cert_file = None
+        self.requests = []
+        self.connections = 0
+        self._errors = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def url(self):
+        return '{}://127.0.0.1:{}'.format('https' if self.tls else 'http', self.port)
+
+    def start(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        server.daemon_threads = True
+        server.stand_in = self
+        if self.tls:
+            hosts = {urlsplit(key.split(' ', 1)[1]).hostname for key in self.recordings.responses}
+            self.cert_file, key_file = _create_certificate(hosts)
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ctx.load_cert_chain(self.cert_file, key_file)
+            server.socket = ctx.wrap_socket(server.socket, server_side=True)
+        self._server = server
+        self._thread = threading.Thread(target=server.serve_forever, name='local-itv-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def inject_error(self, url_pattern, error, count=1):
+        """Respond to the next `count` requests to URLs matching the shell-style
+        `url_pattern` with HTTP status `error`, or close the connection without
+        response if `error` is RESET.
+
+        """
+        with self._lock:
+            self._errors.append([url_pattern, error, count])
+
+    def pop_error(self, url):
+        with self._lock:
+            for error in self._errors:
+                if fnmatch.fnmatchcase(url, error[0]):
+                    error[2] -= 1
+                    if error[2] <= 0:
+                        self._errors.remove(error)
+                    return error[1]
+        return None
+
+    def register_request(self, method, url):
+        with self._lock:
+            self.requests.append((method, url))
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = []
+            self.connections = 0
+
+    def find_response(self, method, url):
+        """Return a tuple (status, reason, headers, body) of the recorded response to the request."""
+        recordings = self.recordings
+        entry = recordings.find(method, url)
+        if entry is None and urlsplit(url).hostname in ('127.0.0.1', 'localhost'):
+            path = urlsplit(url).path.rstrip('/')
+            entry = next((entry for key, entry in recordings.responses.items()
+                          if key.startswith(method + ' ') and urlsplit(key.split(' ', 1)[1]).path == path),
+                         None)
+        if entry is None:
+            return 404, 'Not Found', {}, b''
+        return entry['status'], entry.get('reason'), entry.get('headers', {}), recordings.read_body(entry)
+
+    @contextmanager
+    def redirect(self):
+        """Connect all requests of the HttpSession to this server, even within local tests.
+
+        The server's certificate is made the CA bundle of requests, so it's
+        trusted for all hosts. HttpSession's current connections are closed
+        before and after, so no connection to another server is reused.
+
+        """
+        create_connection = urllib3_connection.create_connection
+
+        def connect_local(address, *args, **kwargs):
+            return create_connection(('127.0.0.1', self.port), *args, **kwargs)
+
+        fetch.close_session()
+        try:
+            with patch('urllib3.util.connection.create_connection', new=connect_local), \
+                    patch('requests.sessions.Session.send', new=fixtures.real_session_send), \
+                    patch.dict(os.environ, {'REQUESTS_CA_BUNDLE': self.cert_file or ''}):
+                yield self
+        finally:
+            fetch.close_session()
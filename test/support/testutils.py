@@ -87,11 +87,14 @@ class HttpResponse(Response):
             self.reason = reason
         if content is not None:
             self._content = content
+            # Allows iter_content() to iterate over content, like on a response that has been read.
+            self._content_consumed = True
             if status_code is None:
                 self.status_code = 200
                 self.reason = 'OK'
         elif text is not None:
             self._content = text.encode('utf8')
+            self._content_consumed = True
             if status_code is None:
                 self.status_code = 200
                 self.reason = 'OK'